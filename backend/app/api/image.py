@@ -3,6 +3,8 @@ from __future__ import annotations
 from fastapi import APIRouter, Depends, HTTPException, status
 
 from ..dependencies import require_auth
+from ..events import events
+from ..media.scene import MODE_FIXED, get_controller, schedule_all, stop_all
 from ..schemas.image import (
     ImageAdjustmentRequest,
     ImageBLCRequest,
@@ -14,11 +16,31 @@ from ..schemas.image import (
     ImageVideoAdjustmentRequest,
     ImageWhiteBalanceRequest,
 )
-from ..state import state
+from ..state import bump_revision, state
+from .video import refresh_pipelines
 
 router = APIRouter(prefix="/cgi-bin/entry.cgi", tags=["image"])
 
 
+async def on_startup():
+    """
+    定时模式的昼夜切换按时间触发，不依赖码流是否在运行
+    """
+    schedule_all()
+
+
+async def on_shutdown():
+    stop_all()
+
+
+def _apply_image() -> None:
+    """
+    图像参数、旋转翻转或场景切换后让 ISP、降噪阶段重新配置，解码源按需重启，并按需切换各码流的管线
+    """
+    bump_revision("isp")
+    refresh_pipelines()
+
+
 def _get_image(cam_id: int) -> dict:
     config = state.image_config.get(cam_id)
     if config is None:
@@ -40,43 +62,67 @@ def get_image_config(cam_id: int, _: str = Depends(require_auth)) -> ImageConfig
 
 
 @router.post("/image/{cam_id}", response_model=ImageConfig)
-def set_image_config(cam_id: int, payload: ImageConfig, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_image_config(cam_id: int, payload: ImageConfig, _: str = Depends(require_auth)) -> ImageConfig:
     state.image_config[cam_id] = payload.model_dump()
+    get_controller(cam_id).schedule()
+    _apply_image()
     return ImageConfig(**state.image_config[cam_id])
 
 
+@router.get("/image/{cam_id}/scene")
+def get_image_scene(cam_id: int, _: str = Depends(require_auth)):
+    """
+    昼夜切换的当前状态和最近的切换记录
+    """
+    _get_image(cam_id)
+    return {
+        **get_controller(cam_id).stats(),
+        "events": [event for event in events.recent("scene") if event["data"]["cam_id"] == cam_id],
+    }
+
+
 @router.put("/image/{cam_id}/scene")
-def set_image_scene(cam_id: int, payload: ImageSceneRequest, _: str = Depends(require_auth)):
+async def set_image_scene(cam_id: int, payload: ImageSceneRequest, _: str = Depends(require_auth)):
     config = _get_image(cam_id)
     config["nightToDay"]["iProfile"] = payload.iProfile
+    _apply_image()
     return {"status": 1, "message": "Scene updated"}
 
 
 @router.put("/image/{cam_id}/video-adjustment", response_model=ImageConfig)
-def set_video_adjustment(cam_id: int, payload: ImageVideoAdjustmentRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_video_adjustment(cam_id: int, payload: ImageVideoAdjustmentRequest, _: str = Depends(require_auth)) -> ImageConfig:
     config = _get_image(cam_id)
     config["videoAdjustment"] = payload.model_dump()
+    _apply_image()
     return ImageConfig(**config)
 
 
 @router.put("/image/{cam_id}/night-to-day", response_model=ImageConfig)
-def set_night_to_day(cam_id: int, payload: ImageNightToDayRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_night_to_day(cam_id: int, payload: ImageNightToDayRequest, _: str = Depends(require_auth)) -> ImageConfig:
     config = _get_image(cam_id)
     config["nightToDay"] = payload.model_dump()
+    if payload.iMode == MODE_FIXED:
+        config["nightToDay"]["iProfileCur"] = payload.iProfileSelect
+    controller = get_controller(cam_id)
+    controller.reset()
+    controller.schedule()
+    _apply_image()
     return ImageConfig(**config)
 
 
 @router.put("/image/{cam_id}/{scene_id}/adjustment", response_model=ImageConfig)
-def set_adjustment(cam_id: int, scene_id: int, payload: ImageAdjustmentRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_adjustment(cam_id: int, scene_id: int, payload: ImageAdjustmentRequest, _: str = Depends(require_auth)) -> ImageConfig:
     profile = _get_profile(cam_id, scene_id)
     profile["imageAdjustment"] = payload.model_dump()
+    _apply_image()
     return ImageConfig(**_get_image(cam_id))
 
 
 @router.put("/image/{cam_id}/{scene_id}/exposure", response_model=ImageConfig)
-def set_exposure(cam_id: int, scene_id: int, payload: ImageExposureRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_exposure(cam_id: int, scene_id: int, payload: ImageExposureRequest, _: str = Depends(require_auth)) -> ImageConfig:
     profile = _get_profile(cam_id, scene_id)
     profile["exposure"] = payload.model_dump()
+    _apply_image()
     return ImageConfig(**_get_image(cam_id))
 
 
@@ -88,14 +134,16 @@ def set_blc(cam_id: int, scene_id: int, payload: ImageBLCRequest, _: str = Depen
 
 
 @router.put("/image/{cam_id}/{scene_id}/white-blance", response_model=ImageConfig)
-def set_white_balance(cam_id: int, scene_id: int, payload: ImageWhiteBalanceRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_white_balance(cam_id: int, scene_id: int, payload: ImageWhiteBalanceRequest, _: str = Depends(require_auth)) -> ImageConfig:
     profile = _get_profile(cam_id, scene_id)
     profile["whiteBlance"] = payload.model_dump()
+    _apply_image()
     return ImageConfig(**_get_image(cam_id))
 
 
 @router.put("/image/{cam_id}/{scene_id}/enhancement", response_model=ImageConfig)
-def set_enhancement(cam_id: int, scene_id: int, payload: ImageEnhancementRequest, _: str = Depends(require_auth)) -> ImageConfig:
+async def set_enhancement(cam_id: int, scene_id: int, payload: ImageEnhancementRequest, _: str = Depends(require_auth)) -> ImageConfig:
     profile = _get_profile(cam_id, scene_id)
     profile["imageEnhancement"] = payload.model_dump()
+    _apply_image()
     return ImageConfig(**_get_image(cam_id))
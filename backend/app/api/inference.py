@@ -5,10 +5,16 @@ import secrets
 from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import JSONResponse
 
 from ..dependencies import require_auth
+from ..media.decode import QueueClosed
+from ..media.inference import engine
+from ..media.notify import notifier
+from ..media.results import BINARY_SUBPROTOCOL, encode_binary, hub
+from ..media.rules import record_rules
+from ..media.template import DEFAULT_DETECTION_TEMPLATE, NotifyTemplates, TemplateError, notify_templates
 from ..schemas.inference import (
     AlgorithmSupport,
     InferenceConfig,
@@ -17,10 +23,22 @@ from ..schemas.inference import (
     ModelListItem,
     NotifyConfig,
 )
-from ..state import state
+from ..state import bump_revision, state
+from .video import VIDEO_PATHS, open_frame_bus
 
 router = APIRouter(prefix="/cgi-bin/entry.cgi", tags=["inference"])
 
+# 推理使用主码流的画面
+INFERENCE_STREAM = 0
+
+
+async def on_shutdown():
+    """
+    停止推理进程和结果输出
+    """
+    notifier.stop()
+    engine.stop()
+
 
 # ============= 模型管理 =============
 
@@ -145,40 +163,75 @@ def get_algorithm_support(_: str = Depends(require_auth)) -> AlgorithmSupport:
 
 # ============= 推理管理 =============
 
+def _inference_status() -> dict:
+    if "inference_status" not in state.__dict__:
+        state.inference_status = {
+            "iEnable": 0,
+            "sStatus": "stop",
+            "sModel": next(iter(state.model_configs), ""),
+            "iFPS": state.inference_config.get("iFPS", 10),
+        }
+    return state.inference_status
+
+
 @router.get("/model/inference", response_model=InferenceStatus)
 def get_inference_status(
     id: int = Query(0),
     _: str = Depends(require_auth),
 ) -> InferenceStatus:
     """获取推理状态"""
-    # 从 state 获取推理状态
-    if "inference_status" not in state.__dict__:
-        state.inference_status = {
-            "iEnable": 1,
-            "sStatus": "running",
-            "sModel": "yolov5.rknn",
-            "iFPS": 30,
-        }
-    return InferenceStatus(**state.inference_status)
+    current = dict(_inference_status())
+    if current["iEnable"]:
+        stats = engine.stats()
+        latency = stats["latency_ms"]
+        current.update(
+            sStatus=engine.status,
+            sBackend=stats["backend"],
+            fMeasuredFPS=stats["measured_fps"],
+            dLatency={
+                "fPreprocess": latency["preprocess"],
+                "fInference": latency["inference"],
+                "fPostprocess": latency["postprocess"],
+                "fTotal": latency["total"],
+            },
+        )
+    return InferenceStatus(**current)
 
 
 @router.post("/model/inference", response_model=InferenceStatus)
-def set_inference_config(
+async def set_inference_config(
     payload: InferenceConfig,
     id: int = Query(0),
     _: str = Depends(require_auth),
 ) -> InferenceStatus:
     """推理配置"""
-    # 更新推理配置
     state.inference_status = {
         "iEnable": payload.iEnable,
         "sStatus": "running" if payload.iEnable == 1 else "stop",
         "sModel": payload.sModel,
         "iFPS": payload.iFPS,
     }
+    engine.configure(
+        payload.iEnable == 1,
+        payload.sModel,
+        payload.iFPS,
+        state.model_configs.get(payload.sModel, {}).get("dConfig", {}),
+        lambda: open_frame_bus(INFERENCE_STREAM, VIDEO_PATHS[INFERENCE_STREAM]),
+    )
     return InferenceStatus(**state.inference_status)
 
 
+@router.get("/model/inference/stats")
+def get_inference_stats(_: str = Depends(require_auth)) -> dict:
+    """推理引擎、结果订阅者（各订阅者的积压和丢弃数）、结果输出和录制规则的统计"""
+    return {
+        "engine": engine.stats(),
+        "results": hub.stats(),
+        "notify": notifier.stats(),
+        "record_rules": record_rules.stats(),
+    }
+
+
 # ============= 推理输出配置 =============
 
 @router.get("/notify/cfg", response_model=NotifyConfig)
@@ -189,7 +242,7 @@ def get_notify_config(_: str = Depends(require_auth)) -> NotifyConfig:
         state.notify_config = {
             "iMode": 1,
             "dTemplate": {
-                "sDetection": "{timestamp}: 检测到 {class} 置信度 {confidence} 位置 ({x1},{y1},{x2},{y2})",
+                "sDetection": DEFAULT_DETECTION_TEMPLATE,
                 "sClassification": "",
                 "sSegmentation": "",
                 "sTracking": "",
@@ -216,12 +269,23 @@ def get_notify_config(_: str = Depends(require_auth)) -> NotifyConfig:
 
 
 @router.post("/notify/cfg", response_model=NotifyConfig)
-def set_notify_config(
+async def set_notify_config(
     payload: NotifyConfig,
     _: str = Depends(require_auth),
 ) -> NotifyConfig:
-    """推理输出配置"""
-    state.notify_config = payload.model_dump()
+    """推理输出配置，模板在这里编译并校验字段，按输出方式启动对应的输出"""
+    config = payload.model_dump()
+    # 模板先编译，模板错误时不重启任何输出
+    try:
+        NotifyTemplates(payload.dTemplate.model_dump())
+    except TemplateError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"输出模板错误: {exc}")
+    try:
+        notifier.configure(config)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    state.notify_config = config
+    bump_revision("notify")
     return NotifyConfig(**state.notify_config)
 
 
@@ -229,35 +293,30 @@ def set_notify_config(
 
 @router.websocket("/ws/inference/results")
 async def ws_inference_results(websocket: WebSocket):
-    """推理结果输出"""
-    await websocket.accept()
+    """
+    推理结果输出
+    默认每个检测目标按模板输出一行文本；请求 recamera.results.v1 子协议时每帧发送一条二进制消息
+    """
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+    client = websocket.client
+    name = f"websocket {client.host}:{client.port}" if client else "websocket"
+    subscription = hub.subscribe(f"{name} (binary)" if binary else name)
     try:
         while True:
-            # 获取模板
-            if "notify_config" in state.__dict__:
-                template = state.notify_config.get("dTemplate", {}).get(
-                    "sDetection",
-                    "{timestamp}: 检测到 {class} 置信度 {confidence} 位置 ({x1},{y1},{x2},{y2})",
-                )
-            else:
-                template = "{timestamp}: 检测到 {class} 置信度 {confidence} 位置 ({x1},{y1},{x2},{y2})"
-            
-            # 模拟推理结果
-            template_vars = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "class": "person",
-                "confidence": "0.85",
-                "x1": 120,
-                "y1": 80,
-                "x2": 250,
-                "y2": 300,
-            }
-            
-            message = template.format(**template_vars)
-            await websocket.send_text(message)
-            await asyncio.sleep(1)
-    except WebSocketDisconnect:
+            result = await subscription.get()
+            if binary:
+                await websocket.send_bytes(encode_binary(result))
+                continue
+            template = notify_templates().detection
+            if template is None:
+                continue
+            for line in template.render(result):
+                await websocket.send_text(line)
+    except (WebSocketDisconnect, QueueClosed):
         return
+    finally:
+        subscription.close()
 
 
 @router.websocket("/ws/system/logs")
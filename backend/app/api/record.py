@@ -1,24 +1,87 @@
 from __future__ import annotations
 
+import logging
+import time
+from functools import partial
 from typing import List, Optional
 import os
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
 from fastapi.responses import Response, FileResponse, JSONResponse
 
 from ..dependencies import require_auth
+from ..filetree import FileTree
+from ..media.recorder import recorder
+from ..media.rules import record_rules
+from ..media.session import PIPELINE_RELAY, PIPELINE_TRANSCODE
+from ..media.schedule import weekly_schedule
+from ..media.triggers import trigger_sources
 from ..schemas.record import (
     RecordRuleConfig,
     RuleConfig,
+    ScheduleStatus,
     ScheduleTimeRange,
     StorageConfig,
     StorageControl,
     StorageStatus,
 )
-from ..state import state
+from ..state import bump_revision, state
+from .video import VIDEO_PATHS, open_encoded, select_pipeline
 
 router = APIRouter(prefix="/cgi-bin/entry.cgi", tags=["record"])
+logger = logging.getLogger(__name__)
+
+
+def _open_recording(stream_id: int, video_path: str):
+    """
+    录制用的已编码码流：和 WebRTC 连接共用直通或共享编码，逐连接编码模式下也用共享编码
+    """
+    pipeline = select_pipeline(stream_id, video_path, True)
+    if pipeline == PIPELINE_TRANSCODE:
+        pipeline = PIPELINE_RELAY
+    return open_encoded(stream_id, video_path, pipeline)
+
+
+def _apply_recorder(rule_config: dict) -> None:
+    sources = {
+        stream_id: partial(_open_recording, stream_id, video_path)
+        for stream_id, video_path in VIDEO_PATHS.items()
+        if Path(video_path).exists()
+    }
+    recorder.configure(rule_config, sources)
+
+
+async def on_startup():
+    """
+    按当前录制规则启动推理规则判断或定时、GPIO、TTY 触发源，以及录制服务
+    """
+    try:
+        record_rules.configure(state.rule_config, state.record_rule_config)
+        trigger_sources.configure(state.rule_config, state.record_rule_config)
+        _apply_recorder(state.rule_config)
+    except ValueError as exc:
+        logger.error(f"录制规则无效: {exc}")
+
+
+async def on_shutdown():
+    record_rules.stop()
+    trigger_sources.stop()
+    recorder.stop(wait=True)
+
+
+def _apply_rules(rule_config: dict, record_rule_config: dict) -> None:
+    """
+    先编译推理规则、启动新的触发源，都成功后才替换正在运行的规则；
+    任何一步失败都返回 400，运行中的规则和触发源保持原样，与保存的配置一致
+    """
+    try:
+        rules = record_rules.compile(rule_config, record_rule_config)
+        trigger_sources.configure(rule_config, record_rule_config)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    record_rules.apply(rules)
+    _apply_recorder(rule_config)
 
 
 # 1. 全局规则配置 (General Rule Configuration)
@@ -28,7 +91,8 @@ def get_rule_config(_: str = Depends(require_auth)) -> RuleConfig:
 
 
 @router.post("/vigil/rule/config", response_model=RuleConfig)
-def set_rule_config(payload: RuleConfig, _: str = Depends(require_auth)) -> RuleConfig:
+async def set_rule_config(payload: RuleConfig, _: str = Depends(require_auth)) -> RuleConfig:
+    _apply_rules(payload.model_dump(), state.record_rule_config)
     state.rule_config = payload.model_dump()
     return RuleConfig(**state.rule_config)
 
@@ -43,10 +107,22 @@ def get_schedule_rule_config(_: str = Depends(require_auth)) -> List[ScheduleTim
 def set_schedule_rule_config(
     payload: List[ScheduleTimeRange], _: str = Depends(require_auth)
 ) -> List[ScheduleTimeRange]:
+    """计划规则配置，保存后编译为每周区间索引"""
     state.schedule_rule_config = [item.model_dump() for item in payload]
+    bump_revision("schedule")
+    weekly_schedule()
     return [ScheduleTimeRange(**item) for item in state.schedule_rule_config]
 
 
+@router.get("/vigil/rule/schedule-rule-status", response_model=ScheduleStatus)
+def get_schedule_rule_status(
+    iTimestamp: Optional[int] = Query(None, description="查询时刻，默认为当前时间"),
+    _: str = Depends(require_auth),
+) -> ScheduleStatus:
+    """查询某一时刻是否在计划内、下一次切换时间和合并后的区间，供时间轴显示"""
+    return ScheduleStatus(**weekly_schedule().query(time.time() if iTimestamp is None else iTimestamp))
+
+
 # 3. 录制规则配置 (Record Rule Configuration)
 @router.get("/vigil/rule/record-rule-config", response_model=RecordRuleConfig)
 def get_record_rule_config(_: str = Depends(require_auth)) -> RecordRuleConfig:
@@ -54,13 +130,25 @@ def get_record_rule_config(_: str = Depends(require_auth)) -> RecordRuleConfig:
 
 
 @router.post("/vigil/rule/record-rule-config", response_model=RecordRuleConfig)
-def set_record_rule_config(
+async def set_record_rule_config(
     payload: RecordRuleConfig, _: str = Depends(require_auth)
 ) -> RecordRuleConfig:
+    """录制规则配置，推理规则在这里编译，多边形或置信度范围无效、触发设备无法打开时返回 400"""
+    _apply_rules(state.rule_config, payload.model_dump())
     state.record_rule_config = payload.model_dump()
     return RecordRuleConfig(**state.record_rule_config)
 
 
+@router.get("/vigil/record/stats")
+def get_record_stats(_: str = Depends(require_auth)) -> dict:
+    """录制服务（预录缓存、写入线程积压和丢弃）、触发源和推理规则的统计"""
+    return {
+        "recorder": recorder.stats(),
+        "triggers": trigger_sources.stats(),
+        "record_rules": record_rules.stats(),
+    }
+
+
 # 4. 存储配置 (Storage Configuration)
 @router.get("/vigil/storage/config", response_model=StorageConfig)
 def get_storage_config(_: str = Depends(require_auth)) -> StorageConfig:
@@ -68,10 +156,12 @@ def get_storage_config(_: str = Depends(require_auth)) -> StorageConfig:
 
 
 @router.post("/vigil/storage/config", response_model=StorageConfig)
-def set_storage_config(
+async def set_storage_config(
     payload: StorageConfig, _: str = Depends(require_auth)
 ) -> StorageConfig:
+    """切换启用的存储槽位，录制中的文件在当前槽位写完，之后的录制写入新槽位"""
     state.storage_config = payload.model_dump()
+    _apply_recorder(state.rule_config)
     return StorageConfig(**state.storage_config)
 
 
@@ -83,7 +173,7 @@ def get_storage_status(_: str = Depends(require_auth)) -> StorageStatus:
 
 # 6. 存储控制 (Storage Control)
 @router.post("/vigil/storage/control")
-def storage_control(payload: StorageControl, _: str = Depends(require_auth)) -> dict:
+async def storage_control(payload: StorageControl, _: str = Depends(require_auth)) -> dict:
     """
     对存储系统执行操作
     支持的操作: format, free_up, eject, config, relay, unrelay
@@ -129,6 +219,8 @@ def storage_control(payload: StorageControl, _: str = Depends(require_auth)) ->
         slots[slot_index]["eState"] = 4  # NotMounted
         slots[slot_index]["sState"] = "NotMounted"
         state.storage_status["iRevision"] += 1
+        # 弹出启用的槽位后停止录制
+        _apply_recorder(state.rule_config)
         return {"code": 0, "sMessage": "Eject operation completed"}
     
     elif action == "config":
@@ -192,27 +284,12 @@ def storage_control(payload: StorageControl, _: str = Depends(require_auth)) ->
             return {"code": 22, "sMessage": "No files specified for removal"}
         
         removed_files = []
-        filesystem = state.mock_filesystems.get(slot_name, {})
+        filesystem = state.mock_filesystems.get(slot_name, FileTree())
         
         for file_path in payload.lFilesOrDirectoriesToRemove:
-            # 移除文件
-            if file_path in filesystem:
-                del filesystem[file_path]
+            # 移除文件，或文件夹及其所有子文件
+            if filesystem.remove_tree(file_path):
                 removed_files.append(file_path)
-            else:
-                # 尝试移除文件夹（及其所有子文件）
-                folder_removed = False
-                keys_to_remove = []
-                for key in filesystem.keys():
-                    if key.startswith(file_path + "/") or key == file_path:
-                        keys_to_remove.append(key)
-                        folder_removed = True
-                
-                for key in keys_to_remove:
-                    del filesystem[key]
-                
-                if folder_removed:
-                    removed_files.append(file_path)
         
         state.storage_status["iRevision"] += 1
         return {
@@ -240,7 +317,7 @@ async def get_file_list(relay_uuid: str, path: str = "", request: Request = None
         )
     
     device_path = state.relay_mappings[relay_uuid]
-    filesystem = state.mock_filesystems.get(device_path, {})
+    filesystem = state.mock_filesystems.get(device_path, FileTree())
     
     # 如果path为空，列出根目录
     if not path:
@@ -281,37 +358,8 @@ async def get_file_list(relay_uuid: str, path: str = "", request: Request = None
                 }
             )
     
-    # 列出目录内容
-    file_list = []
-    
-    # 如果是根目录，列出所有顶级文件夹
-    if path == state.storage_status.get("sDataDirName", "DCIM"):
-        seen_dirs = set()
-        for file_path in filesystem.keys():
-            if file_path.startswith(path + "/"):
-                # 提取第一级目录或文件
-                relative_path = file_path[len(path)+1:]
-                first_part = relative_path.split("/")[0]
-                
-                if "/" in relative_path:
-                    # 这是一个子目录
-                    if first_part not in seen_dirs:
-                        seen_dirs.add(first_part)
-                        # 获取目录信息
-                        dir_path = f"{path}/{first_part}"
-                        if dir_path in filesystem:
-                            file_list.append(filesystem[dir_path])
-                else:
-                    # 这是一个文件
-                    file_list.append(filesystem[file_path])
-    else:
-        # 列出指定目录下的文件
-        for file_path in filesystem.keys():
-            if file_path.startswith(path + "/"):
-                relative_path = file_path[len(path)+1:]
-                # 只列出直接子文件/文件夹
-                if "/" not in relative_path:
-                    file_list.append(filesystem[file_path])
+    # 列出目录内容：只访问该目录的子条目，最新的在前
+    file_list = filesystem.list(path)
     
     return JSONResponse(content=file_list)
 
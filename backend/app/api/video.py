@@ -1,22 +1,35 @@
 from __future__ import annotations
 
 import asyncio
-import cv2
-import time
 import logging
-from typing import Dict, Set
+import time
+from typing import Dict, Optional, Set, Tuple
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, VideoStreamTrack
-from aiortc.contrib.media import MediaPlayer
-from av import VideoFrame
-import numpy as np
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 from ..dependencies import require_auth
+from ..media.adapt import AdaptationController
+from ..media.decode import parse_resolution
+from ..media.geometry import FLIP_NONE, is_identity
+from ..media.passthrough import passthrough_allowed, passthroughs, probe_video
+from ..media.recorder import recorder
+from ..media.relay import bind_sender, encoders, h264_preferences, offers_h264, rendition_settings
+from ..media.session import (
+    PIPELINE_PASSTHROUGH,
+    PIPELINE_RELAY,
+    PIPELINE_TRANSCODE,
+    LatencyStats,
+    PeerSession,
+    peer_stats,
+    watch_first_packet,
+)
+from ..media.source import BusSubscription, SubscriberTrack, sources
+from ..media.stages import MAIN_STREAM, get_pipeline
 from ..schemas.video import (
     EncodeSettings,
     OSDCharSettings,
@@ -27,112 +40,31 @@ from ..schemas.video import (
     StreamUpdateRequest,
     WebRTCOffer,
     WebRTCAnswer,
+    WebRTCConfig,
 )
-from ..state import state
+from ..state import bump_revision, state
 
 router = APIRouter(prefix="/cgi-bin/entry.cgi", tags=["video"])
 
 # 全局变量存储 peer connections
 pcs: Set[RTCPeerConnection] = set()
+# 每个连接的视频发送状态
+sessions: Dict[RTCPeerConnection, PeerSession] = {}
 
 # 视频文件路径
 MAIN_VIDEO_PATH = "/home/dq/github/RC2Web/test/people-walking.mp4"
 SUB_VIDEO_PATH = "/home/dq/github/RC2Web/test/car_identify.mp4"
+VIDEO_PATHS = {0: MAIN_VIDEO_PATH, 1: SUB_VIDEO_PATH}
 
+# 各路码流从收到 offer 到发出第一个 RTP 包的耗时
+first_packet_stats: Dict[int, LatencyStats] = {stream_id: LatencyStats() for stream_id in VIDEO_PATHS}
 
-class LocalVideoTrack(VideoStreamTrack):
+
+async def on_startup():
     """
-    从本地视频文件读取帧并通过 WebRTC 传输的视频轨道
+    预热各路码流
     """
-    
-    def __init__(self, video_path: str):
-        super().__init__()
-        self.video_path = video_path
-        self.cap = None
-        self.fps = 30
-        self._start_time = None
-        self._frame_count = 0
-        self._last_frame_time = None
-        
-    async def recv(self):
-        """
-        接收并返回视频帧
-        """
-        if self.cap is None:
-            # 初始化视频捕获
-            self.cap = cv2.VideoCapture(self.video_path)
-            if not self.cap.isOpened():
-                logger.error(f"无法打开视频文件: {self.video_path}")
-                raise RuntimeError(f"无法打开视频文件: {self.video_path}")
-            
-            # 获取视频信息
-            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
-            total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            
-            logger.info(f"视频已打开: {self.video_path}")
-            logger.info(f"分辨率: {width}x{height}, FPS: {self.fps}, 总帧数: {total_frames}")
-            
-            self._start_time = time.time()
-            self._last_frame_time = self._start_time
-        
-        # 计算帧率控制
-        current_time = time.time()
-        if self._frame_count > 0:
-            elapsed_time = current_time - self._start_time
-            expected_frame_time = self._frame_count / self.fps
-            sleep_time = expected_frame_time - elapsed_time
-            
-            if sleep_time > 0:
-                await asyncio.sleep(sleep_time)
-        
-        # 计算时间戳
-        pts, time_base = await self.next_timestamp()
-        
-        # 读取一帧
-        ret, frame = self.cap.read()
-        
-        # 如果视频结束，循环播放
-        if not ret:
-            logger.info("视频播放完毕，重新开始循环播放")
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            self._frame_count = 0
-            self._start_time = time.time()
-            ret, frame = self.cap.read()
-            
-        if not ret:
-            logger.error("无法读取视频帧")
-            raise RuntimeError("无法读取视频帧")
-        
-        # 将 BGR 转换为 RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # 创建 VideoFrame
-        new_frame = VideoFrame.from_ndarray(frame, format="rgb24")
-        new_frame.pts = pts
-        new_frame.time_base = time_base
-        
-        self._frame_count += 1
-        self._last_frame_time = time.time()
-        
-        return new_frame
-    
-    def stop(self):
-        """
-        停止视频轨道并释放资源
-        """
-        super().stop()
-        if self.cap is not None:
-            self.cap.release()
-            logger.info(f"视频资源已释放: {self.video_path}")
-    
-    def __del__(self):
-        """
-        清理资源
-        """
-        if self.cap is not None:
-            self.cap.release()
+    _prewarm()
 
 
 async def on_shutdown():
@@ -142,6 +74,200 @@ async def on_shutdown():
     coros = [pc.close() for pc in pcs]
     await asyncio.gather(*coros)
     pcs.clear()
+    sessions.clear()
+    passthroughs.shutdown()
+    encoders.shutdown()
+    sources.shutdown()
+
+
+def _geometry() -> Tuple[int, str]:
+    """
+    摄像头的旋转角度和翻转方式，两路码流共用
+    """
+    adjustment = state.image_config.get(0, {}).get("videoAdjustment", {})
+    return adjustment.get("iImageRotation", 0), adjustment.get("sImageFlip", FLIP_NONE)
+
+
+def _source_format(stream_id: int) -> Tuple[Optional[Tuple[int, int]], Optional[float], Tuple[int, str]]:
+    """
+    解码源的输出分辨率和帧率（取自编码参数），以及旋转翻转
+    """
+    encode = _get_stream(stream_id).get("encode", {})
+    frame_rate = float(encode.get("sFrameRate") or 0) or None
+    return parse_resolution(encode.get("sResolution")), frame_rate, _geometry()
+
+
+def _source_options(stream_id: int) -> Dict:
+    output_size, frame_rate, geometry = _source_format(stream_id)
+    return {
+        "queue_size": state.webrtc_config["iDecodeQueueSize"],
+        "drop_policy": state.webrtc_config["sDecodeDropPolicy"],
+        "output_size": output_size,
+        "frame_rate": frame_rate,
+        "pipeline": get_pipeline(stream_id),
+        "geometry": geometry,
+    }
+
+
+def open_source(stream_id: int, video_path: str) -> SubscriberTrack:
+    """
+    订阅该码流的共享解码源，多个连接共用同一个解码器
+    """
+    return sources.subscribe(stream_id, video_path, **_source_options(stream_id))
+
+
+def open_frame_bus(stream_id: int, video_path: str) -> BusSubscription:
+    """
+    只订阅该码流解码源的帧总线（推理等），保持解码源运行但不做逐帧的颜色转换
+    """
+    return sources.subscribe_bus(stream_id, video_path, **_source_options(stream_id))
+
+
+def select_pipeline(stream_id: int, video_path: str, h264: bool) -> str:
+    """
+    直通模式直接转发 H.264 文件的数据包，编码参数要求降分辨率、帧率或码率，
+    或者需要旋转翻转、有启用的帧处理阶段（遮挡、OSD 等）时改用共享编码；
+    共享编码模式下整路码流只编码一次，各连接只做 RTP 打包；对端不支持 H.264 时退回逐连接编码
+    """
+    mode = state.webrtc_config["sRelayMode"]
+    if not h264 or mode == PIPELINE_TRANSCODE:
+        return PIPELINE_TRANSCODE
+    if (
+        mode == PIPELINE_PASSTHROUGH
+        and not get_pipeline(stream_id).active
+        and is_identity(*_geometry())
+        and passthrough_allowed(video_path, _get_stream(stream_id)["encode"])
+    ):
+        return PIPELINE_PASSTHROUGH
+    return PIPELINE_RELAY
+
+
+def open_encoded(stream_id: int, video_path: str, pipeline: str, level: int = 0):
+    """
+    已编码码流：第 0 档按管线直通或共享编码，更低的档位总是由共享编码器缩放后编码
+    """
+    if pipeline == PIPELINE_PASSTHROUGH and level == 0:
+        return passthroughs.open(stream_id, video_path)
+    return encoders.open(
+        stream_id, _get_stream(stream_id)["encode"], lambda: open_source(stream_id, video_path), level
+    )
+
+
+def _create_controller(session: PeerSession) -> Optional[AdaptationController]:
+    """
+    为连接创建码率自适应控制器，每个连接独立在各档之间切换
+    """
+    levels = int(state.webrtc_config.get("iAdaptiveLevels", 1))
+    if levels <= 1:
+        return None
+    return AdaptationController(
+        session.track,
+        levels,
+        lambda level: rendition_settings(_get_stream(session.stream_id)["encode"], level)["iMaxRate"],
+        lambda level: open_encoded(session.stream_id, session.video_path, session.pipeline, level),
+    )
+
+
+def _peer_count(stream_id: int) -> int:
+    return sum(1 for session in sessions.values() if session.stream_id == stream_id)
+
+
+def _admit(stream_id: int) -> int:
+    """
+    检查连接数上限，返回实际提供的码流
+    总连接数已满时拒绝；该码流已满时按 sOverloadPolicy 拒绝，或降级到仍有余量的子码流
+    """
+    config = state.webrtc_config
+    if len(sessions) >= config["iMaxPeers"]:
+        logger.warning(f"WebRTC 连接数已达上限 {config['iMaxPeers']}，拒绝新连接")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="WebRTC 连接数已达上限",
+            headers={"Retry-After": "5"},
+        )
+    if _peer_count(stream_id) < config["iMaxPeersPerStream"]:
+        return stream_id
+    if config["sOverloadPolicy"] == "downgrade":
+        for candidate in VIDEO_PATHS:
+            if candidate > stream_id and _peer_count(candidate) < config["iMaxPeersPerStream"]:
+                logger.warning(f"码流 {stream_id} 连接数已满，新连接降级到码流 {candidate}")
+                return candidate
+    logger.warning(f"码流 {stream_id} 连接数已达上限 {config['iMaxPeersPerStream']}，拒绝新连接")
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"码流 {stream_id} 连接数已达上限",
+        headers={"Retry-After": "5"},
+    )
+
+
+def _prewarm() -> None:
+    """
+    让每路码流的第 0 档在没有连接时也保持运行并缓存最近的 GOP，
+    新连接省去打开文件、探测和等待关键帧的时间；不再需要预热的码流在没有连接时停止
+    """
+    enabled = bool(state.webrtc_config.get("iPrewarm", 0))
+    for stream_id, video_path in VIDEO_PATHS.items():
+        warm = None
+        if enabled and Path(video_path).exists():
+            pipeline = select_pipeline(stream_id, video_path, True)
+            if pipeline != PIPELINE_TRANSCODE:
+                warm = open_encoded(stream_id, video_path, pipeline)
+        for stream in [passthroughs.get(stream_id), *encoders.levels(stream_id)]:
+            if stream is None or stream is warm or not stream.keep_alive:
+                continue
+            stream.keep_alive = False
+            if stream.subscriber_count == 0:
+                stream.stop()
+        if warm is not None:
+            warm.keep_alive = True
+            if not warm.running:
+                warm.start()
+                logger.info(f"码流 {stream_id} 已预热")
+
+
+def _apply_encode(stream_id: int) -> None:
+    """
+    把编码参数应用到正在运行的管线：解码源按新分辨率和帧率重启，共享编码器重建，
+    直通和共享编码之间按需切换，已有连接都不需要重连
+    """
+    source = sources.get(stream_id)
+    if source is not None:
+        source.reconfigure(*_source_format(stream_id))
+    for encoder in encoders.levels(stream_id):
+        encoder.update_settings(_get_stream(stream_id)["encode"])
+    _reselect_pipelines(stream_id)
+
+
+def _reselect_pipelines(stream_id: int) -> None:
+    """
+    配置变化后重新选择直通或共享编码，已有连接按需切换，不需要重连
+    """
+    for session in list(sessions.values()):
+        if session.stream_id != stream_id or session.pipeline == PIPELINE_TRANSCODE:
+            continue
+        pipeline = select_pipeline(stream_id, session.video_path, True)
+        if pipeline == PIPELINE_TRANSCODE or pipeline == session.pipeline:
+            continue
+        logger.info(f"码流 {stream_id} 连接从 {session.pipeline} 切换到 {pipeline}")
+        session.pipeline = pipeline
+        # 已经降档的连接在回到第 0 档时才使用新的管线
+        if session.controller is None or session.controller.level == 0:
+            session.track.switch(open_encoded(stream_id, session.video_path, pipeline))
+    # 录制和连接一样离开旧的码流，之后预热才能停掉没有订阅者的直通码流
+    recorder.reselect(stream_id)
+    _prewarm()
+
+
+def refresh_pipelines() -> None:
+    """
+    帧处理阶段（遮挡、OSD、图像参数、旋转翻转等）的配置变化后调用：
+    解码源按新的旋转翻转重启，再按是否需要改动画面重新选择各码流的管线
+    """
+    for stream_id in VIDEO_PATHS:
+        source = sources.get(stream_id)
+        if source is not None:
+            source.reconfigure(*_source_format(stream_id))
+        _reselect_pipelines(stream_id)
 
 
 def _get_stream(stream_id: int) -> Dict[str, Dict]:
@@ -158,9 +284,10 @@ def get_encode(stream_id: int, _: str = Depends(require_auth)) -> EncodeSettings
 
 
 @router.put("/video/{stream_id}/encode", response_model=EncodeSettings)
-def update_encode(stream_id: int, payload: EncodeSettings, _: str = Depends(require_auth)) -> EncodeSettings:
+async def update_encode(stream_id: int, payload: EncodeSettings, _: str = Depends(require_auth)) -> EncodeSettings:
     stream = _get_stream(stream_id)
     stream["encode"] = payload.model_dump()
+    _apply_encode(stream_id)
     return EncodeSettings(**stream["encode"])
 
 
@@ -197,9 +324,11 @@ def get_osd_mask(stream_id: int, _: str = Depends(require_auth)) -> OSDMaskSetti
 
 
 @router.post("/video/{stream_id}/osd-mask", response_model=OSDMaskSettings)
-def update_osd_mask(stream_id: int, payload: OSDMaskSettings, _: str = Depends(require_auth)) -> OSDMaskSettings:
+async def update_osd_mask(stream_id: int, payload: OSDMaskSettings, _: str = Depends(require_auth)) -> OSDMaskSettings:
     stream = _get_stream(stream_id)
     stream["osd-mask"] = payload.model_dump()
+    bump_revision("mask")
+    _reselect_pipelines(stream_id)
     return OSDMaskSettings(**stream["osd-mask"])
 
 
@@ -228,7 +357,7 @@ def get_osd_config(_: str = Depends(require_auth)) -> OSDConfig:
 
 
 @router.post("/osd/cfg", response_model=OSDConfig)
-def update_osd_config(payload: OSDConfig, _: str = Depends(require_auth)) -> OSDConfig:
+async def update_osd_config(payload: OSDConfig, _: str = Depends(require_auth)) -> OSDConfig:
     """
     配置OSD绘制参数
     """
@@ -239,9 +368,12 @@ def update_osd_config(payload: OSDConfig, _: str = Depends(require_auth)) -> OSD
             detail="遮挡区域最多只能配置6个"
         )
     
-    # 保存配置到状态
+    # 保存配置到状态，OSD 阶段按修订号只重建受影响的文字块，遮挡阶段重新计算像素区域
     state.osd_config = payload.model_dump()
+    bump_revision("osd")
+    bump_revision("mask")
     logger.info(f"OSD 配置已更新: {state.osd_config}")
+    refresh_pipelines()
     
     return OSDConfig(**state.osd_config)
 
@@ -299,6 +431,7 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
     处理 WebRTC offer 并返回 answer
     stream_id: 0 为主码流，1 为子码流
     """
+    offer_at = time.monotonic()
     # 验证 stream_id
     if stream_id not in [0, 1]:
         raise HTTPException(
@@ -306,8 +439,12 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
             detail="stream_id 必须是 0（主码流）或 1（子码流）"
         )
     
+    # 准入控制：超出连接数上限时降级到子码流或拒绝
+    requested_stream_id = stream_id
+    stream_id = _admit(stream_id)
+    
     stream_type = "主码流" if stream_id == 0 else "子码流"
-    VIDEO_PATH = MAIN_VIDEO_PATH if stream_id == 0 else SUB_VIDEO_PATH
+    VIDEO_PATH = VIDEO_PATHS[stream_id]
     logger.info(f"收到 {stream_type} 的 WebRTC offer 请求")
     
     # 检查视频文件是否存在
@@ -325,8 +462,16 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
     
     logger.info(f"创建新的 WebRTC 连接（{stream_type}），当前活跃连接数: {len(pcs)}")
     
-    # 创建本地视频轨道
-    local_video = LocalVideoTrack(VIDEO_PATH)
+    pipeline = select_pipeline(stream_id, VIDEO_PATH, offers_h264(offer.sdp))
+    relay = pipeline != PIPELINE_TRANSCODE
+    if relay:
+        local_video = open_encoded(stream_id, VIDEO_PATH, pipeline).subscribe()
+    else:
+        local_video = open_source(stream_id, VIDEO_PATH)
+    session = PeerSession(pc, stream_id, VIDEO_PATH, pipeline, local_video, created_at=offer_at)
+    if stream_id != requested_stream_id:
+        session.downgraded_from = requested_stream_id
+    sessions[pc] = session
     
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
@@ -340,10 +485,12 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
             logger.warning(f"WebRTC 连接失败（{stream_type}）")
             await pc.close()
             pcs.discard(pc)
+            sessions.pop(pc, None)
             local_video.stop()
         elif pc.connectionState == "closed":
             logger.info(f"WebRTC 连接已关闭（{stream_type}）")
             pcs.discard(pc)
+            sessions.pop(pc, None)
             local_video.stop()
     
     @pc.on("iceconnectionstatechange")
@@ -361,8 +508,17 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
         logger.info(f"ICE 收集状态（{stream_type}）: {pc.iceGatheringState}")
     
     # 添加视频轨道到 peer connection
-    pc.addTrack(local_video)
-    logger.info(f"视频轨道已添加到 WebRTC 连接（{stream_type}）")
+    sender = session.sender = pc.addTrack(local_video)
+    if relay:
+        # 已编码的数据包只能按 H.264 发送，关键帧请求交给共享编码器合并处理，
+        # 其余 RTCP 反馈交给该连接的码率自适应控制器
+        session.controller = _create_controller(session)
+        bind_sender(sender, local_video, session.controller.on_rtcp if session.controller else None)
+        for transceiver in pc.getTransceivers():
+            if transceiver.sender is sender:
+                transceiver.setCodecPreferences(h264_preferences())
+    watch_first_packet(session, first_packet_stats[stream_id])
+    logger.info(f"视频轨道已添加到 WebRTC 连接（{stream_type}，{pipeline}）")
     
     try:
         # 设置远程描述
@@ -385,6 +541,7 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
         logger.error(f"处理 WebRTC offer 时发生错误: {str(e)}")
         await pc.close()
         pcs.discard(pc)
+        sessions.pop(pc, None)
         local_video.stop()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -392,33 +549,85 @@ async def webrtc_offer(stream_id: int, offer: WebRTCOffer, _: str = Depends(requ
         )
 
 
+@router.get("/webrtc/config", response_model=WebRTCConfig)
+def get_webrtc_config(_: str = Depends(require_auth)) -> WebRTCConfig:
+    return WebRTCConfig(**state.webrtc_config)
+
+
+@router.put("/webrtc/config", response_model=WebRTCConfig)
+async def update_webrtc_config(payload: WebRTCConfig, _: str = Depends(require_auth)) -> WebRTCConfig:
+    """
+    更新管线配置，队列参数在解码源下次启动时生效，预热立即生效
+    """
+    state.webrtc_config = payload.model_dump()
+    _prewarm()
+    return WebRTCConfig(**state.webrtc_config)
+
+
+@router.get("/webrtc/streams")
+def webrtc_streams(_: str = Depends(require_auth)) -> Dict:
+    """
+    获取各路解码源、共享编码器（含各档位）、直通码流和各连接的档位，包括帧队列深度和丢帧计数
+    """
+    result = {str(stream_id): source.stats() for stream_id, source in sources.items()}
+    for (stream_id, level), stream in encoders.items():
+        entry = result.setdefault(str(stream_id), {})
+        if level == 0:
+            entry["encoder"] = stream.stats()
+        else:
+            entry.setdefault("renditions", []).append(stream.stats())
+    for session in sessions.values():
+        peer = {"pipeline": session.pipeline}
+        if session.controller is not None:
+            peer.update(session.controller.stats())
+        result.setdefault(str(session.stream_id), {}).setdefault("peers", []).append(peer)
+    for stream_id, stream in passthroughs.items():
+        result.setdefault(str(stream_id), {})["passthrough"] = stream.stats()
+    return result
+
+
+@router.get("/webrtc/stats")
+async def webrtc_stats(_: str = Depends(require_auth)) -> Dict:
+    """
+    获取各连接的发送统计：发送帧数、丢帧、编码耗时、RTT 和码率
+    """
+    peers = await asyncio.gather(*[peer_stats(session) for session in list(sessions.values())])
+    return {"peers": list(peers)}
+
+
 @router.get("/webrtc/status")
 async def webrtc_status(_: str = Depends(require_auth)) -> Dict:
     """
-    获取 WebRTC 连接状态
+    获取 WebRTC 连接状态，视频文件信息只探测一次并缓存
+    顶层的 video_path、video_exists、video_info 为主码流的信息，first_packet 按码流编号，与原来的格式兼容；
+    各码流的详细信息在 streams 中
     """
-    video_exists = Path(VIDEO_PATH).exists()
-    video_info = {}
-    
-    if video_exists:
-        try:
-            cap = cv2.VideoCapture(VIDEO_PATH)
-            if cap.isOpened():
-                video_info = {
-                    "fps": cap.get(cv2.CAP_PROP_FPS),
-                    "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-                    "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                    "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-                    "duration": cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS) if cap.get(cv2.CAP_PROP_FPS) > 0 else 0
-                }
-                cap.release()
-        except Exception as e:
-            logger.error(f"读取视频信息失败: {str(e)}")
-            video_info = {"error": str(e)}
-    
+    config = state.webrtc_config
+    streams = {}
+    for stream_id, video_path in VIDEO_PATHS.items():
+        video_exists = Path(video_path).exists()
+        info = probe_video(video_path) if video_exists else None
+        streams[str(stream_id)] = {
+            "video_path": video_path,
+            "video_exists": video_exists,
+            "video_info": {
+                "fps": info["fps"],
+                "frame_count": info["frame_count"],
+                "width": info["width"],
+                "height": info["height"],
+                "duration": info["duration"],
+            } if info else {},
+            "active_connections": _peer_count(stream_id),
+            "max_connections": config["iMaxPeersPerStream"],
+            "first_packet": first_packet_stats[stream_id].stats(),
+        }
+    main = streams[str(MAIN_STREAM)]
     return {
         "active_connections": len(pcs),
-        "video_path": VIDEO_PATH,
-        "video_exists": video_exists,
-        "video_info": video_info
+        "max_connections": config["iMaxPeers"],
+        "video_path": main["video_path"],
+        "video_exists": main["video_exists"],
+        "video_info": main["video_info"],
+        "first_packet": {stream_id: stream["first_packet"] for stream_id, stream in streams.items()},
+        "streams": streams,
     }
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+
+class EventBus:
+    """
+    进程内事件总线：任意线程都可以发布，监听函数总是在注册它的事件循环中执行
+    最近的事件保留在内存中，供状态接口查询
+    """
+
+    def __init__(self, size: int = 200):
+        self._recent: Deque[Event] = deque(maxlen=size)
+        self._listeners: List[Tuple[Callable[[Event], None], Optional[asyncio.AbstractEventLoop]]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[Event], None]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        self._listeners.append((listener, loop))
+
+    def remove_listener(self, listener: Callable[[Event], None]) -> None:
+        self._listeners = [item for item in self._listeners if item[0] is not listener]
+
+    def publish(self, kind: str, data: Dict[str, Any]) -> Event:
+        event = {"type": kind, "time": time.time(), "data": data}
+        with self._lock:
+            self._recent.append(event)
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for listener, loop in list(self._listeners):
+            if loop is None or loop is current:
+                listener(event)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(listener, event)
+        return event
+
+    def recent(self, kind: Optional[str] = None, limit: int = 50) -> List[Event]:
+        with self._lock:
+            events = [event for event in self._recent if kind is None or event["type"] == kind]
+        return events[-limit:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._recent.clear()
+
+
+events = EventBus()
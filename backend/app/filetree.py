@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_MONTHS = {name: index for index, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1
+)}
+
+
+def mtime_key(mtime: str) -> Tuple[int, ...]:
+    """
+    "Sat, 18 Oct 2025 10:30:15 GMT" -> (年, 月, 日, 时, 分, 秒)，只用于排序，比 strptime 快一个数量级
+    格式不对时排在最前
+    """
+    try:
+        _, day, month, year, clock, _ = mtime.split(" ")
+        hour, minute, second = clock.split(":")
+        return int(year), _MONTHS[month], int(day), int(hour), int(minute), int(second)
+    except (ValueError, KeyError):
+        return (0,)
+
+
+class _Directory:
+    __slots__ = ("entries", "dirs", "order")
+
+    def __init__(self):
+        # 本目录下的条目（文件和目录）、有下级的子目录节点、按 mtime 升序的 (排序键, 名称)
+        self.entries: Dict[str, Dict] = {}
+        self.dirs: Dict[str, _Directory] = {}
+        self.order: List[Tuple[Tuple[int, ...], str]] = []
+
+    def _unlink(self, name: str) -> Dict:
+        entry = self.entries.pop(name)
+        index = bisect_left(self.order, (mtime_key(entry["mtime"]), name))
+        if index == len(self.order) or self.order[index][1] != name:
+            # mtime 被原地修改过，退回线性查找
+            index = next(i for i, item in enumerate(self.order) if item[1] == name)
+        del self.order[index]
+        return entry
+
+
+class FileTree(MutableMapping):
+    """
+    按目录组织的文件索引：每个目录保存子条目和按 mtime 排好序的名称列表，
+    列目录只访问该目录的子条目，不随文件总数增长
+    接口与原来的 {路径: 条目} 字典相同；条目的 mtime 需要通过重新赋值更新，原地修改不会重新排序
+    """
+
+    def __init__(self):
+        self._root = _Directory()
+        self._size = 0
+
+    def _find(self, path: str, create: bool = False) -> Optional[_Directory]:
+        node = self._root
+        if not path:
+            return node
+        for part in path.split("/"):
+            child = node.dirs.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.dirs[part] = _Directory()
+            node = child
+        return node
+
+    def __getitem__(self, path: str) -> Dict:
+        parent, _, name = path.rpartition("/")
+        node = self._find(parent)
+        if node is None or name not in node.entries:
+            raise KeyError(path)
+        return node.entries[name]
+
+    def __setitem__(self, path: str, entry: Dict) -> None:
+        parent, _, name = path.rpartition("/")
+        node = self._find(parent, create=True)
+        if name in node.entries:
+            node._unlink(name)
+        else:
+            self._size += 1
+        node.entries[name] = entry
+        insort(node.order, (mtime_key(entry["mtime"]), name))
+
+    def __delitem__(self, path: str) -> None:
+        parent, _, name = path.rpartition("/")
+        node = self._find(parent)
+        if node is None or name not in node.entries:
+            raise KeyError(path)
+        node._unlink(name)
+        self._size -= 1
+
+    def __iter__(self) -> Iterator[str]:
+        stack = [("", self._root)]
+        while stack:
+            prefix, node = stack.pop()
+            for name in node.entries:
+                yield prefix + name
+            stack.extend((f"{prefix}{name}/", child) for name, child in node.dirs.items())
+
+    def __len__(self) -> int:
+        return self._size
+
+    def list(self, path: str) -> List[Dict]:
+        """
+        目录的直接子条目，最新的在前；目录不存在时返回空列表
+        """
+        node = self._find(path)
+        if node is None:
+            return []
+        entries = node.entries
+        return [entries[name] for _, name in reversed(node.order)]
+
+    def remove_tree(self, path: str) -> bool:
+        """
+        删除文件，或删除目录条目及其下的全部内容，返回是否删除了任何条目
+        """
+        parent, _, name = path.rpartition("/")
+        node = self._find(parent)
+        if node is None:
+            return False
+        removed = 0
+        if name in node.entries:
+            node._unlink(name)
+            removed += 1
+        child = node.dirs.pop(name, None)
+        stack = [child] if child is not None else []
+        while stack:
+            current = stack.pop()
+            removed += len(current.entries)
+            stack.extend(current.dirs.values())
+        self._size -= removed
+        return removed > 0
@@ -25,3 +25,11 @@ app.include_router(record.router)
 # app.include_router(model.router)
 app.include_router(inference.router)
 app.include_router(sensorcraft.router)
+
+app.add_event_handler("startup", video.on_startup)
+app.add_event_handler("startup", record.on_startup)
+app.add_event_handler("startup", image.on_startup)
+app.add_event_handler("shutdown", record.on_shutdown)
+app.add_event_handler("shutdown", image.on_shutdown)
+app.add_event_handler("shutdown", inference.on_shutdown)
+app.add_event_handler("shutdown", video.on_shutdown)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiortc.rtp import RTCP_PSFB_APP, RtcpPsfbPacket, RtcpRrPacket, RtcpSrPacket, unpack_remb_fci
+
+logger = logging.getLogger(__name__)
+
+# 丢包率超过该值时降档
+LOSS_DOWN = 0.10
+# 丢包率低于该值才允许升档
+LOSS_UP = 0.02
+# 估计带宽低于当前档码率的比例时降档
+BANDWIDTH_DOWN = 0.85
+# 估计带宽高于上一档码率的比例时升档
+BANDWIDTH_UP = 1.3
+# 两次切换之间的最短间隔
+SWITCH_INTERVAL = 2.0
+# 连续满足条件这么久才升档，避免来回抖动
+UP_HOLD = 5.0
+# 统计实际发送码率的最短窗口
+RATE_WINDOW = 1.0
+
+
+class AdaptationController:
+    """
+    单个连接的码率自适应：根据接收端的 REMB 和接收报告（丢包率）在预先缩放好的各档之间切换
+    每一档由共享编码器只编码一次，切换只改变该连接订阅的档位，不会影响其他连接
+    REMB 与该连接在当前档位实际发送的码率比较；没有实测值的档位使用 bitrate_for 给出的标称码率（kbps）
+    """
+
+    def __init__(
+        self,
+        track: Any,
+        levels: int,
+        bitrate_for: Callable[[int], int],
+        open_level: Callable[[int], Any],
+    ):
+        self.track = track
+        self.levels = max(1, levels)
+        self.level = 0
+        self.switches = 0
+        self.estimated_bitrate: Optional[int] = None
+        self.fraction_lost = 0.0
+        self._bitrate_for = bitrate_for
+        self._open_level = open_level
+        self._last_switch = 0.0
+        self._up_since: Optional[float] = None
+        # 各档位实测的发送码率（bps）
+        self._observed: Dict[int, float] = {}
+        self._sample: Optional[Tuple[float, int]] = None
+
+    def on_rtcp(self, packet: Any, now: Optional[float] = None) -> None:
+        if isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+            try:
+                self.estimated_bitrate, _ = unpack_remb_fci(packet.fci)
+            except ValueError:
+                return
+        elif isinstance(packet, (RtcpRrPacket, RtcpSrPacket)) and packet.reports:
+            self.fraction_lost = max(report.fraction_lost for report in packet.reports) / 256
+        else:
+            return
+        self._evaluate(time.monotonic() if now is None else now)
+
+    def _measure(self, now: float) -> None:
+        sent = self.track.bytes_sent
+        if self._sample is None:
+            self._sample = (now, sent)
+            return
+        elapsed = now - self._sample[0]
+        if elapsed < RATE_WINDOW:
+            return
+        rate = (sent - self._sample[1]) * 8 / elapsed
+        previous = self._observed.get(self.level)
+        self._observed[self.level] = rate if previous is None else previous * 0.5 + rate * 0.5
+        self._sample = (now, sent)
+
+    def _rate(self, level: int) -> float:
+        return self._observed.get(level) or self._bitrate_for(level) * 1000
+
+    def _evaluate(self, now: float) -> None:
+        self._measure(now)
+        if now - self._last_switch < SWITCH_INTERVAL:
+            return
+        estimate = self.estimated_bitrate
+        current = self._observed.get(self.level)
+
+        congested = self.fraction_lost > LOSS_DOWN or (
+            estimate is not None and current is not None and estimate < current * BANDWIDTH_DOWN
+        )
+        if congested:
+            self._up_since = None
+            if self.level + 1 < self.levels:
+                self._switch(self.level + 1, now)
+            return
+
+        if self.level == 0:
+            return
+        upper = self._rate(self.level - 1)
+        headroom = self.fraction_lost < LOSS_UP and (estimate is None or estimate > upper * BANDWIDTH_UP)
+        if not headroom:
+            self._up_since = None
+        elif self._up_since is None:
+            self._up_since = now
+        elif now - self._up_since >= UP_HOLD:
+            self._up_since = None
+            self._switch(self.level - 1, now)
+
+    def _switch(self, level: int, now: float) -> None:
+        logger.info(
+            f"连接切换档位 {self.level} -> {level}，估计带宽: {self.estimated_bitrate}，丢包率: {self.fraction_lost:.2f}"
+        )
+        self.track.switch(self._open_level(level))
+        self.level = level
+        self.switches += 1
+        self._last_switch = now
+        self._sample = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "levels": self.levels,
+            "switches": self.switches,
+            "estimated_bitrate": self.estimated_bitrate,
+            "sent_bitrate": int(self._observed.get(self.level, 0)),
+            "fraction_lost": round(self.fraction_lost, 3),
+        }
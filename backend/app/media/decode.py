@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from aiortc.mediastreams import VIDEO_CLOCK_RATE
+
+from .framebus import FrameBus, FrameHandle
+from .geometry import FLIP_NONE, RemapPlan, is_identity
+from .pipeline import FramePipeline
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class FrameQueue:
+    """
+    解码线程与事件循环之间的有界帧队列
+    队列满时按策略丢帧：drop_oldest 丢弃最旧的一帧，drop_newest 丢弃新到的帧
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        maxsize: int = 4,
+        policy: str = DROP_OLDEST,
+        on_drop: Optional[Callable[[Any], None]] = None,
+    ):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"未知的丢帧策略: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        # 被丢弃的元素交给 on_drop 处理，例如释放帧句柄
+        self._on_drop = on_drop
+        self.produced = 0
+        self.consumed = 0
+        self.dropped = 0
+        self._items: Deque[Any] = deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+
+    def put(self, item: Any) -> bool:
+        """
+        由解码线程调用，返回该帧是否入队
+        """
+        dropped = None
+        with self._lock:
+            if self._closed:
+                dropped = item
+            elif len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    dropped = item
+                else:
+                    dropped = self._items.popleft()
+            if dropped is not item:
+                self._items.append(item)
+                self.produced += 1
+        if dropped is not None and self._on_drop is not None:
+            self._on_drop(dropped)
+        if dropped is item:
+            return False
+        self._loop.call_soon_threadsafe(self._ready.set)
+        return True
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._closed = True
+            self._error = error
+            remaining = list(self._items)
+            self._items.clear()
+        if self._on_drop is not None:
+            for item in remaining:
+                self._on_drop(item)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    async def get(self) -> Any:
+        """
+        在事件循环中等待下一帧，队列关闭后抛出 QueueClosed
+        """
+        while True:
+            with self._lock:
+                if self._items:
+                    self.consumed += 1
+                    return self._items.popleft()
+                if self._closed:
+                    raise QueueClosed(str(self._error) if self._error else "")
+                self._ready.clear()
+            await self._ready.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = len(self._items)
+        return {
+            "depth": depth,
+            "max_size": self.maxsize,
+            "policy": self.policy,
+            "produced": self.produced,
+            "consumed": self.consumed,
+            "dropped": self.dropped,
+        }
+
+
+def parse_resolution(resolution: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    解析 "1920*1080" 格式的分辨率
+    """
+    if not resolution:
+        return None
+    try:
+        width, height = (int(value) for value in resolution.split("*"))
+    except ValueError:
+        return None
+    return width, height
+
+
+def fit_size(width: int, height: int, limit: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """
+    按比例把源分辨率缩小到 limit 以内（不放大），宽高取偶数以满足 yuv420p 编码要求
+    """
+    if limit is None:
+        return width, height
+    scale = min(limit[0] / width, limit[1] / height, 1.0)
+    if scale >= 1.0:
+        return width, height
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class DecodeWorker(threading.Thread):
+    """
+    每路码流一个解码线程：直接解码到帧总线的共享内存槽位，然后把帧句柄放入队列，
+    全部在事件循环之外完成
+    输出分辨率和帧率低于源文件时在这里一次性缩放和抽帧，后面的编码和推理都只处理缩小后的帧；
+    需要旋转或翻转时和缩放合并为一次重映射，直接写入槽位；
+    帧处理管线（OSD 等）在发布之前对槽位原地处理，编码、录像等消费者都看不到未处理的帧；
+    管线启用时处理的是另一个槽位中的副本，原始帧单独发布给推理，推理不会看到 OSD、遮挡和自己画的检测框
+    """
+
+    def __init__(
+        self,
+        stream_id: int,
+        video_path: str,
+        loop: asyncio.AbstractEventLoop,
+        queue_size: int = 4,
+        drop_policy: str = DROP_OLDEST,
+        output_size: Optional[Tuple[int, int]] = None,
+        frame_rate: Optional[float] = None,
+        pipeline: Optional[FramePipeline] = None,
+        geometry: Tuple[int, str] = (0, FLIP_NONE),
+    ):
+        super().__init__(name=f"decode-{stream_id}", daemon=True)
+        self.stream_id = stream_id
+        self.video_path = video_path
+        self.queue = FrameQueue(loop, queue_size, drop_policy, on_drop=self._release)
+        # 队列中的帧、正在转换的帧、最新帧和最新原始帧各占一个槽位，另外留出余量给其他消费者
+        self.bus_slots = self.queue.maxsize + 5
+        self.bus: Optional[FrameBus] = None
+        self.output_size = output_size
+        self.frame_rate = frame_rate
+        self.pipeline = pipeline
+        self.geometry = geometry
+        self.fps = 30.0
+        self.output_fps = 30.0
+        self.source_width = 0
+        self.source_height = 0
+        self.width = 0
+        self.height = 0
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self._stop_event = threading.Event()
+        self._opened = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _release(self, handle: FrameHandle) -> None:
+        if self.bus is not None:
+            self.bus.release(handle)
+
+    def wait_opened(self, timeout: Optional[float] = None) -> bool:
+        return self._opened.wait(timeout)
+
+    def _open(self) -> cv2.VideoCapture:
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise RuntimeError(f"无法打开视频文件: {self.video_path}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        self.output_fps = min(self.fps, self.frame_rate) if self.frame_rate else self.fps
+        self.source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width, self.height = fit_size(self.source_width, self.source_height, self.output_size)
+        logger.info(f"视频已打开: {self.video_path}")
+        logger.info(f"分辨率: {self.source_width}x{self.source_height}, FPS: {self.fps}")
+        if (self.width, self.height) != (self.source_width, self.source_height) or self.output_fps != self.fps:
+            logger.info(f"码流 {self.stream_id} 输出: {self.width}x{self.height}, FPS: {self.output_fps}")
+        return cap
+
+    def run(self) -> None:
+        cap = None
+        error = None
+        try:
+            cap = self._open()
+            scaled = (self.width, self.height) != (self.source_width, self.source_height)
+            remap = None
+            if not is_identity(*self.geometry):
+                remap = RemapPlan((self.source_width, self.source_height), (self.width, self.height), *self.geometry)
+                self.width, self.height = remap.width, remap.height
+                logger.info(f"码流 {self.stream_id} 旋转 {remap.rotation}°，翻转: {remap.flip}")
+            self.bus = FrameBus((self.height, self.width, 3), self.bus_slots)
+            direct = not scaled and remap is None
+            # 缩放前的解码缓冲区；所有槽位都被消费者占用时也解码到这里并丢弃，保持与源帧率同步
+            scratch = np.empty((self.source_height, self.source_width, 3), np.uint8)
+            self._opened.set()
+
+            epoch = time.time()
+            start_time = epoch
+            frame_count = 0
+            credit = 0.0
+            while not self._stop_event.is_set():
+                # 按源帧率控制节奏
+                sleep_time = frame_count / self.fps - (time.time() - start_time)
+                if sleep_time > 0 and self._stop_event.wait(sleep_time):
+                    break
+
+                # 抽帧：输出帧率低于源帧率时，跳过的帧只 grab 不做颜色转换
+                credit += self.output_fps / self.fps
+                keep = credit >= 1.0
+                if keep:
+                    credit -= 1.0
+
+                slot = self.bus.reserve() if keep else None
+                target = self.bus.array(slot) if slot is not None and direct else scratch
+                ret = self._read(cap, target, keep)
+                # 如果视频结束，循环播放
+                if not ret:
+                    logger.info("视频播放完毕，重新开始循环播放")
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    frame_count = 0
+                    start_time = time.time()
+                    ret = self._read(cap, target, keep)
+                if not ret:
+                    if slot is not None:
+                        self.bus.discard(slot)
+                    raise RuntimeError("无法读取视频帧")
+
+                frame_count += 1
+                self.frames_decoded += 1
+                if not keep:
+                    self.frames_skipped += 1
+                    continue
+                if slot is None:
+                    continue
+                if remap is not None:
+                    remap.apply(scratch, self.bus.array(slot))
+                elif scaled:
+                    cv2.resize(scratch, (self.width, self.height), dst=self.bus.array(slot), interpolation=cv2.INTER_AREA)
+                pts = int((time.time() - epoch) * VIDEO_CLOCK_RATE)
+                raw = self.pipeline is None or not self.pipeline.active
+                if not raw:
+                    output = self.bus.reserve()
+                    if output is not None:
+                        np.copyto(self.bus.array(output), self.bus.array(slot))
+                    self.bus.publish_raw(slot, pts)
+                    if output is None:
+                        # 没有槽位放处理后的副本，这一帧只给推理，不能把未处理的帧发给编码
+                        continue
+                    slot = output
+                    self.pipeline.process(self.bus.array(slot))
+                handle = self.bus.publish(slot, pts, raw)
+                self.queue.put(handle)
+        except Exception as e:
+            logger.error(f"码流 {self.stream_id} 解码失败: {str(e)}")
+            error = e
+        finally:
+            self._opened.set()
+            if cap is not None:
+                cap.release()
+                logger.info(f"视频资源已释放: {self.video_path}")
+            self.queue.close(error)
+            if self.bus is not None:
+                self.bus.close()
+
+    @staticmethod
+    def _read(cap: cv2.VideoCapture, target: np.ndarray, keep: bool) -> bool:
+        if not keep:
+            return cap.grab()
+        ret, _ = cap.read(target)
+        return ret
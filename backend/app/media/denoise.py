@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from ..state import state
+from .isp import active_profile
+from .pipeline import FrameStage
+
+logger = logging.getLogger(__name__)
+
+NOISE_REDUCE_OFF = 0
+# 时域降噪最强时新帧只占 20% 的权重，再强拖影就很明显了
+_TEMPORAL_MIN_WEIGHT = 0.2
+
+
+class DenoiseStage(FrameStage):
+    """
+    降噪（sNoiseReduceMode=1 时启用），放在 ISP 之前处理原始画面
+    时域：在预先分配的 float32 缓冲区上用 cv2.accumulateWeighted 原地做指数滑动平均；
+    空域：3x3 高斯模糊，强度随 iSpatialDenoiseLevel 变化
+    缓冲区只在分辨率变化时重新分配，逐帧没有内存分配
+    """
+
+    name = "denoise"
+
+    def __init__(self, stream_id: int, cam_id: int = 0):
+        super().__init__(stream_id)
+        self.cam_id = cam_id
+        self.temporal_weight = 1.0
+        self.spatial_sigma = 0.0
+        self._revision: Optional[int] = None
+        self._average: Optional[np.ndarray] = None
+        self._primed = False
+
+    def _configure(self) -> None:
+        revision = state.config_revisions.get("isp", 0)
+        if revision == self._revision:
+            return
+        self._revision = revision
+        profile = active_profile(state.image_config.get(self.cam_id, {})) or {}
+        enhancement = profile.get("imageEnhancement", {})
+        if enhancement.get("sNoiseReduceMode", NOISE_REDUCE_OFF) == NOISE_REDUCE_OFF:
+            self.temporal_weight, self.spatial_sigma = 1.0, 0.0
+        else:
+            temporal = enhancement.get("iTemporalDenoiseLevel", 0) / 100
+            self.temporal_weight = 1.0 - (1.0 - _TEMPORAL_MIN_WEIGHT) * temporal
+            self.spatial_sigma = 1.2 * enhancement.get("iSpatialDenoiseLevel", 0) / 100
+        # 参数变化后重新开始累积
+        self._primed = False
+
+    @property
+    def enabled(self) -> bool:
+        self._configure()
+        return self.temporal_weight < 1.0 or self.spatial_sigma > 0
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        self._configure()
+        if self.spatial_sigma > 0:
+            cv2.GaussianBlur(frame, (3, 3), self.spatial_sigma, dst=frame)
+        if self.temporal_weight >= 1.0:
+            return
+        if self._average is None or self._average.shape != frame.shape:
+            self._average = np.empty(frame.shape, np.float32)
+            self._primed = False
+        if not self._primed:
+            np.copyto(self._average, frame)
+            self._primed = True
+            return
+        cv2.accumulateWeighted(frame, self._average, self.temporal_weight)
+        cv2.convertScaleAbs(self._average, dst=frame)
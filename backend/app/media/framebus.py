@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 帧总线与所有需要跨进程共享的对象都使用 spawn 上下文，避免 fork 带着解码线程和事件循环
+mp_context = multiprocessing.get_context("spawn")
+
+_ALIGN = 64
+
+
+@dataclass(frozen=True)
+class FrameHandle:
+    """
+    帧句柄，可以在进程间传递；持有者负责调用 FrameBus.release
+    """
+    slot: int
+    seq: int
+    pts: int
+
+
+@dataclass
+class FrameBusSpec:
+    """
+    其他进程挂载同一条帧总线所需的描述信息
+    """
+    name: str
+    slots: int
+    shape: Tuple[int, ...]
+    lock: Any
+
+
+class FrameBus:
+    """
+    基于 multiprocessing.shared_memory 的帧环形缓冲区
+    每个槽位保存一帧 uint8 图像并带有引用计数，消费者通过 FrameHandle 零拷贝映射为 NumPy 视图，
+    引用计数归零的槽位才会被解码端复用
+    除了最新一帧，总线还记录最新的原始帧（帧处理之前），推理读取原始帧，不受 OSD、遮挡等影响
+    """
+
+    def __init__(self, shape: Tuple[int, ...], slots: int = 6, spec: Optional[FrameBusSpec] = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape))
+        self.overruns = 0
+        self._owner = spec is None
+        self._cursor = 0
+        # 本进程持有、还没有释放的句柄数；关闭总线时要等它们都释放后才解除映射，正在读取的视图不会失效
+        self._held = 0
+
+        # 头部: refcount[int64 x slots] | seq[int64 x slots] | pts[int64 x slots] | latest_slot, next_seq, latest_raw_slot
+        header_bytes = 8 * (3 * slots + 3)
+        self._data_offset = (header_bytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        slot_stride = (self.frame_bytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        size = self._data_offset + slot_stride * slots
+
+        if spec is None:
+            self._lock = mp_context.Lock()
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._lock = spec.lock
+            self._shm = shared_memory.SharedMemory(name=spec.name)
+            # 挂载方不拥有共享内存，不能让本进程的 resource_tracker 在退出时删除它
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        header = np.ndarray((3 * slots + 3,), dtype=np.int64, buffer=self._shm.buf)
+        self._refcount = header[:slots]
+        self._seq = header[slots:2 * slots]
+        self._pts = header[2 * slots:3 * slots]
+        self._meta = header[3 * slots:]
+        if self._owner:
+            header[:] = 0
+            self._seq[:] = -1
+            self._meta[0] = self._meta[2] = -1
+
+        self._arrays: List[np.ndarray] = [
+            np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf, offset=self._data_offset + i * slot_stride)
+            for i in range(slots)
+        ]
+        if self._owner:
+            logger.info(f"帧总线已创建: {self._shm.name}, {slots} 个槽位, 单帧 {self.frame_bytes} 字节")
+
+    @classmethod
+    def attach(cls, spec: FrameBusSpec) -> "FrameBus":
+        """
+        在其他进程中挂载已有的帧总线
+        """
+        return cls(spec.shape, spec.slots, spec=spec)
+
+    @property
+    def closed(self) -> bool:
+        return self._refcount is None
+
+    @property
+    def spec(self) -> FrameBusSpec:
+        return FrameBusSpec(self._shm.name, self.slots, self.shape, self._lock)
+
+    def reserve(self) -> Optional[int]:
+        """
+        获取一个空闲槽位用于写入，没有空闲槽位时返回 None（调用方应丢弃该帧）
+        返回的槽位已带有一个写入者引用
+        """
+        with self._lock:
+            for i in range(self.slots):
+                slot = (self._cursor + i) % self.slots
+                if self._refcount[slot] == 0:
+                    self._refcount[slot] = 1
+                    self._seq[slot] = -1
+                    self._cursor = slot + 1
+                    return slot
+        self.overruns += 1
+        return None
+
+    def array(self, slot: int) -> np.ndarray:
+        """
+        写入端使用的可写视图
+        """
+        return self._arrays[slot]
+
+    def publish(self, slot: int, pts: int, raw: bool = True) -> FrameHandle:
+        """
+        发布已写好的槽位，写入者引用转移到返回的句柄上
+        总线自身为最新一帧多持有一个引用，保证 latest() 总能取到完整的帧；
+        raw 为 True 表示这一帧没有经过帧处理，同时作为最新的原始帧
+        """
+        with self._lock:
+            seq = self._stamp(slot, pts)
+            self._refcount[slot] += 1
+            self._replace_latest(0, slot)
+            if raw:
+                self._refcount[slot] += 1
+                self._replace_latest(2, slot)
+            self._held += 1
+        return FrameHandle(slot, seq, pts)
+
+    def publish_raw(self, slot: int, pts: int) -> None:
+        """
+        只作为最新的原始帧发布（帧处理在另一个槽位的副本上进行），写入者引用转移给总线
+        """
+        with self._lock:
+            self._stamp(slot, pts)
+            self._replace_latest(2, slot)
+
+    def _stamp(self, slot: int, pts: int) -> int:
+        seq = int(self._meta[1])
+        self._meta[1] = seq + 1
+        self._seq[slot] = seq
+        self._pts[slot] = pts
+        return seq
+
+    def _replace_latest(self, index: int, slot: int) -> None:
+        previous = int(self._meta[index])
+        if previous >= 0:
+            self._refcount[previous] -= 1
+        self._meta[index] = slot
+
+    def discard(self, slot: int) -> None:
+        """
+        放弃一个已预留但未发布的槽位
+        """
+        with self._lock:
+            self._refcount[slot] -= 1
+
+    def retain(self, handle: FrameHandle) -> bool:
+        """
+        为句柄增加一个引用，槽位已被复用时返回 False
+        """
+        with self._lock:
+            if self.closed:
+                return False
+            if self._seq[handle.slot] != handle.seq or self._refcount[handle.slot] <= 0:
+                return False
+            self._refcount[handle.slot] += 1
+            self._held += 1
+            return True
+
+    def release(self, handle: FrameHandle) -> None:
+        with self._lock:
+            self._held = max(0, self._held - 1)
+            if self.closed:
+                if not self._held:
+                    self._unmap()
+                return
+            if self._seq[handle.slot] == handle.seq and self._refcount[handle.slot] > 0:
+                self._refcount[handle.slot] -= 1
+
+    def latest(self, raw: bool = False) -> Optional[FrameHandle]:
+        """
+        取得最新一帧的句柄（已增加引用），raw 为 True 时取最新的原始帧；总线为空时返回 None
+        """
+        with self._lock:
+            if self.closed:
+                return None
+            slot = int(self._meta[2 if raw else 0])
+            if slot < 0:
+                return None
+            self._refcount[slot] += 1
+            self._held += 1
+            return FrameHandle(slot, int(self._seq[slot]), int(self._pts[slot]))
+
+    def view(self, handle: FrameHandle) -> Optional[np.ndarray]:
+        """
+        句柄对应帧的只读零拷贝视图，仅在释放句柄之前有效；总线已关闭时返回 None
+        总线在句柄释放之前关闭时，映射保留到句柄释放为止
+        """
+        with self._lock:
+            if self.closed:
+                return None
+            array = self._arrays[handle.slot].view()
+        array.flags.writeable = False
+        return array
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.closed:
+                return {"name": self._shm.name, "closed": True}
+            in_use = int(np.count_nonzero(self._refcount))
+            published = int(self._meta[1])
+        return {
+            "name": self._shm.name,
+            "shape": list(self.shape),
+            "slots": self.slots,
+            "slots_in_use": in_use,
+            "published": published,
+            "overruns": self.overruns,
+        }
+
+    def close(self) -> None:
+        """
+        关闭总线，创建者同时删除共享内存；其他线程的 release、view 等操作要么在关闭之前完成，要么看到已关闭
+        本进程还有未释放的句柄（例如线程池中正在转换的最后一帧）时，等最后一个句柄释放后再解除映射
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self._refcount = self._seq = self._pts = self._meta = None
+            if not self._held:
+                self._unmap()
+        if self._owner:
+            # 删除名称不影响已有的映射
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _unmap(self) -> None:
+        if not self._arrays:
+            return
+        self._arrays = []
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有消费者持有视图，映射随最后一个视图一起释放
+            logger.warning(f"帧总线 {self._shm.name} 仍有未释放的视图")
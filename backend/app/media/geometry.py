@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import logging
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FLIP_NONE = "close"
+# sImageFlip 对应的（水平翻转，垂直翻转）
+_FLIPS = {
+    "close": (False, False),
+    "mirror": (True, False),
+    "flip": (False, True),
+    "centrosymmetric": (True, True),
+}
+
+
+def is_identity(rotation: int, flip: str) -> bool:
+    return rotation % 360 == 0 and _FLIPS.get(flip, (False, False)) == (False, False)
+
+
+def output_size(width: int, height: int, rotation: int) -> Tuple[int, int]:
+    """
+    旋转 90° 或 270° 后宽高互换
+    """
+    return (height, width) if rotation % 180 == 90 else (width, height)
+
+
+class RemapPlan:
+    """
+    缩放、翻转和旋转合成一张预先计算的重映射表，转换成定点格式后逐帧只做一次 cv2.remap
+    不缩放时用最近邻，结果与逐像素搬移完全一致；需要缩放时用双线性，一次完成缩放和旋转
+    先按 sImageFlip 翻转，再按 iImageRotation 顺时针旋转
+    """
+
+    def __init__(
+        self,
+        source_size: Tuple[int, int],
+        scaled_size: Tuple[int, int],
+        rotation: int = 0,
+        flip: str = FLIP_NONE,
+    ):
+        self.source_size = source_size
+        self.rotation = rotation % 360
+        self.flip = flip
+        width, height = scaled_size
+        self.width, self.height = output_size(width, height, self.rotation)
+
+        out_y, out_x = np.indices((self.height, self.width), dtype=np.float32)
+        # 输出坐标逆旋转到翻转后的坐标
+        if self.rotation == 90:
+            x, y = out_y, height - 1 - out_x
+        elif self.rotation == 180:
+            x, y = width - 1 - out_x, height - 1 - out_y
+        elif self.rotation == 270:
+            x, y = width - 1 - out_y, out_x
+        else:
+            x, y = out_x, out_y
+        mirror, upside_down = _FLIPS.get(flip, (False, False))
+        if mirror:
+            x = width - 1 - x
+        if upside_down:
+            y = height - 1 - y
+
+        scaled = tuple(scaled_size) != tuple(source_size)
+        if scaled:
+            # 按像素中心对齐换算回源分辨率
+            x = (x + 0.5) * (source_size[0] / width) - 0.5
+            y = (y + 0.5) * (source_size[1] / height) - 0.5
+        self.interpolation = cv2.INTER_LINEAR if scaled else cv2.INTER_NEAREST
+        self.map1, self.map2 = cv2.convertMaps(
+            np.ascontiguousarray(x, np.float32),
+            np.ascontiguousarray(y, np.float32),
+            cv2.CV_16SC2,
+            nninterpolation=not scaled,
+        )
+
+    def apply(self, source: np.ndarray, target: np.ndarray) -> None:
+        cv2.remap(source, self.map1, self.map2, self.interpolation, dst=target)
@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .framebus import FrameBus, FrameBusSpec, mp_context
+from .postprocess import YOLOV8, PostprocessConfig, postprocess, to_dicts
+from .results import hub, pack_records
+
+logger = logging.getLogger(__name__)
+
+# RKNN 模型在本机用同名 ONNX 模型代替，放在 backend/models 下
+MODEL_DIR = Path(__file__).resolve().parents[2] / "models"
+INPUT_SIZE = 640
+PAD_VALUE = 114
+STAGES = ("preprocess", "inference", "postprocess")
+# 实测帧率按最近几秒的结果计算
+FPS_WINDOW = 3.0
+# 各阶段耗时的指数滑动平均系数
+LATENCY_SMOOTHING = 0.1
+
+
+def model_path(model: str) -> Path:
+    return MODEL_DIR / f"{Path(model).stem}.onnx"
+
+
+class Letterbox:
+    """
+    等比缩放到 INPUT_SIZE x INPUT_SIZE，空白处填充灰色
+    画布预先分配，缩放结果直接写入画布中间的区域；源分辨率变化时才重新计算缩放参数
+    """
+
+    def __init__(self, size: int = INPUT_SIZE):
+        self.size = size
+        self.canvas = np.full((size, size, 3), PAD_VALUE, np.uint8)
+        self.scale = 1.0
+        self.pad = (0, 0)
+        self._source: Optional[Tuple[int, int]] = None
+        self._roi: Optional[np.ndarray] = None
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        if self._source != (width, height):
+            self._source = (width, height)
+            self.scale = min(self.size / width, self.size / height)
+            scaled_w, scaled_h = round(width * self.scale), round(height * self.scale)
+            self.pad = ((self.size - scaled_w) // 2, (self.size - scaled_h) // 2)
+            self.canvas[:] = PAD_VALUE
+            self._roi = self.canvas[self.pad[1]:self.pad[1] + scaled_h, self.pad[0]:self.pad[0] + scaled_w]
+        cv2.resize(frame, self._roi.shape[1::-1], dst=self._roi, interpolation=cv2.INTER_LINEAR)
+        return self.canvas
+
+    def to_source(self, boxes: np.ndarray) -> np.ndarray:
+        """
+        输入画布上的 x1, y1, x2, y2 换算回源画面坐标
+        """
+        boxes = (boxes - np.tile(self.pad, 2)) / self.scale
+        width, height = self._source
+        return np.clip(boxes, 0, [width, height, width, height])
+
+
+class OnnxBackend:
+    """
+    OpenCV DNN 加载 ONNX 模型，输出 YOLO 格式的原始张量
+    """
+
+    name = "onnx"
+    # 输出格式按张量形状判断
+    layout = None
+
+    def __init__(self, path: Path):
+        self.net = cv2.dnn.readNetFromONNX(str(path))
+
+    def forward(self, image: np.ndarray) -> np.ndarray:
+        self.net.setInput(cv2.dnn.blobFromImage(image, 1 / 255, swapRB=True))
+        return self.net.forward()
+
+
+class MotionBackend:
+    """
+    没有可用模型时的替身：对相邻两次输入做帧差，把运动区域按 YOLOv8 的输出格式 (1, 4 + 类别数, N) 返回，
+    全部归为第 0 类，置信度随区域内运动像素的占比升高
+    """
+
+    name = "motion"
+    layout = YOLOV8
+    # 在 1/4 分辨率上做帧差
+    _STEP = 4
+
+    def __init__(self, classes: int = 1):
+        self.classes = max(1, classes)
+        self._previous: Optional[np.ndarray] = None
+        self._kernel = np.ones((5, 5), np.uint8)
+
+    def forward(self, image: np.ndarray) -> np.ndarray:
+        size = image.shape[0] // self._STEP
+        gray = cv2.cvtColor(cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            return np.zeros((1, 4 + self.classes, 0), np.float32)
+        _, moving = cv2.threshold(cv2.absdiff(gray, previous), 12, 255, cv2.THRESH_BINARY)
+        merged = cv2.dilate(moving, self._kernel, iterations=2)
+        contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rects = np.array([cv2.boundingRect(contour) for contour in contours], np.float32).reshape(-1, 4)
+        output = np.zeros((1, 4 + self.classes, len(rects)), np.float32)
+        for i, (x, y, w, h) in enumerate(rects.astype(int)):
+            fill = np.count_nonzero(moving[y:y + h, x:x + w]) / max(1, w * h)
+            output[0, 4, i] = min(1.0, 0.3 + fill)
+        rects *= self._STEP
+        output[0, 0] = rects[:, 0] + rects[:, 2] / 2
+        output[0, 1] = rects[:, 1] + rects[:, 3] / 2
+        output[0, 2] = rects[:, 2]
+        output[0, 3] = rects[:, 3]
+        return output
+
+
+def load_backend(model: str, classes: int):
+    path = model_path(model)
+    if path.exists():
+        try:
+            return OnnxBackend(path)
+        except cv2.error as exc:
+            logger.error(f"加载模型 {path} 失败，改用运动检测替身: {exc}")
+    return MotionBackend(classes)
+
+
+def _wait(control, timeout: float, options: Dict) -> bool:
+    """
+    等待控制消息（最多 timeout 秒），收到 None 时返回 False 表示退出
+    """
+    try:
+        message = control.get(timeout=max(0.0, timeout))
+    except queue.Empty:
+        return True
+    if message is None:
+        return False
+    options.update(message)
+    return True
+
+
+def run_worker(spec: FrameBusSpec, control, results, options: Dict) -> None:
+    """
+    推理进程入口：按 iFPS 从帧总线取最新的原始帧（帧处理之前），信箱缩放、推理、后处理，
+    结果连同各阶段耗时放入 results；results 已满时丢弃本次结果，不阻塞推理
+    """
+    logging.basicConfig(level=logging.INFO)
+    bus = FrameBus.attach(spec)
+    backend = load_backend(options["sModel"], len(options.get("dConfig", {}).get("lLablel", [])) or 1)
+    letterbox = Letterbox()
+    source_config = options.get("dConfig")
+    config = PostprocessConfig.from_model_config(source_config)
+    results.put({"backend": backend.name})
+    last_seq = -1
+    next_due = time.monotonic()
+    try:
+        while True:
+            if not _wait(control, next_due - time.monotonic(), options):
+                break
+            if options.get("dConfig") is not source_config:
+                source_config = options.get("dConfig")
+                config = PostprocessConfig.from_model_config(source_config)
+            next_due = max(next_due + 1 / options["iFPS"], time.monotonic())
+            handle = bus.latest(raw=True)
+            if handle is None or handle.seq == last_seq:
+                if handle is not None:
+                    bus.release(handle)
+                # 还没有新帧，稍后再取
+                next_due = time.monotonic() + 0.005
+                continue
+            last_seq = handle.seq
+            start = time.perf_counter()
+            try:
+                frame = bus.view(handle)
+                height, width = frame.shape[:2]
+                image = letterbox.apply(frame)
+            finally:
+                bus.release(handle)
+            preprocessed = time.perf_counter()
+            output = backend.forward(image)
+            inferred = time.perf_counter()
+            detections = postprocess(output, config, backend.layout)
+            detections.boxes = letterbox.to_source(detections.boxes)
+            records = pack_records(detections, width, height)
+            detections = to_dicts(detections, config.labels)
+            done = time.perf_counter()
+            try:
+                results.put_nowait({
+                    "seq": handle.seq,
+                    "pts": handle.pts,
+                    "timestamp": time.time(),
+                    "width": width,
+                    "height": height,
+                    "detections": detections,
+                    "records": records,
+                    "latency": {
+                        "preprocess": (preprocessed - start) * 1000,
+                        "inference": (inferred - preprocessed) * 1000,
+                        "postprocess": (done - inferred) * 1000,
+                    },
+                })
+            except queue.Full:
+                pass
+    finally:
+        bus.close()
+
+
+def _reap(process, control, timeout: float = 2.0) -> None:
+    """
+    等待推理进程退出，超时后强制结束
+    """
+    if process.is_alive():
+        control.put(None)
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+
+
+class InferenceEngine:
+    """
+    推理引擎：推理在独立进程中运行，API 所在的事件循环只收集结果并发布到结果中心
+    通过订阅码流的共享解码源保持解码运行，解码源重启（分辨率、旋转等变化）换了帧总线时重启推理进程
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.model = ""
+        self.fps = 10
+        self.config: Dict = {}
+        self.backend: Optional[str] = None
+        self.error: Optional[str] = None
+        self.results_received = 0
+        self.restarts = 0
+        self.latency: Dict[str, float] = {}
+        self._times: Deque[float] = deque()
+        self._open_subscription: Optional[Callable] = None
+        self._subscription = None
+        self._process = None
+        self._control = None
+        self._results = None
+        self._bus_name: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def configure(self, enabled: bool, model: str, fps: int, config: Dict, open_subscription: Callable) -> None:
+        """
+        更新推理配置；模型变化时重启推理进程，帧率和阈值直接发送给正在运行的进程
+        """
+        model_changed = model != self.model
+        self.model, self.fps, self.config = model, fps, config
+        self._open_subscription = open_subscription
+        if not enabled:
+            self.stop()
+            return
+        self.enabled = True
+        self.error = None
+        if model_changed:
+            self._stop_process()
+        elif self.running:
+            self._control.put({"iFPS": fps, "dConfig": config})
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        self.enabled = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop_process()
+        if self._subscription is not None:
+            self._subscription.stop()
+            self._subscription = None
+        self._times.clear()
+
+    def _start_process(self, spec: FrameBusSpec) -> None:
+        self._stop_process()
+        self._control = mp_context.Queue()
+        self._results = mp_context.Queue(maxsize=8)
+        options = {"sModel": self.model, "iFPS": self.fps, "dConfig": self.config}
+        self._process = mp_context.Process(
+            target=run_worker, args=(spec, self._control, self._results, options), daemon=True
+        )
+        self._process.start()
+        self._bus_name = spec.name
+        self.restarts += 1
+        logger.info(f"推理进程已启动: {self.model}, {self.fps} FPS, 帧总线 {spec.name}")
+
+    def _stop_process(self) -> None:
+        """
+        通知推理进程退出；等待退出在线程池中进行，不阻塞事件循环
+        """
+        process, control = self._process, self._control
+        self._process = None
+        self._bus_name = None
+        self.backend = None
+        if process is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _reap(process, control)
+            return
+        loop.run_in_executor(None, _reap, process, control)
+
+    def _bus(self):
+        """
+        当前解码源的帧总线，订阅已结束时重新订阅
+        """
+        if self._subscription is None or not self._subscription.live:
+            self._subscription = self._open_subscription()
+        return self._subscription.bus
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        """
+        在线程池中阻塞等待推理结果，一次取走所有已到达的结果
+        """
+        items = []
+        try:
+            items.append(self._results.get(timeout=0.5))
+            while True:
+                items.append(self._results.get_nowait())
+        except (queue.Empty, OSError, ValueError):
+            pass
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while self.enabled:
+                bus = self._bus()
+                if bus is None:
+                    await asyncio.sleep(0.1)
+                    continue
+                if self._process is not None and not self._process.is_alive():
+                    self.error = f"推理进程异常退出: {self._process.exitcode}"
+                    logger.error(self.error)
+                    self._stop_process()
+                    await asyncio.sleep(1)
+                    continue
+                if bus.spec.name != self._bus_name:
+                    self._start_process(bus.spec)
+                for item in await loop.run_in_executor(None, self._drain):
+                    self._receive(item)
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            self.error = str(exc)
+            logger.exception(f"推理引擎异常: {exc}")
+
+    def _receive(self, item: Dict[str, Any]) -> None:
+        if "backend" in item:
+            self.backend = item["backend"]
+            self.error = None
+            return
+        now = time.monotonic()
+        self._times.append(now)
+        while now - self._times[0] > FPS_WINDOW:
+            self._times.popleft()
+        for stage, value in item["latency"].items():
+            previous = self.latency.get(stage)
+            self.latency[stage] = value if previous is None else previous + LATENCY_SMOOTHING * (value - previous)
+        self.results_received += 1
+        hub.publish(item)
+
+    @property
+    def measured_fps(self) -> float:
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return "error"
+        return "running" if self.enabled else "stop"
+
+    def stats(self) -> Dict[str, Any]:
+        latency = {stage: round(self.latency.get(stage, 0.0), 2) for stage in STAGES}
+        latency["total"] = round(sum(latency.values()), 2)
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "model": self.model,
+            "backend": self.backend,
+            "fps": self.fps,
+            "measured_fps": round(self.measured_fps, 2),
+            "latency_ms": latency,
+            "results": self.results_received,
+            "restarts": self.restarts,
+            "error": self.error,
+        }
+
+
+engine = InferenceEngine()
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import logging
+import math
+from fractions import Fraction
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from ..state import state
+from .pipeline import FrameStage
+from .scene import MODE_FIXED
+
+logger = logging.getLogger(__name__)
+
+# 手动曝光以 1/30 秒、0 dB 增益为基准，总增益限制在 [1/4, 4]
+_REFERENCE_EXPOSURE = 1 / 30
+_EXPOSURE_RANGE = (0.25, 4.0)
+# 白平衡以 6500K 为基准，按一半强度（平方根）校正，避免模拟画面偏色过重
+_REFERENCE_CT = 6500
+_WHITE_BALANCE_CT = {"natural": 5000, "streetlight": 3000, "outdoor": 6500}
+
+# BGR 与亮度/色差之间的转换（BT.601 权重）
+_TO_YUV = np.array([
+    [0.114, 0.587, 0.299],
+    [0.886, -0.587, -0.299],
+    [-0.114, -0.587, 0.701],
+])
+_FROM_YUV = np.array([
+    [1.0, 1.0, 0.0],
+    [1.0, -0.114 / 0.587, -0.299 / 0.587],
+    [1.0, 0.0, 1.0],
+])
+
+
+def active_profile(config: Dict) -> Optional[Dict]:
+    """
+    当前生效的场景参数：正在编辑的配置（iProfile >= 0）优先，
+    保持不变模式使用 iProfileSelect，自动和定时模式使用昼夜切换的结果 iProfileCur
+    """
+    profiles = config.get("profile", [])
+    night_to_day = config.get("nightToDay", {})
+    candidates = [night_to_day.get("iProfile")]
+    if night_to_day.get("iMode") != MODE_FIXED:
+        candidates.append(night_to_day.get("iProfileCur"))
+    candidates.append(night_to_day.get("iProfileSelect"))
+    for index in candidates:
+        if isinstance(index, int) and 0 <= index < len(profiles):
+            return profiles[index]
+    return profiles[0] if profiles else None
+
+
+def exposure_gain(exposure: Dict) -> float:
+    """
+    手动曝光时由曝光时间和增益（dB）换算亮度倍数，自动曝光保持源画面
+    """
+    if exposure.get("sExposureMode") != "manual":
+        return 1.0
+    try:
+        exposure_time = float(Fraction(exposure.get("sExposureTime", "1/30")))
+    except (ValueError, ZeroDivisionError):
+        exposure_time = _REFERENCE_EXPOSURE
+    gain = exposure_time / _REFERENCE_EXPOSURE
+    if exposure.get("sGainMode") == "manual":
+        gain *= 10 ** (exposure.get("iExposureGain", 0) / 20)
+    return min(max(gain, _EXPOSURE_RANGE[0]), _EXPOSURE_RANGE[1])
+
+
+def tone_lut(brightness: int, contrast: int, gain: float = 1.0) -> np.ndarray:
+    """
+    曝光、亮度、对比度合成一张 256 项查找表，三个通道共用
+    50 为中性值：亮度每档约 2.5 个灰阶，对比度在 0~2 倍之间
+    """
+    values = np.arange(256, dtype=np.float64) * gain
+    values = (values - 128) * (contrast / 50) + 128 + (brightness - 50) * 2.55
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def _blackbody(ct: float) -> np.ndarray:
+    """
+    色温对应的近似 RGB（Tanner Helland 拟合），返回 BGR
+    """
+    t = ct / 100
+    if t <= 66:
+        red = 255.0
+        green = 99.4708025861 * math.log(t) - 161.1195681661
+    else:
+        red = 329.698727446 * (t - 60) ** -0.1332047592
+        green = 288.1221695283 * (t - 60) ** -0.0755148492
+    if t >= 66:
+        blue = 255.0
+    elif t <= 19:
+        blue = 0.0
+    else:
+        blue = 138.5177312231 * math.log(t - 10) - 305.0447927307
+    return np.clip([blue, green, red], 1, 255)
+
+
+def white_balance_gains(white_balance: Dict) -> np.ndarray:
+    """
+    按白平衡模式得到 BGR 三个通道的增益（以绿色为 1）；auto 不做校正
+    """
+    style = white_balance.get("sWhiteBlanceStyle", "auto")
+    ct = white_balance.get("iWhiteBalanceCT") if style == "manual" else _WHITE_BALANCE_CT.get(style)
+    if not ct:
+        return np.ones(3)
+    ratio = _blackbody(_REFERENCE_CT) / _blackbody(ct)
+    return np.sqrt(ratio / ratio[1])
+
+
+def color_matrix(hue: int, saturation: int, gains: np.ndarray) -> np.ndarray:
+    """
+    白平衡、色调、饱和度合成一个 BGR 3x3 颜色矩阵
+    色调在 ±180° 之间旋转色差平面，饱和度在 0~2 倍之间缩放色差
+    """
+    angle = math.radians((hue - 50) * 3.6)
+    scale = saturation / 50
+    chroma = np.array([
+        [1.0, 0.0, 0.0],
+        [0.0, scale * math.cos(angle), -scale * math.sin(angle)],
+        [0.0, scale * math.sin(angle), scale * math.cos(angle)],
+    ])
+    return _FROM_YUV @ chroma @ _TO_YUV @ np.diag(gains)
+
+
+class ISPProgram:
+    """
+    由一组场景参数编译出的处理步骤：色调查找表、颜色矩阵、锐化强度，中性的步骤跳过
+    """
+
+    def __init__(self, profile: Optional[Dict]):
+        profile = profile or {}
+        adjustment = profile.get("imageAdjustment", {})
+        brightness = adjustment.get("iBrightness", 50)
+        contrast = adjustment.get("iContrast", 50)
+        gain = exposure_gain(profile.get("exposure", {}))
+
+        self.lut: Optional[np.ndarray] = None
+        if (brightness, contrast, gain) != (50, 50, 1.0):
+            self.lut = tone_lut(brightness, contrast, gain)
+
+        self.matrix: Optional[np.ndarray] = None
+        matrix = color_matrix(
+            adjustment.get("iHue", 50),
+            adjustment.get("iSaturation", 50),
+            white_balance_gains(profile.get("whiteBlance", {})),
+        )
+        if not np.allclose(matrix, np.eye(3), atol=1e-3):
+            # 对角矩阵会走 OpenCV 的逐元素缩放分支，比通用的矩阵变换慢一个数量级，加一个不影响结果的微小量
+            matrix[matrix == 0] = 1e-6
+            self.matrix = matrix.astype(np.float32)
+
+        # 大于 0 锐化，小于 0 柔化
+        self.sharpen = (adjustment.get("iSharpness", 50) - 50) / 50
+        self._blurred: Optional[np.ndarray] = None
+
+    @property
+    def active(self) -> bool:
+        return self.lut is not None or self.matrix is not None or self.sharpen != 0
+
+    def apply(self, frame: np.ndarray) -> None:
+        if self.lut is not None:
+            cv2.LUT(frame, self.lut, dst=frame)
+        if self.matrix is not None:
+            cv2.transform(frame, self.matrix, dst=frame)
+        if self.sharpen:
+            if self._blurred is None or self._blurred.shape != frame.shape:
+                self._blurred = np.empty_like(frame)
+            cv2.GaussianBlur(frame, (3, 3), 0, dst=self._blurred)
+            cv2.addWeighted(frame, 1 + self.sharpen, self._blurred, -self.sharpen, 0, dst=frame)
+
+
+class ISPStage(FrameStage):
+    """
+    模拟 ISP：把当前场景的图像调节、曝光、白平衡编译为查找表和颜色矩阵后逐帧应用
+    只在 config_revisions["isp"] 变化时重新编译
+    """
+
+    name = "isp"
+
+    def __init__(self, stream_id: int, cam_id: int = 0):
+        super().__init__(stream_id)
+        self.cam_id = cam_id
+        self.compiles = 0
+        self._program: Optional[ISPProgram] = None
+        self._revision: Optional[int] = None
+
+    def program(self) -> ISPProgram:
+        revision = state.config_revisions.get("isp", 0)
+        if revision != self._revision:
+            self._program = ISPProgram(active_profile(state.image_config.get(self.cam_id, {})))
+            self._revision = revision
+            self.compiles += 1
+            logger.info(f"码流 {self.stream_id} 图像参数已更新")
+        return self._program
+
+    @property
+    def enabled(self) -> bool:
+        return self.program().active
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        self.program().apply(frame)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..state import state
+from .pipeline import FrameStage
+
+logger = logging.getLogger(__name__)
+
+Rect = Tuple[int, int, int, int]
+
+
+def _clip(x: float, y: float, width: float, height: float, frame_width: int, frame_height: int) -> Optional[Rect]:
+    x0 = max(0, min(frame_width, int(x)))
+    y0 = max(0, min(frame_height, int(y)))
+    x1 = max(0, min(frame_width, int(np.ceil(x + width))))
+    y1 = max(0, min(frame_height, int(np.ceil(y + height))))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+def mask_rects(stream_id: int, frame_width: int, frame_height: int) -> List[Rect]:
+    """
+    把遮挡配置换算为像素矩形 (x0, y0, x1, y1)
+    maskOverlay 是相对整幅画面的比例；各码流的 osd-mask 是相对 normalizedScreenSize 的坐标
+    """
+    rects = []
+    overlay = (state.osd_config or {}).get("maskOverlay", {})
+    if overlay.get("iEnabled"):
+        for mask in overlay.get("privacyMask", []):
+            rects.append(_clip(
+                mask["iPositionX"] * frame_width,
+                mask["iPositionY"] * frame_height,
+                mask["iMaskWidth"] * frame_width,
+                mask["iMaskHeight"] * frame_height,
+                frame_width,
+                frame_height,
+            ))
+
+    stream_mask = state.video_streams.get(stream_id, {}).get("osd-mask", {})
+    if stream_mask.get("iEnabled"):
+        screen = stream_mask.get("normalizedScreenSize", {})
+        scale_x = frame_width / (screen.get("iNormalizedScreenWidth") or frame_width)
+        scale_y = frame_height / (screen.get("iNormalizedScreenHeight") or frame_height)
+        for mask in stream_mask.get("privacyMask", []):
+            rects.append(_clip(
+                mask["iPositionX"] * scale_x,
+                mask["iPositionY"] * scale_y,
+                mask["iMaskWidth"] * scale_x,
+                mask["iMaskHeight"] * scale_y,
+                frame_width,
+                frame_height,
+            ))
+    return [rect for rect in rects if rect is not None]
+
+
+def disjoint_rects(rects: List[Rect]) -> List[Rect]:
+    """
+    把可能重叠的矩形拆分合并为互不重叠的矩形，每个像素只填充一次
+    先按所有上下边界切成水平条带，条带内合并 x 区间，再把区间相同的相邻条带合并
+    """
+    edges = sorted({y for rect in rects for y in (rect[1], rect[3])})
+    bands: List[Tuple[int, int, List[Tuple[int, int]]]] = []
+    for top, bottom in zip(edges, edges[1:]):
+        spans = sorted((x0, x1) for x0, y0, x1, y1 in rects if y0 <= top and y1 >= bottom)
+        merged: List[Tuple[int, int]] = []
+        for x0, x1 in spans:
+            if merged and x0 <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], x1))
+            else:
+                merged.append((x0, x1))
+        if bands and bands[-1][1] == top and bands[-1][2] == merged:
+            bands[-1] = (bands[-1][0], bottom, merged)
+        elif merged:
+            bands.append((top, bottom, merged))
+    return [(x0, top, x1, bottom) for top, bottom, spans in bands for x0, x1 in spans]
+
+
+class MaskPlan:
+    """
+    预先计算好的遮挡区域：互不重叠的矩形切片，逐帧只按切片整块填充，不做坐标换算
+    """
+
+    def __init__(self, rects: List[Rect]):
+        self.rects = disjoint_rects(rects)
+        self.slices = [(slice(y0, y1), slice(x0, x1)) for x0, y0, x1, y1 in self.rects]
+
+    @property
+    def pixels(self) -> int:
+        return sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in self.rects)
+
+    def fill(self, frame: np.ndarray, value: int = 0) -> None:
+        for region in self.slices:
+            frame[region] = value
+
+
+class MaskStage(FrameStage):
+    """
+    隐私遮挡：在帧发布到帧总线之前原地涂黑，编码、录像、抓图等所有输出看到的都是遮挡后的画面
+    像素区域按（分辨率，config_revisions["mask"]）缓存
+    """
+
+    name = "mask"
+
+    def __init__(self, stream_id: int):
+        super().__init__(stream_id)
+        self.builds = 0
+        self._plan: Optional[MaskPlan] = None
+        self._key: Optional[tuple] = None
+
+    @property
+    def enabled(self) -> bool:
+        overlay = (state.osd_config or {}).get("maskOverlay", {})
+        if overlay.get("iEnabled") and overlay.get("privacyMask"):
+            return True
+        stream_mask = state.video_streams.get(self.stream_id, {}).get("osd-mask", {})
+        return bool(stream_mask.get("iEnabled") and stream_mask.get("privacyMask"))
+
+    def plan(self, frame_width: int, frame_height: int) -> MaskPlan:
+        key = (state.config_revisions.get("mask", 0), frame_width, frame_height)
+        if key != self._key:
+            self._plan = MaskPlan(mask_rects(self.stream_id, frame_width, frame_height))
+            self._key = key
+            self.builds += 1
+            logger.info(f"码流 {self.stream_id} 遮挡区域已更新: {self._plan.rects}")
+        return self._plan
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        frame_height, frame_width = frame.shape[:2]
+        self.plan(frame_width, frame_height).fill(frame)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import struct
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# MQTT 3.1.1 中用到的报文类型（固定报头高 4 位）
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+PROTOCOL_LEVEL = 4
+CONNECT_TIMEOUT = 5.0
+DEFAULT_KEEPALIVE = 30
+
+_CONNACK_ERRORS = {
+    1: "不支持的协议版本",
+    2: "客户端 ID 被拒绝",
+    3: "服务不可用",
+    4: "用户名或密码错误",
+    5: "未授权",
+}
+
+
+class MqttError(ConnectionError):
+    pass
+
+
+def encode_length(length: int) -> bytes:
+    """
+    剩余长度的变长编码，每字节 7 位
+    """
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(kind: int, body: bytes = b"") -> bytes:
+    return bytes([kind]) + encode_length(len(body)) + body
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """
+    读取一个完整报文，返回固定报头的首字节和报文体
+    """
+    header = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+        shift += 7
+        if shift > 21:
+            raise MqttError("报文剩余长度无效")
+    return header, await reader.readexactly(length) if length else b""
+
+
+class MqttClient:
+    """
+    最小的异步 MQTT 3.1.1 发布客户端：支持 QoS 0/1 和心跳，不订阅
+    QoS 1 的消息可以连续发送多条，每条的 PUBACK 通过 publish 返回的 future 等待
+    连接断开时所有未确认的 future 以 MqttError 结束，由调用方决定是否重发
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        client_id: str = "",
+        username: str = "",
+        password: str = "",
+        keepalive: int = DEFAULT_KEEPALIVE,
+    ):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._packet_id = 0
+        self._last_send = 0.0
+        self._tasks: Tuple[asyncio.Task, ...] = ()
+        self._error: Optional[MqttError] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and self._error is None
+
+    async def connect(self) -> None:
+        self._error = None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT
+        )
+        flags = 0x02  # clean session
+        payload = encode_string(self.client_id)
+        if self.username:
+            flags |= 0x80
+            payload += encode_string(self.username)
+            if self.password:
+                flags |= 0x40
+                payload += encode_string(self.password)
+        body = encode_string("MQTT") + struct.pack("!BBH", PROTOCOL_LEVEL, flags, self.keepalive) + payload
+        self._send(packet(CONNECT, body))
+        try:
+            header, body = await asyncio.wait_for(read_packet(self._reader), CONNECT_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError) as exc:
+            self.close()
+            raise MqttError("等待 CONNACK 超时或连接被关闭") from exc
+        if header & 0xF0 != CONNACK or len(body) != 2:
+            self.close()
+            raise MqttError(f"收到意外的报文: {header:#x}")
+        if body[1]:
+            self.close()
+            raise MqttError(f"broker 拒绝连接: {_CONNACK_ERRORS.get(body[1], body[1])}")
+        self._tasks = (asyncio.ensure_future(self._read_loop()),)
+        if self.keepalive > 0:
+            self._tasks += (asyncio.ensure_future(self._keepalive_loop()),)
+        logger.info(f"MQTT 已连接 {self.host}:{self.port}")
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0) -> Optional[asyncio.Future]:
+        """
+        发送一条 PUBLISH；QoS 1 返回等待 PUBACK 的 future，QoS 0 返回 None
+        """
+        if not self.connected:
+            raise MqttError(str(self._error) if self._error else "MQTT 未连接")
+        body = encode_string(topic)
+        future = None
+        if qos:
+            self._packet_id = self._packet_id % 0xFFFF + 1
+            body += struct.pack("!H", self._packet_id)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[self._packet_id] = future
+        self._send(packet(PUBLISH | (1 << 1 if qos else 0), body + payload))
+        return future
+
+    async def drain(self) -> None:
+        if self._writer is None:
+            raise MqttError("MQTT 未连接")
+        await self._writer.drain()
+
+    def close(self) -> None:
+        if self._writer is not None and self._error is None:
+            try:
+                self._writer.write(packet(DISCONNECT))
+            except (OSError, RuntimeError):
+                pass
+        self._fail(MqttError("MQTT 连接已关闭"))
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = ()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._reader = None
+
+    def _send(self, data: bytes) -> None:
+        self._writer.write(data)
+        self._last_send = time.monotonic()
+
+    def _fail(self, error: MqttError) -> None:
+        if self._error is None:
+            self._error = error
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                header, body = await read_packet(self._reader)
+                kind = header & 0xF0
+                if kind == PUBACK and len(body) == 2:
+                    future = self._pending.pop(struct.unpack("!H", body)[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+                elif kind != PINGRESP:
+                    logger.debug(f"忽略 MQTT 报文: {header:#x}")
+        except asyncio.CancelledError:
+            pass
+        except (asyncio.IncompleteReadError, OSError, MqttError) as exc:
+            logger.warning(f"MQTT 连接断开: {exc!r}")
+            self._fail(MqttError("MQTT 连接断开"))
+
+    async def _keepalive_loop(self) -> None:
+        """
+        空闲超过心跳间隔的一半时发送 PINGREQ，broker 据此判断连接存活
+        """
+        interval = self.keepalive / 2
+        try:
+            while self.connected:
+                idle = time.monotonic() - self._last_send
+                if idle >= interval:
+                    self._send(packet(PINGREQ))
+                    idle = 0.0
+                await asyncio.sleep(interval - idle)
+        except asyncio.CancelledError:
+            pass
+        except (OSError, RuntimeError) as exc:
+            self._fail(MqttError(f"发送心跳失败: {exc}"))
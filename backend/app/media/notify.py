@@ -0,0 +1,441 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+import termios
+import time
+import tty
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..state import state
+from .decode import QueueClosed
+from .mqtt import MqttClient
+from .results import ResultSubscription, hub
+from .template import notify_templates
+
+logger = logging.getLogger(__name__)
+
+# NotifyConfig.iMode
+NOTIFY_OFF = 0
+NOTIFY_MQTT = 1
+NOTIFY_HTTP = 2
+NOTIFY_UART = 3
+
+# 每个输出最多缓存的待发送消息数，超过后丢弃最旧的
+DEFAULT_SPILL_SIZE = 256
+# 重连（重试）的退避：0.5s 起每次翻倍，最长 30s，带 ±20% 抖动
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+BACKOFF_JITTER = 0.2
+LATENCY_SMOOTHING = 0.1
+
+# HTTP 微批：攒够 32 帧或第一帧等待 50ms 后发送一次
+HTTP_BATCH_SIZE = 32
+HTTP_BATCH_DELAY = 0.05
+HTTP_TIMEOUT = 5.0
+# 这些状态码表示稍后重试可能成功，其余 4xx 直接丢弃该批
+HTTP_RETRY_STATUS = (408, 429)
+
+MQTT_BATCH_SIZE = 16
+MQTT_ACK_TIMEOUT = 10.0
+
+UART_BATCH_SIZE = 16
+
+
+class SinkError(Exception):
+    pass
+
+
+def backoff_delay(attempt: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+
+
+def result_json(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON 输出包含的字段，不含二进制目标记录和推理耗时
+    """
+    return {
+        "seq": result["seq"],
+        "timestamp": result["timestamp"],
+        "width": result["width"],
+        "height": result["height"],
+        "detections": result["detections"],
+    }
+
+
+class SpillBuffer:
+    """
+    输出端的有界待发送缓存：连接断开或对端变慢时消息在这里积压，满了丢弃最旧的
+    发送失败的一批放回队首，保持发送顺序
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_SPILL_SIZE):
+        self.maxsize = max(1, maxsize)
+        self.dropped = 0
+        self._items: Deque[Any] = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def append(self, item: Any) -> None:
+        self._items.append(item)
+        self._trim()
+        self._ready.set()
+
+    def restore(self, items: List[Any]) -> None:
+        self._items.extendleft(reversed(items))
+        self._trim()
+        self._ready.set()
+
+    def _trim(self) -> None:
+        while len(self._items) > self.maxsize:
+            self._items.popleft()
+            self.dropped += 1
+
+    async def take(self, count: int, delay: float = 0.0) -> List[Any]:
+        """
+        等待至少一条消息，最多取 count 条；delay 大于 0 时不足 count 条会再等最多 delay 秒凑批
+        """
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        if delay > 0 and len(self._items) < count:
+            deadline = time.monotonic() + delay
+            while len(self._items) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        return [self._items.popleft() for _ in range(min(count, len(self._items)))]
+
+
+class Sink(ABC):
+    """
+    推理结果输出端：订阅结果中心，结果编码后进入待发送缓存，发送协程按批发送
+    连接失败或发送失败时按指数退避重连，期间结果继续进入缓存
+    """
+
+    mode = NOTIFY_OFF
+    name = ""
+    batch_size = 1
+    batch_delay = 0.0
+
+    def __init__(self, spill_size: int = DEFAULT_SPILL_SIZE):
+        self.spill = SpillBuffer(spill_size)
+        self.connected = False
+        self.queued = 0
+        self.sent = 0
+        self.batches = 0
+        self.bytes_sent = 0
+        self.rejected = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._subscription: Optional[ResultSubscription] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._subscription = hub.subscribe(f"notify {self.name}")
+        self._tasks = [asyncio.ensure_future(self._collect()), asyncio.ensure_future(self._deliver())]
+
+    def stop(self) -> None:
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self.disconnect()
+        self.connected = False
+
+    @abstractmethod
+    def encode(self, result: Dict[str, Any]) -> Optional[Any]:
+        """
+        一帧结果编码为一条待发送消息，返回 None 表示这一帧不需要输出
+        """
+
+    async def connect(self) -> None:
+        pass
+
+    def disconnect(self) -> None:
+        pass
+
+    @abstractmethod
+    async def send(self, batch: List[Any]) -> int:
+        """
+        发送一批消息，返回发送的字节数；失败时抛出异常，这一批放回缓存稍后重试
+        """
+
+    async def _collect(self) -> None:
+        try:
+            while True:
+                result = await self._subscription.get()
+                if not result["detections"]:
+                    continue
+                message = self.encode(result)
+                if message is not None:
+                    self.spill.append(message)
+                    self.queued += 1
+        except (asyncio.CancelledError, QueueClosed):
+            pass
+        except Exception as exc:
+            self.last_error = str(exc)
+            logger.exception(f"{self.name} 输出编码异常: {exc}")
+
+    async def _deliver(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                await self.connect()
+                if attempt:
+                    self.reconnects += 1
+                self.connected = True
+                attempt = 0
+                while True:
+                    batch = await self.spill.take(self.batch_size, self.batch_delay)
+                    start = time.monotonic()
+                    try:
+                        size = await self.send(batch)
+                    except BaseException:
+                        self.spill.restore(batch)
+                        raise
+                    elapsed = (time.monotonic() - start) * 1000
+                    self.latency = elapsed if self.latency is None else self.latency + LATENCY_SMOOTHING * (elapsed - self.latency)
+                    self.sent += len(batch)
+                    self.batches += 1
+                    self.bytes_sent += size
+            except asyncio.CancelledError:
+                return
+            except Exception as exc:
+                self.connected = False
+                self.failures += 1
+                self.last_error = str(exc) or repr(exc)
+                self.disconnect()
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"{self.name} 输出失败，{delay:.1f}s 后重试: {self.last_error}")
+                try:
+                    await asyncio.sleep(delay)
+                except asyncio.CancelledError:
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "connected": self.connected,
+            "buffered": len(self.spill),
+            "spill_size": self.spill.maxsize,
+            "queued": self.queued,
+            "sent": self.sent,
+            "batches": self.batches,
+            "bytes": self.bytes_sent,
+            "dropped": self.spill.dropped,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+            "latency_ms": round(self.latency or 0.0, 2),
+            "last_error": self.last_error,
+        }
+
+
+class MqttSink(Sink):
+    """
+    每帧一条 JSON 消息发布到 sTopic；一批消息连续发送后一起等待 PUBACK，
+    断线时未确认的一批放回缓存，重连后重发（QoS 1 至少一次）
+    """
+
+    mode = NOTIFY_MQTT
+    batch_size = MQTT_BATCH_SIZE
+
+    def __init__(self, config: Dict[str, Any], spill_size: int = DEFAULT_SPILL_SIZE):
+        super().__init__(spill_size)
+        address = config["sURL"]
+        host = urlsplit(address).hostname if "://" in address else address
+        self.topic = config["sTopic"]
+        self.qos = min(1, max(0, config.get("iQos", 1)))
+        self.name = f"mqtt {host}:{config['iPort']}/{self.topic}"
+        self.client = MqttClient(
+            host,
+            config["iPort"],
+            client_id=f"recamera-{state.device_info['sSerialNumber']}",
+            username=config.get("sUsername", ""),
+            password=config.get("sPassword", ""),
+        )
+
+    def encode(self, result: Dict[str, Any]) -> bytes:
+        return json.dumps(result_json(result), ensure_ascii=False, separators=(",", ":")).encode()
+
+    async def connect(self) -> None:
+        await self.client.connect()
+
+    def disconnect(self) -> None:
+        self.client.close()
+
+    async def send(self, batch: List[bytes]) -> int:
+        acks = [self.client.publish(self.topic, message, self.qos) for message in batch]
+        await self.client.drain()
+        if self.qos:
+            await asyncio.wait_for(asyncio.gather(*acks), MQTT_ACK_TIMEOUT)
+        return sum(len(message) for message in batch)
+
+
+class HttpSink(Sink):
+    """
+    微批 POST 到 sUrl：请求体是多帧结果的 JSON 数组，sToken 作为 Authorization 头
+    使用一个长连接复用的客户端，避免每帧建立连接
+    """
+
+    mode = NOTIFY_HTTP
+    batch_size = HTTP_BATCH_SIZE
+    batch_delay = HTTP_BATCH_DELAY
+
+    def __init__(self, config: Dict[str, Any], spill_size: int = DEFAULT_SPILL_SIZE):
+        super().__init__(spill_size)
+        self.url = config["sUrl"]
+        self.name = f"http {self.url}"
+        headers = {"Content-Type": "application/json"}
+        if config.get("sToken"):
+            headers["Authorization"] = config["sToken"]
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+        )
+
+    def encode(self, result: Dict[str, Any]) -> str:
+        return json.dumps(result_json(result), ensure_ascii=False, separators=(",", ":"))
+
+    def stop(self) -> None:
+        super().stop()
+        asyncio.ensure_future(self.client.aclose())
+
+    async def send(self, batch: List[str]) -> int:
+        body = f"[{','.join(batch)}]".encode()
+        response = await self.client.post(self.url, content=body)
+        if response.status_code >= 400:
+            if response.status_code < 500 and response.status_code not in HTTP_RETRY_STATUS:
+                self.rejected += len(batch)
+                self.last_error = f"HTTP {response.status_code}"
+                logger.warning(f"{self.name} 拒绝了 {len(batch)} 条结果: HTTP {response.status_code}")
+                return 0
+            raise SinkError(f"HTTP {response.status_code}")
+        return len(body)
+
+
+class UartSink(Sink):
+    """
+    按检测模板逐行写入串口；串口以非阻塞方式打开，写满时等待可写，不阻塞事件循环
+    """
+
+    mode = NOTIFY_UART
+    batch_size = UART_BATCH_SIZE
+
+    def __init__(self, config: Dict[str, Any], spill_size: int = DEFAULT_SPILL_SIZE):
+        super().__init__(spill_size)
+        self.port = config["sPort"]
+        self.baud_rate = config["iBaudRate"]
+        self.name = f"uart {self.port}"
+        self._speed = getattr(termios, f"B{self.baud_rate}", None)
+        if self._speed is None:
+            raise ValueError(f"不支持的波特率: {self.baud_rate}")
+        self._fd: Optional[int] = None
+
+    def encode(self, result: Dict[str, Any]) -> Optional[bytes]:
+        template = notify_templates().detection
+        if template is None:
+            return None
+        return "".join(f"{line}\n" for line in template.render(result)).encode()
+
+    async def connect(self) -> None:
+        fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(fd)
+            attributes = termios.tcgetattr(fd)
+            attributes[4] = attributes[5] = self._speed
+            termios.tcsetattr(fd, termios.TCSANOW, attributes)
+        except termios.error:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def disconnect(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    async def send(self, batch: List[bytes]) -> int:
+        data = memoryview(b"".join(batch))
+        size = len(data)
+        while data:
+            try:
+                data = data[os.write(self._fd, data):]
+            except BlockingIOError:
+                await self._writable()
+        return size
+
+    async def _writable(self) -> None:
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_writer(self._fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            loop.remove_writer(self._fd)
+
+
+SINKS = {NOTIFY_MQTT: (MqttSink, "dMqtt"), NOTIFY_HTTP: (HttpSink, "dHttp"), NOTIFY_UART: (UartSink, "dUart")}
+
+
+class Notifier:
+    """
+    按 NotifyConfig.iMode 运行一个输出端；只有输出方式或对应的连接配置变化时才重建，
+    模板变化直接在下一帧生效
+    """
+
+    def __init__(self):
+        self.sink: Optional[Sink] = None
+        self._key: Optional[tuple] = None
+
+    def configure(self, config: Dict[str, Any], spill_size: int = DEFAULT_SPILL_SIZE) -> None:
+        mode = config.get("iMode", NOTIFY_OFF)
+        sink_class, section = SINKS.get(mode, (None, None))
+        options = config.get(section) if section else None
+        key = (mode, json.dumps(options, sort_keys=True)) if sink_class and options else None
+        if key == self._key:
+            return
+        # 先构造新的输出端，参数无效时抛出 ValueError，正在运行的输出端保持不变
+        sink = sink_class(options, spill_size) if key is not None else None
+        self.stop()
+        if sink is None:
+            return
+        self.sink = sink
+        self.sink.start()
+        self._key = key
+        logger.info(f"推理结果输出: {self.sink.name}")
+
+    def stop(self) -> None:
+        if self.sink is not None:
+            self.sink.stop()
+            self.sink = None
+        self._key = None
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        return self.sink.stats() if self.sink is not None else None
+
+
+notifier = Notifier()
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ..state import state
+from .pipeline import FrameStage
+from .results import hub
+
+logger = logging.getLogger(__name__)
+
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# iOSDFontSize 以 1080p 画面为基准，其他分辨率按高度等比缩放；0 表示自适应
+_FONT_BASE_HEIGHT = 1080
+_ADAPTIVE_DIVISOR = 24
+
+# 超过该时间（秒）没有新的推理结果时不再画框，避免推理停止后残留旧框
+RESULT_MAX_AGE = 1.0
+
+
+@dataclass
+class Tile:
+    """
+    预先栅格化的文字块：颜色和 alpha 权重只在文字或样式变化时计算一次，逐帧只做一次加权混合
+    """
+    colors: np.ndarray
+    weight: np.ndarray
+    inverse_weight: np.ndarray
+
+    @property
+    def height(self) -> int:
+        return self.colors.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.colors.shape[1]
+
+
+def render_text(text: str, height: int, color: Tuple[int, int, int], outline: bool) -> Tile:
+    """
+    把一段文字栅格化为 Tile；outline 为 True 时白字黑边（黑白自动模式），否则使用 color（BGR）
+    """
+    thickness = max(1, height // 12)
+    scale = cv2.getFontScaleFromHeight(_FONT, height, thickness)
+    (width, text_height), baseline = cv2.getTextSize(text, _FONT, scale, thickness)
+    stroke = thickness + 2 * max(1, thickness // 2) if outline else thickness
+    pad = stroke
+    size = (text_height + baseline + 2 * pad, width + 2 * pad)
+    origin = (pad, pad + text_height)
+
+    alpha = np.zeros(size, np.uint8)
+    cv2.putText(alpha, text, origin, _FONT, scale, 255, stroke, cv2.LINE_AA)
+    if outline:
+        colors = np.zeros(size + (3,), np.uint8)
+        cv2.putText(colors, text, origin, _FONT, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+    else:
+        colors = np.empty(size + (3,), np.uint8)
+        colors[:] = color
+
+    # 裁掉全透明的边缘，只混合真正有文字的区域
+    rows = np.flatnonzero(alpha.any(axis=1))
+    cols = np.flatnonzero(alpha.any(axis=0))
+    if rows.size:
+        alpha = alpha[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        colors = colors[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    weight = alpha.astype(np.float32) / 255
+    return Tile(colors=np.ascontiguousarray(colors), weight=weight, inverse_weight=1 - weight)
+
+
+def blend(frame: np.ndarray, tile: Tile, x: int, y: int) -> None:
+    """
+    把 Tile 原地混合到帧的 (x, y) 处，只读写 Tile 覆盖的区域
+    """
+    frame_height, frame_width = frame.shape[:2]
+    x = max(0, min(x, frame_width - tile.width))
+    y = max(0, min(y, frame_height - tile.height))
+    height = min(tile.height, frame_height - y)
+    width = min(tile.width, frame_width - x)
+    if height <= 0 or width <= 0:
+        return
+    roi = frame[y:y + height, x:x + width]
+    cv2.blendLinear(
+        tile.colors[:height, :width], roi, tile.weight[:height, :width], tile.inverse_weight[:height, :width], dst=roi
+    )
+
+
+def _parse_color(value: str) -> Tuple[int, int, int]:
+    rgb = int(value, 16)
+    return rgb & 0xFF, (rgb >> 8) & 0xFF, (rgb >> 16) & 0xFF
+
+
+def date_format(date_style: str, time_style: str, show_week: bool) -> str:
+    """
+    把 sDateStyle（如 CHR-YYYY-MM-DD）和 sTimeStyle 转换为 strftime 格式
+    """
+    pattern = date_style.split("-", 1)[1] if date_style[:4] in ("CHR-", "ENG-") else date_style
+    pattern = pattern.replace("YYYY", "%Y").replace("MM", "%m").replace("DD", "%d")
+    if show_week:
+        pattern += " %a"
+    return pattern + (" %I:%M:%S %p" if time_style == "12hour" else " %H:%M:%S")
+
+
+class OSDStage(FrameStage):
+    """
+    OSD 叠加：通道名称、序列号只在配置变化时栅格化一次，时间每秒重新栅格化一次，
+    逐帧只用 NumPy 把缓存的 Tile 混合到对应区域
+    推理叠加取结果中心最近一帧的检测框，类别名称同样栅格化一次后按名称缓存
+    配置取自 state.osd_config，修订号为 config_revisions["osd"]
+    """
+
+    name = "osd"
+
+    def __init__(self, stream_id: int):
+        super().__init__(stream_id)
+        self.renders = 0
+        self._tiles: Dict[str, Tuple[tuple, Tile]] = {}
+        self._layout: List[Tuple[str, tuple, Optional[str], float, float]] = []
+        self._layout_key: Optional[tuple] = None
+        self._clock_format = ""
+        self._clock_second = -1
+        self._clock_text = ""
+        self._inference_style: Optional[tuple] = None
+        self._labels: Dict[str, Tile] = {}
+
+    @property
+    def enabled(self) -> bool:
+        config = state.osd_config or {}
+        return any(
+            config.get(overlay, {}).get("iEnabled")
+            for overlay in ("channelNameOverlay", "dateTimeOverlay", "SNOverlay", "inferenceOverlay")
+        )
+
+    def _inference_enabled(self) -> bool:
+        """
+        全局 inferenceOverlay 为总开关，各码流的 osd-inference 可以单独关闭
+        """
+        overlay = (state.osd_config or {}).get("inferenceOverlay", {})
+        stream = state.video_streams.get(self.stream_id, {}).get("osd-inference", {})
+        return bool(overlay.get("iEnabled")) and bool(stream.get("inferenceOverlay", {}).get("iEnabled", 1))
+
+    def _build_layout(self, frame_height: int) -> None:
+        """
+        根据配置计算每个叠加项的样式键和位置；样式键不变的 Tile 继续复用
+        """
+        config = state.osd_config or {}
+        attribute = config.get("attribute", {})
+        font_size = int(attribute.get("iOSDFontSize") or 0)
+        height = font_size * frame_height // _FONT_BASE_HEIGHT if font_size else frame_height // _ADAPTIVE_DIVISOR
+        height = max(8, height)
+        # 0 表示黑白自动（白字黑边），其他取值（1 或 customize）使用 sOSDFrontColor
+        outline = str(attribute.get("sOSDFrontColorMode", 1)) == "0"
+        style = (height, outline, _parse_color(attribute.get("sOSDFrontColor", "ffffff")))
+
+        layout = []
+        channel = config.get("channelNameOverlay", {})
+        if channel.get("iEnabled"):
+            layout.append(("channel", style, channel.get("sChannelName", ""), channel["iPositionX"], channel["iPositionY"]))
+        serial = config.get("SNOverlay", {})
+        if serial.get("iEnabled"):
+            layout.append(("serial", style, state.device_info.get("sSerialNumber", ""), serial["iPositionX"], serial["iPositionY"]))
+        clock = config.get("dateTimeOverlay", {})
+        if clock.get("iEnabled"):
+            self._clock_format = date_format(
+                clock.get("sDateStyle", "CHR-YYYY-MM-DD"), clock.get("sTimeStyle", "24hour"), bool(clock.get("iDisplayWeekEnabled"))
+            )
+            self._clock_second = -1
+            layout.append(("clock", style, None, clock["iPositionX"], clock["iPositionY"]))
+        self._layout = layout
+
+        # 检测框标签用一半字号，样式变化时清空标签缓存
+        inference_style = (max(8, height // 2), outline, style[2])
+        if inference_style != self._inference_style:
+            self._inference_style = inference_style
+            self._labels = {}
+
+        # 已经不在布局里的 Tile 释放掉
+        names = {item[0] for item in layout}
+        for name in list(self._tiles):
+            if name not in names:
+                del self._tiles[name]
+
+    def _tile(self, name: str, style: tuple, text: str) -> Tile:
+        key = (style, text)
+        cached = self._tiles.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        height, outline, color = style
+        tile = render_text(text, height, color, outline)
+        self._tiles[name] = (key, tile)
+        self.renders += 1
+        return tile
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        frame_height, frame_width = frame.shape[:2]
+        layout_key = (state.config_revisions.get("osd", 0), frame_height, frame_width)
+        if layout_key != self._layout_key:
+            self._build_layout(frame_height)
+            self._layout_key = layout_key
+
+        for name, style, text, position_x, position_y in self._layout:
+            if text is None:
+                second = int(now)
+                if second != self._clock_second:
+                    self._clock_second = second
+                    self._clock_text = time.strftime(self._clock_format, time.localtime(second))
+                text = self._clock_text
+            tile = self._tile(name, style, text)
+            blend(frame, tile, int(position_x * frame_width), int(position_y * frame_height))
+
+        if self._inference_enabled():
+            self._draw_results(frame, hub.latest, now)
+
+    def _label(self, text: str) -> Tile:
+        tile = self._labels.get(text)
+        if tile is None:
+            height, outline, color = self._inference_style
+            tile = self._labels[text] = render_text(text, height, color, outline)
+            self.renders += 1
+        return tile
+
+    def _draw_results(self, frame: np.ndarray, result: Optional[Dict[str, Any]], now: float) -> None:
+        """
+        把推理结果的检测框按帧尺寸缩放后画到帧上，结果的坐标以推理输入画面的分辨率为准
+        """
+        if result is None or abs(now - result["timestamp"]) > RESULT_MAX_AGE or not result["width"] or not result["height"]:
+            return
+        frame_height, frame_width = frame.shape[:2]
+        scale_x = frame_width / result["width"]
+        scale_y = frame_height / result["height"]
+        _, outline, color = self._inference_style
+        color = (255, 255, 255) if outline else color
+        thickness = max(1, frame_height // 360)
+        for detection in result["detections"]:
+            x1, y1 = int(detection["x1"] * scale_x), int(detection["y1"] * scale_y)
+            x2, y2 = int(detection["x2"] * scale_x), int(detection["y2"] * scale_y)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+            label = self._label(detection["class"])
+            blend(frame, label, x1, y1 - label.height)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import av
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+
+from .decode import parse_resolution
+from .relay import PacketFanout, PacketTrack
+
+logger = logging.getLogger(__name__)
+
+_START_CODE = b"\x00\x00\x00\x01"
+_NAL_SPS = 7
+
+_probe_cache: Dict[Tuple[str, float], Optional[Dict[str, Any]]] = {}
+
+
+def probe_video(video_path: str) -> Optional[Dict[str, Any]]:
+    """
+    获取文件视频流的编码格式、分辨率、帧率、码率和时长，按路径和修改时间缓存
+    """
+    try:
+        key = (video_path, os.path.getmtime(video_path))
+    except OSError:
+        return None
+    if key not in _probe_cache:
+        info = None
+        try:
+            with av.open(video_path) as container:
+                if container.streams.video:
+                    video = container.streams.video[0]
+                    info = {
+                        "codec": video.codec_context.name,
+                        "width": video.codec_context.width,
+                        "height": video.codec_context.height,
+                        "fps": float(video.average_rate or 0),
+                        "bit_rate": video.bit_rate or container.bit_rate or 0,
+                        "frame_count": video.frames,
+                        "duration": container.duration / av.time_base if container.duration else 0,
+                    }
+        except av.AVError as e:
+            logger.warning(f"无法识别视频文件 {video_path}: {str(e)}")
+        _probe_cache[key] = info
+    return _probe_cache[key]
+
+
+def passthrough_allowed(video_path: str, settings: Dict) -> bool:
+    """
+    文件是 H.264，且编码参数不要求降低分辨率、帧率或码率时才能直接转发
+    """
+    info = probe_video(video_path)
+    if info is None or info["codec"] != "h264":
+        return False
+    size = parse_resolution(settings.get("sResolution"))
+    if size is not None and (size[0] < info["width"] or size[1] < info["height"]):
+        return False
+    frame_rate = settings.get("sFrameRate")
+    if frame_rate and info["fps"] and float(frame_rate) < round(info["fps"]):
+        return False
+    max_rate = settings.get("iMaxRate")
+    if max_rate and info["bit_rate"] and max_rate * 1000 < info["bit_rate"]:
+        return False
+    return True
+
+
+def parse_avcc(extradata: Optional[bytes]) -> Tuple[int, bytes]:
+    """
+    解析 MP4 中 avcC 格式的 extradata
+    返回 NAL 长度字段的字节数和 Annex-B 格式的 SPS/PPS；extradata 本身就是 Annex-B 时长度返回 0
+    """
+    if not extradata or extradata[0] != 1:
+        return 0, extradata or b""
+    length_size = (extradata[4] & 0x03) + 1
+    parameter_sets = []
+    pos = 5
+    for mask in (0x1F, 0xFF):
+        # 先是 SPS（数量占低 5 位），然后是 PPS
+        count = extradata[pos] & mask
+        pos += 1
+        for _ in range(count):
+            size = int.from_bytes(extradata[pos:pos + 2], "big")
+            pos += 2
+            parameter_sets.append(_START_CODE + extradata[pos:pos + size])
+            pos += size
+    return length_size, b"".join(parameter_sets)
+
+
+def to_annexb(data: bytes, length_size: int) -> Tuple[bytes, bool]:
+    """
+    把长度前缀格式的 NAL 单元转换为起始码格式，同时返回其中是否带有 SPS
+    """
+    nals: List[bytes] = []
+    has_sps = False
+    pos = 0
+    while pos + length_size <= len(data):
+        size = int.from_bytes(data[pos:pos + length_size], "big")
+        pos += length_size
+        nal = data[pos:pos + size]
+        pos += size
+        if nal:
+            has_sps = has_sps or (nal[0] & 0x1F) == _NAL_SPS
+            nals.append(_START_CODE + nal)
+    return b"".join(nals), has_sps
+
+
+class PassthroughStream(PacketFanout):
+    """
+    直通码流：用 PyAV 解复用 H.264 文件，数据包不解码也不重新编码，直接分发给各连接做 RTP 打包
+    按文件时间戳控制节奏，文件结束后循环播放，时间戳连续递增
+    """
+
+    label = "直通"
+
+    def __init__(self, stream_id: int, video_path: str):
+        super().__init__(stream_id)
+        self.video_path = video_path
+        self.packets_read = 0
+        self.keyframes = 0
+        self.keyframe_requests = 0
+        self.loops = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_event_loop()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._demux, args=(self._stop_event,), name=f"passthrough-{self.stream_id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread = None
+        self._stop_subscribers()
+
+    def request_keyframe(self) -> None:
+        """
+        直通模式无法强制关键帧，没有缓存的 GOP 时新连接等待文件中的下一个关键帧
+        """
+        self.keyframe_requests += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream_id": self.stream_id,
+            "video_path": self.video_path,
+            "running": self.running,
+            "subscribers": len(self._subscribers),
+            "packets_read": self.packets_read,
+            "keyframes": self.keyframes,
+            "keyframe_requests": self.keyframe_requests,
+            "instant_starts": self.instant_starts,
+            "keep_alive": self.keep_alive,
+            "loops": self.loops,
+        }
+
+    def _finish(self, stop_event: threading.Event) -> None:
+        if stop_event.is_set():
+            # 正常停止，订阅者已经处理过
+            return
+        self._thread = None
+        self._stop_subscribers()
+
+    def _demux(self, stop_event: threading.Event) -> None:
+        """
+        在解复用线程中执行，数据包通过 call_soon_threadsafe 交给事件循环分发
+        """
+        loop = self._loop
+        try:
+            with av.open(self.video_path) as container:
+                video = container.streams.video[0]
+                codec = video.codec_context
+                if codec.name != "h264":
+                    raise RuntimeError(f"直通模式只支持 H.264，当前为 {codec.name}")
+                if getattr(codec, "has_b_frames", False):
+                    logger.warning(f"码流 {self.stream_id} 源文件带有 B 帧，部分浏览器可能出现卡顿")
+                length_size, parameter_sets = parse_avcc(codec.extradata)
+                time_base = video.time_base
+                frame_ticks = int(VIDEO_CLOCK_RATE / float(video.average_rate or 30))
+                logger.info(f"码流 {self.stream_id} 直通已打开: {self.video_path}")
+
+                start_time = time.monotonic()
+                offset = 0
+                while not stop_event.is_set():
+                    first_dts = None
+                    last_pts = 0
+                    for packet in container.demux(video):
+                        if stop_event.is_set():
+                            break
+                        if packet.size == 0 or packet.pts is None:
+                            continue
+                        dts = packet.dts if packet.dts is not None else packet.pts
+                        if first_dts is None:
+                            first_dts = dts
+                        pts = offset + int((packet.pts - first_dts) * time_base * VIDEO_CLOCK_RATE)
+                        send_at = (offset + int((dts - first_dts) * time_base * VIDEO_CLOCK_RATE)) / VIDEO_CLOCK_RATE
+                        last_pts = max(last_pts, pts)
+
+                        # 按解码顺序的时间戳控制发送节奏
+                        sleep_time = send_at - (time.monotonic() - start_time)
+                        if sleep_time > 0 and stop_event.wait(sleep_time):
+                            break
+
+                        data = bytes(packet)
+                        if length_size:
+                            data, has_sps = to_annexb(data, length_size)
+                        else:
+                            has_sps = True
+                        if packet.is_keyframe:
+                            self.keyframes += 1
+                            if not has_sps:
+                                # 每个关键帧前补上 SPS/PPS，中途加入的连接才能直接解码
+                                data = parameter_sets + data
+                        out = av.Packet(data)
+                        out.pts = pts
+                        out.dts = pts
+                        out.time_base = VIDEO_TIME_BASE
+                        out.is_keyframe = packet.is_keyframe
+                        self.packets_read += 1
+                        loop.call_soon_threadsafe(self._dispatch, out)
+                    if stop_event.is_set():
+                        break
+                    # 文件结束，回到开头继续播放，时间戳接在上一轮之后
+                    container.seek(0, stream=video)
+                    offset = last_pts + frame_ticks
+                    self.loops += 1
+                    logger.info("视频播放完毕，重新开始循环播放")
+        except Exception as e:
+            logger.error(f"码流 {self.stream_id} 直通失败: {str(e)}")
+        finally:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._finish, stop_event)
+
+
+class PassthroughRegistry:
+    """
+    按 stream_id 管理直通码流
+    """
+
+    def __init__(self):
+        self._streams: Dict[int, PassthroughStream] = {}
+
+    def open(self, stream_id: int, video_path: str) -> PassthroughStream:
+        stream = self._streams.get(stream_id)
+        if stream is None or (stream.video_path != video_path and not stream.running):
+            stream = PassthroughStream(stream_id, video_path)
+            self._streams[stream_id] = stream
+        return stream
+
+    def subscribe(self, stream_id: int, video_path: str) -> PacketTrack:
+        return self.open(stream_id, video_path).subscribe()
+
+    def get(self, stream_id: int) -> Optional[PassthroughStream]:
+        return self._streams.get(stream_id)
+
+    def items(self):
+        return self._streams.items()
+
+    def shutdown(self) -> None:
+        for stream in self._streams.values():
+            stream.stop()
+        self._streams.clear()
+
+
+passthroughs = PassthroughRegistry()
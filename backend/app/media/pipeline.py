@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStage(ABC):
+    """
+    帧处理阶段：在解码线程中对帧总线槽位里的 BGR 帧原地处理，所有消费者看到的都是处理后的帧
+    """
+
+    name = "stage"
+
+    def __init__(self, stream_id: int):
+        self.stream_id = stream_id
+
+    @property
+    def enabled(self) -> bool:
+        return False
+
+    @abstractmethod
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        ...
+
+
+class FramePipeline:
+    """
+    单路码流的帧处理阶段列表
+    有启用的阶段时画面会被修改，直通模式不可用
+    """
+
+    def __init__(self, stream_id: int, stages: List[FrameStage]):
+        self.stream_id = stream_id
+        self.stages = stages
+        self.frames = 0
+        self._time: Dict[str, float] = {stage.name: 0.0 for stage in stages}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return any(stage.enabled for stage in self.stages)
+
+    def process(self, frame: np.ndarray) -> None:
+        now = time.time()
+        with self._lock:
+            for stage in self.stages:
+                if not stage.enabled:
+                    continue
+                start = time.perf_counter()
+                stage.apply(frame, now)
+                self._time[stage.name] += time.perf_counter() - start
+            self.frames += 1
+
+    def stats(self) -> Dict[str, Any]:
+        frames = self.frames or 1
+        return {
+            "active": self.active,
+            "frames": self.frames,
+            "stages": {
+                stage.name: {
+                    "enabled": stage.enabled,
+                    "avg_ms": round(self._time[stage.name] / frames * 1000, 3),
+                }
+                for stage in self.stages
+            },
+        }
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+YOLOV5 = "yolov5"
+YOLOV8 = "yolov8"
+# 进入 NMS 的候选框上限，IoU 矩阵的大小是它的平方
+MAX_CANDIDATES = 1024
+
+
+@dataclass
+class PostprocessConfig:
+    """
+    检测模型的后处理参数，取自 model_configs 中的 dConfig
+    """
+    threshold: float = 0.25
+    iou_threshold: float = 0.45
+    max_objects: int = 300
+    labels: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_model_config(cls, config: Optional[Dict]) -> "PostprocessConfig":
+        config = config or {}
+        return cls(
+            threshold=float(config.get("fThr", cls.threshold)),
+            iou_threshold=float(config.get("fIouThr", cls.iou_threshold)),
+            max_objects=int(config.get("iMaxObject", cls.max_objects)),
+            labels=list(config.get("lLablel", [])),
+        )
+
+    @classmethod
+    def from_metrics(cls, metrics: Dict, labels: Optional[List[str]] = None) -> "PostprocessConfig":
+        """
+        ModelInfo.metrics 中的 iou、confidence 为百分数，topk 为最大目标数
+        """
+        default = cls()
+        return cls(
+            threshold=metrics["confidence"] / 100 if metrics.get("confidence") is not None else default.threshold,
+            iou_threshold=metrics["iou"] / 100 if metrics.get("iou") is not None else default.iou_threshold,
+            max_objects=metrics.get("topk") or default.max_objects,
+            labels=list(labels or []),
+        )
+
+
+@dataclass
+class Detections:
+    """
+    一帧的检测结果，按置信度从高到低排列；boxes 为 x1, y1, x2, y2
+    """
+    boxes: np.ndarray
+    scores: np.ndarray
+    class_ids: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64))
+
+    def take(self, index) -> "Detections":
+        return Detections(self.boxes[index], self.scores[index], self.class_ids[index])
+
+
+def _xywh_to_xyxy(xywh: np.ndarray) -> np.ndarray:
+    half = xywh[:, 2:4] / 2
+    return np.concatenate([xywh[:, :2] - half, xywh[:, :2] + half], axis=1)
+
+
+def decode_yolov8(output: np.ndarray, threshold: float) -> Detections:
+    """
+    YOLOv8 输出 (1, 4 + 类别数, N)：先沿类别轴取最大值筛掉低分锚点，只对剩下的列取类别和框
+    """
+    output = output.reshape(output.shape[-2:])
+    class_scores = output[4:]
+    best = class_scores.max(axis=0)
+    candidates = np.flatnonzero(best >= threshold)
+    if not len(candidates):
+        return Detections.empty()
+    class_ids = class_scores[:, candidates].argmax(axis=0)
+    boxes = _xywh_to_xyxy(output[:4, candidates].T)
+    return Detections(boxes, best[candidates], class_ids)
+
+
+def decode_yolov5(output: np.ndarray, threshold: float) -> Detections:
+    """
+    YOLOv5 输出 (1, N, 5 + 类别数)：置信度为目标分数乘类别分数，目标分数本身低于阈值的行先筛掉
+    """
+    output = output.reshape(output.shape[-2:])
+    candidates = np.flatnonzero(output[:, 4] >= threshold)
+    if not len(candidates):
+        return Detections.empty()
+    rows = output[candidates]
+    class_scores = rows[:, 5:] * rows[:, 4:5]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(rows)), class_ids]
+    keep = scores >= threshold
+    return Detections(_xywh_to_xyxy(rows[keep, :4]), scores[keep], class_ids[keep])
+
+
+def decode(output: np.ndarray, threshold: float, layout: Optional[str] = None) -> Detections:
+    """
+    未指定格式时按张量形状区分：YOLOv8 通道在前（4 + 类别数 < 锚点数），YOLOv5 锚点在前
+    """
+    if layout is None:
+        rows, columns = output.shape[-2:]
+        layout = YOLOV8 if rows < columns else YOLOV5
+    if layout == YOLOV8:
+        return decode_yolov8(output, threshold)
+    return decode_yolov5(output, threshold)
+
+
+def box_iou(boxes: np.ndarray) -> np.ndarray:
+    """
+    两两之间的 IoU 矩阵；逐个坐标做外积式的广播，避免在长度为 2 的末轴上归约
+    """
+    x1, y1, x2, y2 = np.ascontiguousarray(boxes.T, np.float32)
+    width = np.minimum.outer(x2, x2)
+    width -= np.maximum.outer(x1, x1)
+    np.maximum(width, 0, out=width)
+    height = np.minimum.outer(y2, y2)
+    height -= np.maximum.outer(y1, y1)
+    np.maximum(height, 0, out=height)
+    overlap = width
+    overlap *= height
+    area = (x2 - x1) * (y2 - y1)
+    union = np.add.outer(area, area)
+    union -= overlap
+    np.maximum(union, 1e-9, out=union)
+    overlap /= union
+    return overlap
+
+
+def nms(detections: Detections, iou_threshold: float) -> np.ndarray:
+    """
+    按类别的 NMS，detections 需已按置信度降序排列，返回保留项的下标
+    用整体迭代（Cluster-NMS）代替逐框循环：每轮只让仍被保留的框去抑制排在它后面的同类框，
+    直到保留集合不再变化，结果与逐框的贪心 NMS 相同，迭代次数只取决于相互抑制的链长
+    """
+    count = len(detections)
+    if count <= 1:
+        return np.arange(count)
+    # 不同类别的框平移到互不重叠的区域，一次 IoU 计算即可按类别抑制
+    boxes = detections.boxes + (detections.class_ids * (detections.boxes.max() - detections.boxes.min() + 1))[:, None]
+    # 重叠对很稀疏，只保留排在前面的框抑制后面的框的 (i, j) 对
+    first, second = np.divmod(np.flatnonzero(box_iou(boxes) > iou_threshold), count)
+    forward = first < second
+    first, second = first[forward], second[forward]
+    keep = np.ones(count, bool)
+    while True:
+        updated = np.ones(count, bool)
+        updated[second[keep[first]]] = False
+        if np.array_equal(updated, keep):
+            break
+        keep = updated
+    return np.flatnonzero(keep)
+
+
+def postprocess(output: np.ndarray, config: PostprocessConfig, layout: Optional[str] = None) -> Detections:
+    """
+    解码、阈值过滤、按类别 NMS、取前 max_objects 个，全程为数组运算
+    """
+    detections = decode(output, config.threshold, layout)
+    if not len(detections):
+        return detections
+    order = np.argsort(-detections.scores, kind="stable")
+    if len(order) > MAX_CANDIDATES:
+        order = order[:MAX_CANDIDATES]
+    detections = detections.take(order)
+    keep = nms(detections, config.iou_threshold)[:config.max_objects]
+    return detections.take(keep)
+
+
+def to_dicts(detections: Detections, labels: List[str]) -> List[Dict]:
+    """
+    转换为接口输出的结构，坐标取整
+    """
+    boxes = detections.boxes.round().astype(int).tolist()
+    class_ids = detections.class_ids.tolist()
+    scores = np.round(detections.scores.astype(np.float64), 3).tolist()
+    return [
+        {
+            "class_id": class_id,
+            "class": labels[class_id] if class_id < len(labels) else str(class_id),
+            "confidence": score,
+            "x1": box[0],
+            "y1": box[1],
+            "x2": box[2],
+            "y2": box[3],
+        }
+        for box, class_id, score in zip(boxes, class_ids, scores)
+    ]
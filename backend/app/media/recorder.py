@@ -0,0 +1,630 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+import av
+import cv2
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+from ..events import events
+from ..state import state
+from .relay import PacketFanout, PacketTrack
+from .rules import RECORD_TRIGGER
+from .schedule import local_week_second, weekly_schedule
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MP4 = "mp4"
+FORMAT_JPG = "jpg"
+FORMAT_RAW = "raw"
+_SUFFIXES = {FORMAT_MP4: ".mp4", FORMAT_JPG: ".jpg", FORMAT_RAW: ".h264"}
+
+# 预录缓存的上限，按时长和字节数同时限制，至少保留最新的一个 GOP
+PREROLL_SECONDS = 5.0
+PREROLL_BYTES = 4 * 1024 * 1024
+# 单次触发（定时、GPIO 边沿、TTY 命令）的录制时长，持续触发（推理规则、电平）解除后再录的时长
+CLIP_SECONDS = 10.0
+POSTROLL_SECONDS = 3.0
+# 单个文件的最长时长，超过后在下一个关键帧切换到新文件
+MAX_CLIP_SECONDS = 300.0
+# 写入线程积压的数据包上限，超出说明存储跟不上，丢弃到下一个关键帧
+WRITE_QUEUE_PACKETS = 600
+# 码流意外停止后重新订阅的间隔
+REOPEN_DELAY = 1.0
+
+
+def packet_seconds(packet: av.Packet) -> float:
+    return float(packet.pts * (packet.time_base or VIDEO_TIME_BASE))
+
+
+class PacketRing:
+    """
+    按 GOP 对齐的预录缓存：每个 GOP 以关键帧开始，超出时长或字节上限时整 GOP 丢弃最旧的，
+    取出的预录数据总是从关键帧开始，写入文件无需重新编码
+    """
+
+    def __init__(self, max_seconds: float = PREROLL_SECONDS, max_bytes: int = PREROLL_BYTES):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.gops: Deque[List[av.Packet]] = deque()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return sum(len(gop) for gop in self.gops)
+
+    @property
+    def seconds(self) -> float:
+        if not self.gops:
+            return 0.0
+        return packet_seconds(self.gops[-1][-1]) - packet_seconds(self.gops[0][0])
+
+    def append(self, packet: av.Packet) -> None:
+        if packet.is_keyframe:
+            self.gops.append([])
+        elif not self.gops:
+            # 第一个关键帧之前的数据无法单独解码
+            return
+        self.gops[-1].append(packet)
+        self.bytes += packet.size
+        while len(self.gops) > 1 and (self.bytes > self.max_bytes or self.seconds > self.max_seconds):
+            self.bytes -= sum(item.size for item in self.gops.popleft())
+
+    def snapshot(self) -> List[av.Packet]:
+        return [packet for gop in self.gops for packet in gop]
+
+    def keyframe(self) -> Optional[av.Packet]:
+        return self.gops[-1][0] if self.gops else None
+
+    def clear(self) -> None:
+        self.gops.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "gops": len(self.gops),
+            "packets": len(self),
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 2),
+        }
+
+
+class Clip:
+    """
+    一个录制文件；路径和存储槽位在事件循环中确定，文件的打开、写入和关闭都在写入线程中进行
+    """
+
+    def __init__(self, stream_id: int, path: Path, fmt: str, slot: Dict[str, Any]):
+        self.stream_id = stream_id
+        self.path = path
+        self.format = fmt
+        self.slot = slot
+        self.first_pts: Optional[float] = None
+        self.packets = 0
+        self.dropping = False
+        # 以下只在写入线程中访问
+        self.container: Optional[av.container.OutputContainer] = None
+        self.output: Optional[av.video.stream.VideoStream] = None
+        self.file = None
+        self.base: Optional[int] = None
+        self.last_dts: Optional[int] = None
+        self.opened = False
+        self.failed = False
+
+
+def decode_keyframe(packet: av.Packet) -> av.VideoFrame:
+    """
+    解码一个关键帧（数据包内带 SPS/PPS），用于获取画面尺寸和生成截图
+    """
+    codec = av.CodecContext.create("h264", "r")
+    frames = codec.decode(av.Packet(bytes(packet)))
+    frames = frames or codec.decode(None)
+    if not frames:
+        raise ValueError("关键帧无法解码")
+    return frames[0]
+
+
+class ClipWriter:
+    """
+    录制文件写入线程：事件循环只把数据包放进队列，打开文件、封装和落盘都在这里完成，
+    存储卡写入慢或卡顿时不会阻塞实时码流；所有码流共用一个线程，对存储卡顺序写入
+    """
+
+    def __init__(self, max_packets: int = WRITE_QUEUE_PACKETS):
+        self.max_packets = max_packets
+        self.packets_written = 0
+        self.bytes_written = 0
+        self.files_written = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writing: Dict[str, int] = {}
+        # 已分配给未关闭文件的路径，写入线程创建文件之前同名路径也不会被再次分配
+        self.reserved: Set[Path] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        if not self.running:
+            self._thread = threading.Thread(target=self._run, name="clip-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = False, timeout: float = 5.0) -> None:
+        """
+        队列中已有的数据写完后线程退出；wait 为 False 时不等待，事件循环中调用不会被存储卡阻塞
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            if wait:
+                self._thread.join(timeout)
+            self._thread = None
+            self._queue = queue.Queue()
+
+    def write(self, clip: Clip, packet: av.Packet) -> bool:
+        """
+        放入一个数据包，积压超过上限时返回 False
+        """
+        if self._queue.qsize() >= self.max_packets:
+            return False
+        self._queue.put((clip, packet))
+        return True
+
+    def close(self, clip: Clip) -> None:
+        self._queue.put((clip, None))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        等待队列中已有的数据写完，供测试和关闭时使用
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self) -> None:
+        # 停止后重新启动的线程使用新的队列，旧线程写完自己的队列后退出
+        items = self._queue
+        opened: Set[Clip] = set()
+        while True:
+            item = items.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            clip, packet = item
+            try:
+                if packet is None:
+                    opened.discard(clip)
+                    self._close(clip)
+                    self._notify(self.reserved.discard, clip.path)
+                    continue
+                if clip.failed:
+                    continue
+                if not clip.opened:
+                    self._open(clip, packet)
+                    opened.add(clip)
+                self._write(clip, packet)
+            except Exception as exc:
+                self.errors += 1
+                self.last_error = f"{clip.path}: {exc}"
+                logger.error(f"写入录制文件 {clip.path} 失败: {exc}")
+                # 出错的文件丢弃剩余数据，不影响其他文件
+                clip.failed = True
+                opened.discard(clip)
+                self._close(clip)
+        for clip in opened:
+            self._close(clip)
+
+    def _open(self, clip: Clip, packet: av.Packet) -> None:
+        clip.base = packet.pts
+        clip.path.parent.mkdir(parents=True, exist_ok=True)
+        if clip.format == FORMAT_RAW:
+            # 数据包本身就是带参数集的 Annex-B 码流，直接拼接即可播放
+            clip.file = open(clip.path, "wb")
+        elif clip.format == FORMAT_MP4:
+            frame = decode_keyframe(packet)
+            clip.container = av.open(str(clip.path), "w", format="mp4")
+            # 不重新编码：mp4 封装器从带内的 SPS/PPS 生成 avcC
+            clip.output = clip.container.add_stream("h264")
+            clip.output.width = frame.width
+            clip.output.height = frame.height
+            clip.output.time_base = VIDEO_TIME_BASE
+        clip.opened = True
+        self._notify(self._set_writing, clip.slot, 1)
+        logger.info(f"码流 {clip.stream_id} 开始录制: {clip.path}")
+
+    def _write(self, clip: Clip, packet: av.Packet) -> None:
+        if clip.format == FORMAT_JPG:
+            image = decode_keyframe(packet).to_ndarray(format="bgr24")
+            ok, data = cv2.imencode(".jpg", image)
+            if not ok:
+                raise ValueError("JPEG 编码失败")
+            clip.path.write_bytes(data.tobytes())
+            self.bytes_written += len(data)
+        elif clip.format == FORMAT_RAW:
+            clip.file.write(bytes(packet))
+            self.bytes_written += packet.size
+        else:
+            # 时间戳从文件第一个数据包开始；直通文件循环播放等情况下 dts 不递增时顺延
+            dts = packet.dts if packet.dts is not None else packet.pts
+            dts -= clip.base
+            if clip.last_dts is not None and dts <= clip.last_dts:
+                dts = clip.last_dts + 1
+            clip.last_dts = dts
+            output = av.Packet(bytes(packet))
+            output.pts = max(packet.pts - clip.base, dts)
+            output.dts = dts
+            output.time_base = packet.time_base or VIDEO_TIME_BASE
+            output.is_keyframe = packet.is_keyframe
+            output.stream = clip.output
+            clip.container.mux(output)
+            self.bytes_written += packet.size
+        self.packets_written += 1
+
+    def _close(self, clip: Clip) -> None:
+        if not clip.opened:
+            return
+        clip.opened = False
+        try:
+            if clip.container is not None:
+                clip.container.close()
+            if clip.file is not None:
+                clip.file.close()
+        except Exception as exc:
+            self.errors += 1
+            self.last_error = f"{clip.path}: {exc}"
+            logger.error(f"关闭录制文件 {clip.path} 失败: {exc}")
+        finally:
+            clip.container = clip.output = clip.file = None
+            self.files_written += 1
+            self._notify(self._set_writing, clip.slot, -1)
+            logger.info(f"码流 {clip.stream_id} 录制结束: {clip.path}")
+
+    def _notify(self, callback: Callable[..., None], *args: Any) -> None:
+        """
+        存储状态只在事件循环中修改，写入线程通过 call_soon_threadsafe 交回
+        """
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                pass
+
+    def _set_writing(self, slot: Dict[str, Any], delta: int) -> None:
+        """
+        槽位上有打开的录制文件时 bWriting 为 True，多路码流同时录制时按文件计数；在事件循环中执行
+        """
+        count = self._writing.get(slot["sDevPath"], 0) + delta
+        self._writing[slot["sDevPath"]] = count
+        if slot["bWriting"] != (count > 0):
+            slot["bWriting"] = count > 0
+            state.storage_status["iRevision"] += 1
+
+
+def enabled_slot() -> Optional[Dict[str, Any]]:
+    dev_path = state.storage_config.get("sEnabledSlotDevPath")
+    for slot in state.storage_status["lSlots"]:
+        if slot["sDevPath"] == dev_path and slot["bEnabled"]:
+            return slot
+    return None
+
+
+def clip_path(slot: Dict[str, Any], stream_id: int, fmt: str, timestamp: float, reserved: Set[Path]) -> Path:
+    """
+    <sMountPath>/<sDataDirName>/<日期>/<日期 时间> video<码流>.mp4，同一秒内的文件加序号区分
+    返回的路径加入 reserved，文件还没有创建时也不会分配给下一个文件
+    """
+    local = time.localtime(timestamp)
+    directory = Path(slot["sMountPath"]) / state.storage_status.get("sDataDirName", "DCIM") / time.strftime("%Y-%m-%d", local)
+    name = f"{time.strftime('%Y-%m-%d %H-%M-%S', local)} {'image' if fmt == FORMAT_JPG else 'video'}{stream_id}"
+    path = directory / f"{name}{_SUFFIXES[fmt]}"
+    index = 1
+    while path in reserved or path.exists():
+        path = directory / f"{name} ({index}){_SUFFIXES[fmt]}"
+        index += 1
+    reserved.add(path)
+    return path
+
+
+class RecorderTrack(PacketTrack):
+    """
+    录制用的订阅者：数据包直接交给录制器，不经过发送队列
+    """
+
+    def __init__(self, stream: PacketFanout, on_packet: Callable[[av.Packet], None], on_ended: Callable[["RecorderTrack"], None]):
+        super().__init__(stream)
+        self._on_packet = on_packet
+        self._on_ended = on_ended
+
+    def _put(self, packet: av.Packet) -> None:
+        self._on_packet(packet)
+
+    def request_keyframe(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        live = self.readyState == "live"
+        super().stop()
+        if live:
+            self._on_ended(self)
+
+
+class StreamRecorder:
+    """
+    一路码流的录制：持续把数据包放进预录缓存；录制时先写入预录数据，之后的数据包直接交给写入线程
+    """
+
+    def __init__(self, recorder: "Recorder", stream_id: int, open_stream: Callable[[], PacketFanout]):
+        self.recorder = recorder
+        self.stream_id = stream_id
+        self.ring = PacketRing()
+        self.clip: Optional[Clip] = None
+        self.clips = 0
+        self.packets_dropped = 0
+        self._open_stream = open_stream
+        self._track: Optional[RecorderTrack] = None
+        self._reopen: Optional[asyncio.TimerHandle] = None
+        self._last_open = float("-inf")
+
+    def attach(self) -> None:
+        self._reopen = None
+        self._track = RecorderTrack(self._open_stream(), self.feed, self._ended)
+        self._track.stream.subscribe(self._track)
+
+    def detach(self) -> None:
+        if self._reopen is not None:
+            self._reopen.cancel()
+            self._reopen = None
+        track, self._track = self._track, None
+        if track is not None:
+            track.stop()
+        self.finish()
+        self.ring.clear()
+
+    def reattach(self) -> None:
+        """
+        管线切换后（例如启用遮挡后直通改为共享编码）改订阅新的已编码码流：当前文件在切换处结束，
+        预录缓存来自旧码流，一并清空；正在录制时新文件从新码流的第一个关键帧开始
+        """
+        track = self._track
+        if track is None:
+            return
+        stream = self._open_stream()
+        if stream is track.stream:
+            return
+        logger.info(f"码流 {self.stream_id} 录制切换到{stream.label}")
+        recording = self.clip is not None
+        self.finish()
+        self.ring.clear()
+        self._track = RecorderTrack(stream, self.feed, self._ended)
+        stream.subscribe(self._track)
+        track.stop()
+        if recording:
+            self._last_open = float("-inf")
+            self.begin(asyncio.get_running_loop().time())
+
+    def _ended(self, track: RecorderTrack) -> None:
+        if track is not self._track:
+            return
+        # 码流停止（文件打开失败、管线切换等），结束当前文件，稍后重新订阅
+        logger.warning(f"码流 {self.stream_id} 录制订阅已停止，{REOPEN_DELAY} 秒后重新订阅")
+        self._track = None
+        self.finish()
+        self.ring.clear()
+        self._reopen = asyncio.get_running_loop().call_later(REOPEN_DELAY, self.attach)
+
+    def begin(self, now: float) -> None:
+        """
+        开始录制：mp4/raw 已在录制时什么也不做；jpg 每次触发保存一张最近关键帧的截图
+        两次开始之间不足 iIntervalMs 时忽略
+        """
+        fmt = self.recorder.format
+        if self.clip is not None:
+            return
+        if now - self._last_open < self.recorder.interval:
+            self.recorder.skipped += 1
+            return
+        slot = enabled_slot()
+        if slot is None:
+            self.recorder.skipped += 1
+            logger.warning(f"码流 {self.stream_id} 录制触发被忽略：没有启用的存储槽位")
+            return
+        self._last_open = now
+        self.clip = Clip(self.stream_id, clip_path(slot, self.stream_id, fmt, time.time(), self.recorder.writer.reserved), fmt, slot)
+        self.clips += 1
+        if fmt == FORMAT_JPG:
+            keyframe = self.ring.keyframe()
+            if keyframe is not None:
+                self._write(keyframe)
+            return
+        for packet in self.ring.snapshot():
+            self._write(packet)
+
+    def finish(self) -> None:
+        clip, self.clip = self.clip, None
+        if clip is not None:
+            self.recorder.writer.close(clip)
+
+    def feed(self, packet: av.Packet) -> None:
+        self.ring.append(packet)
+        clip = self.clip
+        if clip is None:
+            return
+        if packet.is_keyframe and clip.packets:
+            # 文件只在关键帧处结束或切换，下一个文件可以独立解码
+            if not self.recorder.recording():
+                self.finish()
+                return
+            if packet_seconds(packet) - clip.first_pts >= MAX_CLIP_SECONDS:
+                self.finish()
+                self._last_open = float("-inf")
+                self.begin(asyncio.get_running_loop().time())
+                return
+        self._write(packet)
+
+    def _write(self, packet: av.Packet) -> None:
+        clip = self.clip
+        if clip.packets == 0 or clip.dropping:
+            if not packet.is_keyframe:
+                self.packets_dropped += clip.dropping
+                return
+            clip.dropping = False
+        if not self.recorder.writer.write(clip, packet):
+            self.packets_dropped += 1
+            clip.dropping = True
+            return
+        if clip.first_pts is None:
+            clip.first_pts = packet_seconds(packet)
+        clip.packets += 1
+        if clip.format == FORMAT_JPG:
+            self.finish()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream_id": self.stream_id,
+            "attached": self._track is not None,
+            "recording": self.clip is not None,
+            "path": str(self.clip.path) if self.clip else None,
+            "clips": self.clips,
+            "packets_dropped": self.packets_dropped,
+            "preroll": self.ring.stats(),
+        }
+
+
+class Recorder:
+    """
+    录制服务：规则总开关打开且有启用的存储槽位时，订阅各路已编码码流并维护预录缓存；
+    收到录制触发事件后按 dWriterConfig 写文件，持续触发（start/stop）解除后再录 POSTROLL_SECONDS，
+    单次触发（trigger）录 CLIP_SECONDS，重复触发顺延；配置了计划时只在计划内录制
+    """
+
+    def __init__(self):
+        self.writer = ClipWriter()
+        self.streams: Dict[int, StreamRecorder] = {}
+        self.format = FORMAT_MP4
+        self.interval = 0.0
+        self.triggers = 0
+        self.skipped = 0
+        self._holds: Set[str] = set()
+        self._deadline = float("-inf")
+        self._listening = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.streams)
+
+    def configure(self, rule_config: Dict[str, Any], sources: Dict[int, Callable[[], PacketFanout]]) -> None:
+        """
+        sources 为各路码流打开已编码码流的函数；规则总开关关闭或没有启用的槽位时停止录制
+        """
+        writer_config = rule_config.get("dWriterConfig") or {}
+        fmt = writer_config.get("sFormat", FORMAT_MP4)
+        if fmt not in _SUFFIXES:
+            raise ValueError(f"不支持的录制格式: {fmt}")
+        if not (rule_config.get("bRuleEnabled") and enabled_slot() is not None and sources):
+            self.stop()
+            return
+        if fmt != self.format:
+            for stream in self.streams.values():
+                stream.finish()
+        self.format = fmt
+        self.interval = max(0, int(writer_config.get("iIntervalMs") or 0)) / 1000
+        for stream_id in set(self.streams) - set(sources):
+            self.streams.pop(stream_id).detach()
+        self.writer.start()
+        for stream_id, open_stream in sources.items():
+            if stream_id not in self.streams:
+                self.streams[stream_id] = StreamRecorder(self, stream_id, open_stream)
+                self.streams[stream_id].attach()
+        if not self._listening:
+            events.add_listener(self._on_event)
+            self._listening = True
+
+    def stop(self, wait: bool = False) -> None:
+        if self._listening:
+            events.remove_listener(self._on_event)
+            self._listening = False
+        for stream in self.streams.values():
+            stream.detach()
+        self.streams.clear()
+        self._holds.clear()
+        self._deadline = float("-inf")
+        self.writer.stop(wait)
+
+    def reselect(self, stream_id: int) -> None:
+        """
+        码流的管线重新选择后调用，录制订阅跟随切换
+        """
+        stream = self.streams.get(stream_id)
+        if stream is not None:
+            stream.reattach()
+
+    def recording(self) -> bool:
+        if not self.allowed():
+            return False
+        return bool(self._holds) or asyncio.get_running_loop().time() < self._deadline
+
+    def allowed(self) -> bool:
+        schedule = weekly_schedule()
+        return not schedule.intervals or schedule.active(local_week_second(time.time()))
+
+    def _on_event(self, event: Dict[str, Any]) -> None:
+        if event["type"] != RECORD_TRIGGER:
+            return
+        data = event["data"]
+        source, action = data.get("source", ""), data.get("action")
+        now = asyncio.get_running_loop().time()
+        if action == "stop":
+            if source in self._holds:
+                self._holds.discard(source)
+                if not self._holds:
+                    self._deadline = max(self._deadline, now + POSTROLL_SECONDS)
+            return
+        if not self.allowed():
+            self.skipped += 1
+            return
+        if action == "start":
+            self._holds.add(source)
+        else:
+            self._deadline = max(self._deadline, now + CLIP_SECONDS)
+        self.triggers += 1
+        for stream in self.streams.values():
+            stream.begin(now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "format": self.format,
+            "holds": sorted(self._holds),
+            "triggers": self.triggers,
+            "skipped": self.skipped,
+            "streams": [stream.stats() for stream in self.streams.values()],
+            "writer": {
+                "running": self.writer.running,
+                "backlog": self.writer.backlog,
+                "files_written": self.writer.files_written,
+                "packets_written": self.writer.packets_written,
+                "bytes_written": self.writer.bytes_written,
+                "errors": self.writer.errors,
+                "last_error": self.writer.last_error,
+            },
+        }
+
+
+recorder = Recorder()
@@ -0,0 +1,449 @@
+from __future__ import annotations
+
+import asyncio
+import fractions
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import av
+from aiortc import MediaStreamTrack, RTCRtpSender
+from aiortc.mediastreams import VIDEO_TIME_BASE, MediaStreamError
+from aiortc.rtp import RTCP_PSFB_PLI, RtcpPsfbPacket
+from av import VideoFrame
+from av.video.frame import PictureType
+from av.video.reformatter import VideoReformatter
+
+from .source import SubscriberTrack
+
+logger = logging.getLogger(__name__)
+
+# aiortc 只处理 PLI，FIR 需要自己识别
+RTCP_PSFB_FIR = 4
+
+# 两次强制关键帧之间的最短间隔，窗口内所有连接的关键帧请求合并为一次
+KEYFRAME_MIN_INTERVAL = 0.5
+
+# 低档位的码率按级数递减，且不低于该值（kbps）
+MIN_RENDITION_KBPS = 150
+
+# 每个连接最多缓存的数据包数，超出说明该连接跟不上，丢弃并等待下一个关键帧
+PEER_QUEUE_SIZE = 120
+
+# 为新连接缓存的 GOP 最多包含的数据包数，需要给新连接的队列留出余量
+GOP_CACHE_SIZE = 90
+
+_H264_RTPMAP = re.compile(r"^a=rtpmap:\d+ H264/90000", re.MULTILINE | re.IGNORECASE)
+
+
+def offers_h264(sdp: str) -> bool:
+    """
+    判断对端 offer 是否支持 H.264
+    """
+    return _H264_RTPMAP.search(sdp) is not None
+
+
+def h264_preferences() -> List[Any]:
+    """
+    只保留 H.264（以及重传用的 rtx）的编解码器偏好，用于 setCodecPreferences
+    """
+    codecs = RTCRtpSender.getCapabilities("video").codecs
+    return [codec for codec in codecs if codec.mimeType.lower() in ("video/h264", "video/rtx")]
+
+
+def rendition_settings(settings: Dict, level: int) -> Dict:
+    """
+    第 level 档的编码参数：分辨率每档减半，码率每档约为上一档的三分之一
+    """
+    if level == 0:
+        return settings
+    max_rate = int(settings.get("iMaxRate") or 2048)
+    return {**settings, "iMaxRate": max(MIN_RENDITION_KBPS, max_rate // 3 ** level)}
+
+
+def _parse_profile(profile: Optional[str]) -> str:
+    profile = (profile or "baseline").lower()
+    return profile if profile in ("baseline", "main", "high") else "baseline"
+
+
+class PacketTrack(MediaStreamTrack):
+    """
+    输出已编码数据包的视频轨道，每个 WebRTC 连接一个
+    aiortc 收到 av.Packet 时只做 RTP 打包，不再为每个连接单独编码
+    """
+
+    kind = "video"
+
+    def __init__(self, stream: "EncodedStream"):
+        super().__init__()
+        self.stream = stream
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.bytes_sent = 0
+        self._packets: Deque[av.Packet] = deque()
+        self._ready = asyncio.Event()
+        # 新连接必须从关键帧开始解码
+        self._waiting_keyframe = True
+
+    def _put(self, packet: av.Packet) -> None:
+        if self._waiting_keyframe:
+            if not packet.is_keyframe:
+                return
+            self._waiting_keyframe = False
+        if len(self._packets) >= PEER_QUEUE_SIZE:
+            # 跟不上的连接丢掉积压的数据，从下一个关键帧重新开始
+            self.packets_dropped += len(self._packets)
+            self._packets.clear()
+            self._waiting_keyframe = True
+            self.stream.request_keyframe()
+            return
+        self._packets.append(packet)
+        self._ready.set()
+
+    async def recv(self) -> av.Packet:
+        while self.readyState == "live":
+            if self._packets:
+                packet = self._packets.popleft()
+                self.packets_sent += 1
+                self.bytes_sent += packet.size
+                return packet
+            self._ready.clear()
+            await self._ready.wait()
+        raise MediaStreamError
+
+    def request_keyframe(self) -> None:
+        self.stream.request_keyframe()
+
+    def switch(self, stream) -> None:
+        """
+        把连接切换到另一路已编码码流（例如直通和共享编码之间），轨道不变，对端无需重新协商
+        """
+        previous = self.stream
+        self._packets.clear()
+        self._waiting_keyframe = True
+        self.stream = stream
+        stream.subscribe(self)
+        previous.unsubscribe(self)
+
+    def stop(self) -> None:
+        if self.readyState == "live":
+            super().stop()
+            self._ready.set()
+            self.stream.unsubscribe(self)
+
+
+def bind_sender(
+    sender: RTCRtpSender, track: PacketTrack, on_rtcp: Optional[Callable[[Any], None]] = None
+) -> None:
+    """
+    接管发送端的 RTCP 关键帧请求（PLI/FIR），转交给共享编码器统一合并处理
+    on_rtcp 会收到该连接的所有 RTCP 包，用于码率自适应
+    """
+    handle_rtcp_packet = sender._handle_rtcp_packet
+
+    async def _handle_rtcp_packet(packet) -> None:
+        if on_rtcp is not None:
+            on_rtcp(packet)
+        if isinstance(packet, RtcpPsfbPacket) and packet.fmt in (RTCP_PSFB_PLI, RTCP_PSFB_FIR):
+            track.request_keyframe()
+            return
+        await handle_rtcp_packet(packet)
+
+    sender._handle_rtcp_packet = _handle_rtcp_packet
+
+
+class PacketFanout(ABC):
+    """
+    已编码码流的公共部分：把数据包分发给各连接，并缓存从最近一个关键帧开始的 GOP，
+    新连接先收到缓存的 GOP，不用等下一个关键帧就能立即出画面
+    keep_alive 为 True 时没有连接也保持运行（预热）
+    """
+
+    label = "已编码码流"
+
+    def __init__(self, stream_id: int):
+        self.stream_id = stream_id
+        self.keep_alive = False
+        self.instant_starts = 0
+        self._subscribers: Set[PacketTrack] = set()
+        self._gop: List[av.Packet] = []
+
+    @property
+    @abstractmethod
+    def running(self) -> bool:
+        ...
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @abstractmethod
+    def start(self) -> None:
+        ...
+
+    @abstractmethod
+    def stop(self) -> None:
+        ...
+
+    @abstractmethod
+    def request_keyframe(self) -> None:
+        ...
+
+    def subscribe(self, track: Optional[PacketTrack] = None) -> PacketTrack:
+        track = track or PacketTrack(self)
+        self._subscribers.add(track)
+        if not self.running:
+            self.start()
+        if not self._prefill(track):
+            self.request_keyframe()
+        logger.info(f"码流 {self.stream_id} {self.label}新增连接，当前连接数: {len(self._subscribers)}")
+        return track
+
+    def unsubscribe(self, track: PacketTrack) -> None:
+        self._subscribers.discard(track)
+        logger.info(f"码流 {self.stream_id} {self.label}连接离开，当前连接数: {len(self._subscribers)}")
+        if not self._subscribers and not self.keep_alive:
+            self.stop()
+
+    def _prefill(self, track: PacketTrack) -> bool:
+        """
+        用缓存的 GOP 预先填充新连接；GOP 超过 GOP_CACHE_SIZE 时不缓存，改为等待下一个关键帧
+        """
+        if not self._gop:
+            return False
+        for packet in self._gop:
+            track._put(packet)
+        self.instant_starts += 1
+        return True
+
+    def _dispatch(self, packet: av.Packet) -> None:
+        if packet.is_keyframe:
+            self._gop = [packet]
+        elif self._gop:
+            if len(self._gop) >= GOP_CACHE_SIZE:
+                self._gop = []
+            else:
+                self._gop.append(packet)
+        for track in list(self._subscribers):
+            track._put(packet)
+
+    def _stop_subscribers(self) -> None:
+        self._gop = []
+        for track in list(self._subscribers):
+            track.stop()
+
+
+class EncodedStream(PacketFanout):
+    """
+    共享 H.264 编码器：每路码流的每个档位只编码一次，编码后的数据包分发给所有连接
+    编码参数取自 state.video_streams[id]["encode"]；level > 0 的档位把输入帧按 1/2**level 缩小后再编码
+    """
+
+    label = "共享编码"
+
+    def __init__(self, stream_id: int, settings: Dict, open_input: Callable[[], SubscriberTrack], level: int = 0):
+        super().__init__(stream_id)
+        self.level = level
+        self.settings = rendition_settings(settings, level)
+        self.frames_encoded = 0
+        self.keyframes = 0
+        self.keyframe_requests = 0
+        self.encode_time = 0.0
+        self._open_input = open_input
+        self._input: Optional[SubscriberTrack] = None
+        self._task: Optional[asyncio.Task] = None
+        self._codec: Optional[av.CodecContext] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"encode-{stream_id}-{level}")
+        # 每个档位独立的缩放上下文，共享的输入帧不能在多个线程里用同一个 reformatter
+        self._reformatter = VideoReformatter()
+        self._force_keyframe = False
+        self._rebuild = False
+        self._last_keyframe = 0.0
+        self.reconfigurations = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        self._input = self._open_input()
+        self._task = asyncio.ensure_future(self._run(self._input))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._input is not None:
+            self._input.stop()
+            self._input = None
+        self._stop_subscribers()
+
+    def update_settings(self, settings: Dict) -> None:
+        """
+        应用新的编码参数：下一帧用新参数重建编码器，重建后的第一帧就是关键帧，连接无需重新协商
+        """
+        self.settings = rendition_settings(settings, self.level)
+        self._rebuild = True
+        self.reconfigurations += 1
+        logger.info(f"码流 {self.stream_id} 共享编码参数已更新，将在下一帧生效")
+
+    def request_keyframe(self) -> None:
+        """
+        请求关键帧；最小间隔内的多次请求（多个连接的 PLI/FIR、新连接加入）只触发一次
+        """
+        self.keyframe_requests += 1
+        if time.monotonic() - self._last_keyframe >= KEYFRAME_MIN_INTERVAL:
+            self._force_keyframe = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream_id": self.stream_id,
+            "level": self.level,
+            "running": self.running,
+            "subscribers": len(self._subscribers),
+            "frames_encoded": self.frames_encoded,
+            "keyframes": self.keyframes,
+            "keyframe_requests": self.keyframe_requests,
+            "instant_starts": self.instant_starts,
+            "keep_alive": self.keep_alive,
+            "reconfigurations": self.reconfigurations,
+            "width": self._codec.width if self._codec else 0,
+            "height": self._codec.height if self._codec else 0,
+            "bitrate_kbps": int(self.settings.get("iMaxRate") or 2048),
+            "gop": int(self.settings.get("iGOP") or 0),
+            "rc_mode": self.settings.get("sRCMode"),
+            "avg_encode_ms": round(self.encode_time / self.frames_encoded * 1000, 2) if self.frames_encoded else 0,
+        }
+
+    def _create_codec(self, frame: VideoFrame) -> av.CodecContext:
+        settings = self.settings
+        fps = int(settings.get("sFrameRate") or 30)
+        gop = int(settings.get("iGOP") or fps * 2)
+        bitrate = int(settings.get("iMaxRate") or 2048) * 1000
+
+        codec = av.CodecContext.create("libx264", "w")
+        codec.width = frame.width
+        codec.height = frame.height
+        codec.pix_fmt = "yuv420p"
+        codec.framerate = fractions.Fraction(fps, 1)
+        # 与输入帧相同的时间基，编码时不会改写共享帧的时间戳
+        codec.time_base = VIDEO_TIME_BASE
+        codec.bit_rate = bitrate
+        codec.gop_size = gop
+        x264_params = [f"keyint={gop}", f"min-keyint={gop}", "scenecut=0", "repeat-headers=1"]
+        if settings.get("sRCMode") == "CBR":
+            x264_params += [f"vbv-maxrate={bitrate // 1000}", f"vbv-bufsize={bitrate // 1000}", "nal-hrd=cbr"]
+        else:
+            x264_params += [f"vbv-maxrate={bitrate // 1000}", f"vbv-bufsize={bitrate * 2 // 1000}"]
+        codec.options = {
+            "profile": _parse_profile(settings.get("sH264Profile")),
+            "preset": "veryfast",
+            "tune": "zerolatency",
+            "x264-params": ":".join(x264_params),
+        }
+        codec.open()
+        logger.info(f"码流 {self.stream_id} 档位 {self.level} 共享编码器已创建: {frame.width}x{frame.height}, {bitrate // 1000}kbps, GOP {gop}")
+        return codec
+
+    def _scale(self, frame: VideoFrame) -> VideoFrame:
+        width = max(2, (frame.width >> self.level) // 2 * 2)
+        height = max(2, (frame.height >> self.level) // 2 * 2)
+        scaled = self._reformatter.reformat(frame, width=width, height=height, format="yuv420p")
+        scaled.pts = frame.pts
+        scaled.time_base = frame.time_base
+        return scaled
+
+    @staticmethod
+    def _keyframe_copy(frame: VideoFrame) -> VideoFrame:
+        copy = VideoFrame.from_ndarray(frame.to_ndarray(), format=frame.format.name)
+        copy.pts = frame.pts
+        copy.time_base = frame.time_base
+        copy.pict_type = PictureType.I
+        return copy
+
+    def _encode(self, frame: VideoFrame, force_keyframe: bool, rebuild: bool = False) -> List[av.Packet]:
+        """
+        在编码线程中执行
+        """
+        start = time.perf_counter()
+        if self.level:
+            # 缩放后的帧只属于这个档位，可以直接标记帧类型
+            frame = self._scale(frame)
+            frame.pict_type = PictureType.I if force_keyframe else PictureType.NONE
+        elif force_keyframe:
+            # 第 0 档的输入是各档位在各自线程中同时读取的共享帧，标记关键帧前先复制一份
+            frame = self._keyframe_copy(frame)
+        if rebuild or self._codec is None or self._codec.width != frame.width or self._codec.height != frame.height:
+            self._codec = self._create_codec(frame)
+        packets = self._codec.encode(frame)
+        for packet in packets:
+            packet.time_base = VIDEO_TIME_BASE
+        self.encode_time += time.perf_counter() - start
+        self.frames_encoded += 1
+        return packets
+
+    async def _run(self, input_track: SubscriberTrack) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while self._subscribers or self.keep_alive:
+                frame = await input_track.recv()
+                force_keyframe, rebuild = self._force_keyframe, self._rebuild
+                self._force_keyframe = self._rebuild = False
+                packets = await loop.run_in_executor(self._executor, self._encode, frame, force_keyframe, rebuild)
+                for packet in packets:
+                    if packet.is_keyframe:
+                        self.keyframes += 1
+                        self._last_keyframe = time.monotonic()
+                    self._dispatch(packet)
+        except (asyncio.CancelledError, MediaStreamError):
+            pass
+        except Exception as e:
+            logger.error(f"码流 {self.stream_id} 共享编码失败: {str(e)}")
+        finally:
+            self._codec = None
+            self._stop_subscribers()
+
+
+class EncoderRegistry:
+    """
+    按 (stream_id, 档位) 管理共享编码器
+    """
+
+    def __init__(self):
+        self._streams: Dict[Tuple[int, int], EncodedStream] = {}
+
+    def open(
+        self, stream_id: int, settings: Dict, open_input: Callable[[], SubscriberTrack], level: int = 0
+    ) -> EncodedStream:
+        stream = self._streams.get((stream_id, level))
+        if stream is None:
+            stream = EncodedStream(stream_id, settings, open_input, level)
+            self._streams[(stream_id, level)] = stream
+        elif not stream.running:
+            stream.settings = rendition_settings(settings, level)
+            stream._open_input = open_input
+        return stream
+
+    def subscribe(self, stream_id: int, settings: Dict, open_input: Callable[[], SubscriberTrack]) -> PacketTrack:
+        return self.open(stream_id, settings, open_input).subscribe()
+
+    def get(self, stream_id: int, level: int = 0) -> Optional[EncodedStream]:
+        return self._streams.get((stream_id, level))
+
+    def levels(self, stream_id: int) -> List[EncodedStream]:
+        return [stream for (sid, _), stream in sorted(self._streams.items()) if sid == stream_id]
+
+    def items(self):
+        return self._streams.items()
+
+    def shutdown(self) -> None:
+        for stream in self._streams.values():
+            stream.stop()
+        self._streams.clear()
+
+
+encoders = EncoderRegistry()
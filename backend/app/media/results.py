@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .decode import DROP_OLDEST, FrameQueue
+from .postprocess import Detections
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多积压的结果数，超过后丢弃最旧的
+DEFAULT_QUEUE_SIZE = 16
+
+# 二进制结果格式（小端）：24 字节帧头 + 每个目标 12 字节
+# 帧头: magic "RCIR" | version u8 | flags u8 | count u16 | seq u32 | timestamp f64 (秒) | width u16 | height u16
+# 目标: class_id u16 | confidence u16 | x1 u16 | y1 u16 | x2 u16 | y2 u16，置信度和坐标按 0~65535 归一化
+# websocket 客户端在 Sec-WebSocket-Protocol 中请求该子协议时使用二进制格式
+BINARY_SUBPROTOCOL = "recamera.results.v1"
+BINARY_MAGIC = b"RCIR"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBHIdHH")
+BINARY_RECORD = np.dtype([
+    ("class_id", "<u2"),
+    ("confidence", "<u2"),
+    ("x1", "<u2"),
+    ("y1", "<u2"),
+    ("x2", "<u2"),
+    ("y2", "<u2"),
+])
+_NORMALIZED_MAX = 65535
+
+
+def pack_records(detections: Detections, width: int, height: int) -> bytes:
+    """
+    检测结果按二进制格式打包为目标记录，在推理进程中每帧做一次，所有二进制订阅者共用
+    """
+    records = np.empty(len(detections), BINARY_RECORD)
+    records["class_id"] = detections.class_ids
+    records["confidence"] = np.rint(np.clip(detections.scores, 0, 1) * _NORMALIZED_MAX)
+    boxes = np.rint(detections.boxes * (_NORMALIZED_MAX / np.array([width, height, width, height])))
+    np.clip(boxes, 0, _NORMALIZED_MAX, out=boxes)
+    for column, name in enumerate(("x1", "y1", "x2", "y2")):
+        records[name] = boxes[:, column]
+    return records.tobytes()
+
+
+def encode_binary(result: Dict[str, Any]) -> bytes:
+    """
+    一帧的全部检测结果编码为一条二进制消息：帧头加上推理进程打包好的目标记录，没有目标时只有帧头
+    """
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC,
+        BINARY_VERSION,
+        0,
+        len(result["detections"]),
+        result["seq"] & 0xFFFFFFFF,
+        result["timestamp"],
+        result["width"],
+        result["height"],
+    )
+    return header + result["records"]
+
+
+def unpack_records(records: bytes, count: int = -1, offset: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    目标记录还原为类别、0~1 的置信度和 0~1 的归一化框 (N, 4)，不复制原始数据
+    """
+    array = np.frombuffer(records, BINARY_RECORD, count, offset)
+    scale = np.float32(1 / _NORMALIZED_MAX)
+    boxes = np.stack([array[name] for name in ("x1", "y1", "x2", "y2")], axis=1) * scale
+    return array["class_id"].astype(np.int64), array["confidence"] * scale, boxes
+
+
+def decode_binary(message: bytes) -> Dict[str, Any]:
+    """
+    encode_binary 的逆过程，坐标和置信度还原为 0~1 的浮点数
+    """
+    magic, version, _, count, seq, timestamp, width, height = BINARY_HEADER.unpack_from(message)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("不是推理结果的二进制消息")
+    class_ids, confidences, boxes = unpack_records(message, count, BINARY_HEADER.size)
+    return {
+        "seq": seq,
+        "timestamp": timestamp,
+        "width": width,
+        "height": height,
+        "class_ids": class_ids,
+        "confidences": confidences,
+        "boxes": boxes,
+    }
+
+
+class ResultSubscription:
+    """
+    结果中心的一个订阅者（websocket、MQTT、HTTP、录像等），拥有独立的有界队列
+    消费慢的订阅者只会丢掉自己队列里最旧的结果，不会拖慢推理或其他订阅者
+    """
+
+    def __init__(self, hub: "ResultsHub", name: str, maxsize: int):
+        self.hub = hub
+        self.name = name
+        self.queue = FrameQueue(asyncio.get_running_loop(), maxsize, DROP_OLDEST)
+        # 最近取走的结果在中心的发布序号
+        self.position = -1
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        等待下一个结果，取消订阅后抛出 QueueClosed
+        """
+        index, result = await self.queue.get()
+        self.position = index
+        return result
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+    def stats(self) -> Dict[str, Any]:
+        queue = self.queue.stats()
+        return {
+            "name": self.name,
+            # 已发布但还没被该订阅者取走（含已丢弃）的结果数
+            "lag": max(0, self.hub.published - 1 - self.position) if self.hub.published else 0,
+            "depth": queue["depth"],
+            "max_size": queue["max_size"],
+            "received": queue["produced"],
+            "consumed": queue["consumed"],
+            "dropped": queue["dropped"],
+        }
+
+
+class ResultsHub:
+    """
+    推理结果中心：生产者每帧只发布一次，结果的同一个对象分发到各订阅者的队列，不复制也不重新格式化
+    """
+
+    def __init__(self):
+        self.published = 0
+        self.latest: Optional[Dict[str, Any]] = None
+        self._subscriptions: List[ResultSubscription] = []
+
+    def subscribe(self, name: str, maxsize: int = DEFAULT_QUEUE_SIZE) -> ResultSubscription:
+        subscription = ResultSubscription(self, name, maxsize)
+        # 新订阅者从下一个结果开始计算延迟
+        subscription.position = self.published - 1
+        self._subscriptions.append(subscription)
+        logger.info(f"推理结果新增订阅者 {name}，当前订阅数: {len(self._subscriptions)}")
+        return subscription
+
+    def unsubscribe(self, subscription: ResultSubscription) -> None:
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            subscription.queue.close()
+            logger.info(f"推理结果订阅者 {subscription.name} 离开，当前订阅数: {len(self._subscriptions)}")
+
+    def publish(self, result: Dict[str, Any]) -> None:
+        item: Tuple[int, Dict[str, Any]] = (self.published, result)
+        self.published += 1
+        self.latest = result
+        for subscription in list(self._subscriptions):
+            subscription.queue.put(item)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "subscribers": [subscription.stats() for subscription in self._subscriptions],
+        }
+
+
+hub = ResultsHub()
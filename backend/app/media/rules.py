@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from ..events import events
+from .decode import QueueClosed
+from .results import ResultSubscription, hub, unpack_records
+
+logger = logging.getLogger(__name__)
+
+# 录制触发事件，各触发源（推理规则、定时、GPIO、TTY）共用，data 中 source 区分来源
+RECORD_TRIGGER = "record_trigger"
+LATENCY_SMOOTHING = 0.1
+# 区域掩码的边长，坐标精度为画面宽高的 1/512
+RASTER_SIZE = 512
+RASTER_SHIFT = 4
+
+
+class RuleSet:
+    """
+    编译后的 lInferenceSet：类别过滤编译成查表矩阵，置信度范围编译成数组，区域过滤预先栅格化成按位的掩码，
+    一帧内全部目标对全部规则只做几次数组运算，不随多边形顶点数增加
+    """
+
+    def __init__(self, inference_set: List[Dict[str, Any]]):
+        self.ids = [item["sID"] for item in inference_set]
+        self.debounce = np.array([max(1, item["iDebounceTimes"]) for item in inference_set], np.int64)
+        confidence = np.array([item["lConfidenceFilter"] for item in inference_set], np.float32).reshape(-1, 2)
+        if (confidence[:, 0] > confidence[:, 1]).any():
+            raise ValueError("lConfidenceFilter 的下限不能大于上限")
+        self.confidence_min = confidence[:, :1]
+        self.confidence_max = confidence[:, 1:]
+
+        # 类别查表：每条规则一行，最后一列表示超出表范围的类别，类别列表为空的规则接受所有类别
+        classes = [item["lClassFilter"] for item in inference_set]
+        size = max([class_id for ids in classes for class_id in ids] + [-1]) + 1
+        self.class_table = np.zeros((len(classes), size + 1), bool)
+        for row, ids in enumerate(classes):
+            if ids:
+                self.class_table[row, ids] = True
+            else:
+                self.class_table[row] = True
+        self._class_limit = size
+
+        # 区域过滤栅格化：每个像素按位记录落在哪些规则的多边形内，每条规则一位
+        self.region_rules = np.array(
+            [row for row, item in enumerate(inference_set) if item.get("lRegionFilter")], np.int64
+        )
+        self.region_mask = np.zeros((RASTER_SIZE, RASTER_SIZE, (len(self.region_rules) + 7) // 8), np.uint8)
+        layer = np.empty((RASTER_SIZE, RASTER_SIZE), np.uint8)
+        for bit, row in enumerate(self.region_rules):
+            item = inference_set[row]
+            layer[:] = 0
+            for region in item["lRegionFilter"]:
+                points = np.asarray(region["lPolygon"], np.float64)
+                if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+                    raise ValueError(f"规则 {item['sID']} 的多边形至少需要 3 个 [x, y] 顶点")
+                # 顶点换算到像素中心坐标系，保留 4 位小数精度
+                vertices = np.rint((points * RASTER_SIZE - 0.5) * (1 << RASTER_SHIFT)).astype(np.int32)
+                cv2.fillPoly(layer, [vertices], 1, cv2.LINE_8, RASTER_SHIFT)
+            self.region_mask[:, :, bit // 8] |= layer << (bit % 8)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def inside(self, centers: np.ndarray) -> np.ndarray:
+        """
+        点是否在各条区域规则的多边形内，centers (N, 2) 为 0~1 坐标 -> (区域规则数, N)
+        """
+        pixels = np.clip((centers * RASTER_SIZE).astype(np.int64), 0, RASTER_SIZE - 1)
+        bits = self.region_mask[pixels[:, 1], pixels[:, 0]]
+        return np.unpackbits(bits, axis=1, count=len(self.region_rules), bitorder="little").T.astype(bool)
+
+    def evaluate(self, class_ids: np.ndarray, confidences: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        """
+        一帧的检测结果（坐标和置信度都是 0~1）对每条规则是否命中，返回 (规则数,) 的布尔数组
+        """
+        if not len(class_ids):
+            return np.zeros(len(self), bool)
+        class_ids = np.where(class_ids < self._class_limit, class_ids, self._class_limit)
+        accepted = self.class_table[:, class_ids]
+        accepted &= (confidences >= self.confidence_min) & (confidences <= self.confidence_max)
+        if len(self.region_rules):
+            accepted[self.region_rules] &= self.inside((boxes[:, :2] + boxes[:, 2:]) * 0.5)
+        return accepted.any(axis=1)
+
+
+class RecordRuleEngine:
+    """
+    推理规则录制：订阅推理结果，每条规则连续 iDebounceTimes 帧命中才算触发，连续同样帧数未命中才解除；
+    有规则触发时发布 start，全部解除时发布 stop
+    """
+
+    def __init__(self):
+        self.rules: Optional[RuleSet] = None
+        self.active = False
+        self.frames = 0
+        self.triggers = 0
+        self.latency: Optional[float] = None
+        self._hits = np.zeros(0, np.int64)
+        self._misses = np.zeros(0, np.int64)
+        self._triggered = np.zeros(0, bool)
+        self._subscription: Optional[ResultSubscription] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, rule_config: Dict[str, Any], record_rule_config: Dict[str, Any]) -> None:
+        """
+        规则总开关打开且录制条件选择 lInferenceSet 时运行；配置变化后重新编译规则，去抖计数从头开始
+        配置无效时抛出 ValueError，原来的规则保持不变
+        """
+        self.apply(self.compile(rule_config, record_rule_config))
+
+    @staticmethod
+    def compile(rule_config: Dict[str, Any], record_rule_config: Dict[str, Any]) -> Optional[RuleSet]:
+        """
+        只编译不生效，供先校验全部录制配置再统一应用；不需要运行时返回 None
+        """
+        inference_set = record_rule_config.get("lInferenceSet") or []
+        if not (rule_config.get("bRuleEnabled") and record_rule_config.get("sCurrentSelected") == "lInferenceSet" and inference_set):
+            return None
+        return RuleSet(inference_set)
+
+    def apply(self, rules: Optional[RuleSet]) -> None:
+        if rules is None:
+            self.stop()
+            return
+        self._install(rules)
+        if self._task is None or self._task.done():
+            self._subscription = hub.subscribe("record rules")
+            self._task = asyncio.ensure_future(self._run())
+
+    def load(self, inference_set: List[Dict[str, Any]]) -> None:
+        self._install(RuleSet(inference_set))
+
+    def _install(self, rules: RuleSet) -> None:
+        self._set_active(False, None)
+        self.rules = rules
+        self._hits = np.zeros(len(rules), np.int64)
+        self._misses = np.zeros(len(rules), np.int64)
+        self._triggered = np.zeros(len(rules), bool)
+
+    def stop(self) -> None:
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._set_active(False, None)
+        self.rules = None
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                self.observe(await self._subscription.get())
+        except (asyncio.CancelledError, QueueClosed):
+            pass
+        except Exception as exc:
+            logger.exception(f"录制规则判断异常: {exc}")
+
+    def observe(self, result: Dict[str, Any]) -> bool:
+        """
+        用一帧推理结果更新各规则的去抖计数，返回当前是否处于触发状态
+        """
+        if self.rules is None:
+            return False
+        start = time.perf_counter()
+        matched = self.rules.evaluate(*unpack_records(result["records"]))
+        self._hits = np.where(matched, self._hits + 1, 0)
+        self._misses = np.where(matched, 0, self._misses + 1)
+        self._triggered |= self._hits >= self.rules.debounce
+        self._triggered &= self._misses < self.rules.debounce
+        self.frames += 1
+        self._set_active(bool(self._triggered.any()), result)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.latency = elapsed if self.latency is None else self.latency + LATENCY_SMOOTHING * (elapsed - self.latency)
+        return self.active
+
+    def _set_active(self, active: bool, result: Optional[Dict[str, Any]]) -> None:
+        if active == self.active:
+            return
+        self.active = active
+        rules = [self.rules.ids[row] for row in np.flatnonzero(self._triggered)] if self.rules else []
+        if active:
+            self.triggers += 1
+        logger.info(f"推理规则录制{'开始' if active else '结束'}: {', '.join(rules)}")
+        events.publish(RECORD_TRIGGER, {
+            "source": "inference",
+            "action": "start" if active else "stop",
+            "rules": rules,
+            "seq": result["seq"] if result else None,
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.rules is not None,
+            "active": self.active,
+            "rules": len(self.rules) if self.rules else 0,
+            "triggered": [self.rules.ids[row] for row in np.flatnonzero(self._triggered)] if self.rules else [],
+            "frames": self.frames,
+            "triggers": self.triggers,
+            "latency_ms": round(self.latency or 0.0, 3),
+        }
+
+
+record_rules = RecordRuleEngine()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import cv2
+import numpy as np
+
+from ..events import events
+from ..state import bump_revision, state
+from .pipeline import FrameStage
+
+logger = logging.getLogger(__name__)
+
+MODE_AUTO = 0
+MODE_SCHEDULE = 1
+MODE_FIXED = 2
+
+PROFILE_DAY = 1
+PROFILE_NIGHT = 2
+
+# 每秒采样约 4 次，每次只取约 64 像素宽的抽样画面
+SAMPLE_INTERVAL = 0.25
+SAMPLE_WIDTH = 64
+# 亮度直方图的滚动窗口
+HISTOGRAM_WINDOW = 2.0
+HISTOGRAM_BINS = 32
+# iNightToDayFilterLevel（0~5，数值越大越不灵敏，越暗才转夜间）对应的（转夜间阈值，转白天阈值），平均亮度 0~255
+THRESHOLDS = {
+    0: (70.0, 85.0),
+    1: (50.0, 75.0),
+    2: (35.0, 65.0),
+    3: (28.0, 58.0),
+    4: (22.0, 50.0),
+    5: (16.0, 42.0),
+}
+DAY_SECONDS = 86400
+
+
+def scheduled_profile(night_to_day: Dict, seconds: int) -> int:
+    """
+    定时模式：一天中的秒数落在 [iDawnTime, iDuskTime) 内为白天，区间可以跨过午夜
+    """
+    dawn = night_to_day.get("iDawnTime", 0)
+    dusk = night_to_day.get("iDuskTime", 86400)
+    if dawn <= dusk:
+        day = dawn <= seconds < dusk
+    else:
+        day = seconds >= dawn or seconds < dusk
+    return PROFILE_DAY if day else PROFILE_NIGHT
+
+
+def next_schedule_change(night_to_day: Dict, seconds: int) -> int:
+    """
+    一天中的秒数到下一个晨曦或黄昏时刻的秒数，正好在切换时刻时返回一整天
+    """
+    edges = (night_to_day.get("iDawnTime", 0), night_to_day.get("iDuskTime", DAY_SECONDS))
+    return min((edge - seconds) % DAY_SECONDS or DAY_SECONDS for edge in edges)
+
+
+class SceneController:
+    """
+    昼夜参数切换：自动模式下按滚动亮度直方图的平均亮度切换，越过阈值并持续 iNightToDayFilterTime 秒才切换；
+    定时模式按晨曦、黄昏时间切换；当前结果写入 nightToDay.iProfileCur，每次切换发布 scene 事件
+    """
+
+    def __init__(self, cam_id: int = 0):
+        self.cam_id = cam_id
+        self.profile: Optional[int] = None
+        self.luminance: Optional[float] = None
+        self.switches = 0
+        self.samples = 0
+        self._histogram = np.zeros(HISTOGRAM_BINS, np.int64)
+        self._history: Deque[tuple] = deque()
+        self._pending: Optional[int] = None
+        self._pending_since = 0.0
+        self._decide_now = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def night_to_day(self) -> Dict:
+        return state.image_config.get(self.cam_id, {}).get("nightToDay", {})
+
+    def observe(self, gray: np.ndarray, now: float) -> None:
+        """
+        加入一帧抽样的灰度画面，更新滚动直方图后按当前模式判断
+        """
+        histogram = np.bincount(gray.ravel() >> 3, minlength=HISTOGRAM_BINS)
+        self._history.append((now, histogram))
+        self._histogram += histogram
+        while self._history and now - self._history[0][0] > HISTOGRAM_WINDOW:
+            self._histogram -= self._history.popleft()[1]
+        total = self._histogram.sum()
+        if total:
+            centers = np.arange(HISTOGRAM_BINS) * 8 + 4
+            self.luminance = float(self._histogram @ centers) / total
+        self.samples += 1
+        self.evaluate(now)
+
+    def evaluate(self, now: float) -> None:
+        night_to_day = self.night_to_day
+        mode = night_to_day.get("iMode", MODE_FIXED)
+        if mode == MODE_SCHEDULE:
+            local = time.localtime(now)
+            self._switch(scheduled_profile(night_to_day, local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec), "schedule")
+        elif mode == MODE_AUTO and self.luminance is not None:
+            night_below, day_above = THRESHOLDS[night_to_day.get("iNightToDayFilterLevel", 1)]
+            if self.luminance < night_below:
+                target = PROFILE_NIGHT
+            elif self.luminance > day_above:
+                target = PROFILE_DAY
+            else:
+                # 处于两个阈值之间，保持当前配置
+                target = self.profile or PROFILE_DAY
+            if self.profile is None or self._decide_now:
+                self._decide_now = False
+                self._pending = None
+                self._switch(target, "auto")
+            elif target == self.profile:
+                self._pending = None
+            elif target != self._pending:
+                self._pending = target
+                self._pending_since = now
+            elif now - self._pending_since >= night_to_day.get("iNightToDayFilterTime", 5):
+                self._pending = None
+                self._switch(target, "auto")
+        # 配置被整体替换后重新写回当前结果
+        if mode in (MODE_AUTO, MODE_SCHEDULE) and self.profile is not None and night_to_day.get("iProfileCur") != self.profile:
+            night_to_day["iProfileCur"] = self.profile
+            bump_revision("isp")
+
+    def _switch(self, profile: int, reason: str) -> None:
+        if profile == self.profile:
+            return
+        previous = self.profile
+        self.profile = profile
+        self.switches += 1
+        self.night_to_day["iProfileCur"] = profile
+        bump_revision("isp")
+        luminance = round(self.luminance, 1) if self.luminance is not None else None
+        logger.info(f"摄像头 {self.cam_id} 场景切换 {previous} -> {profile}（{reason}，亮度: {luminance}）")
+        events.publish("scene", {
+            "cam_id": self.cam_id,
+            "from": previous,
+            "to": profile,
+            "reason": reason,
+            "luminance": luminance,
+        })
+
+    def schedule(self) -> None:
+        """
+        定时模式不依赖画面采样：立即按当前时间切换，再用定时器在下一个晨曦或黄昏时刻切换，
+        没有连接和录制、解码源没有运行时也能按时切换；其他模式取消定时器
+        """
+        self.stop()
+        if self.night_to_day.get("iMode") != MODE_SCHEDULE:
+            return
+        now = time.time()
+        self.evaluate(now)
+        local = time.localtime(now)
+        delay = next_schedule_change(self.night_to_day, local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec)
+        # 定时器在切换时刻所在的那一秒内触发
+        self._timer = asyncio.get_running_loop().call_later(delay - now % 1 + 0.001, self.schedule)
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def reset(self) -> None:
+        """
+        修改昼夜参数后重新统计，下一次采样直接按新参数判断，不再等待滞后时间
+        """
+        self._pending = None
+        self._decide_now = True
+        self._history.clear()
+        self._histogram[:] = 0
+        self.luminance = None
+
+    def stats(self) -> Dict[str, Any]:
+        night_to_day = self.night_to_day
+        return {
+            "cam_id": self.cam_id,
+            "mode": night_to_day.get("iMode"),
+            "profile": night_to_day.get("iProfileCur"),
+            "luminance": round(self.luminance, 1) if self.luminance is not None else None,
+            "pending": self._pending,
+            "samples": self.samples,
+            "switches": self.switches,
+        }
+
+
+_controllers: Dict[int, SceneController] = {}
+
+
+def schedule_all() -> None:
+    for cam_id in state.image_config:
+        get_controller(cam_id).schedule()
+
+
+def stop_all() -> None:
+    for controller in _controllers.values():
+        controller.stop()
+
+
+def get_controller(cam_id: int = 0) -> SceneController:
+    controller = _controllers.get(cam_id)
+    if controller is None:
+        controller = SceneController(cam_id)
+        _controllers[cam_id] = controller
+    return controller
+
+
+class SceneStage(FrameStage):
+    """
+    昼夜切换的采样阶段，放在 ISP 之前，统计的是未经调节的原始亮度
+    不修改画面，每 SAMPLE_INTERVAL 秒抽样一次；启用时（自动或定时模式）按当前场景做 ISP，直通模式不可用
+    """
+
+    name = "scene"
+
+    def __init__(self, stream_id: int, cam_id: int = 0):
+        super().__init__(stream_id)
+        self.controller = get_controller(cam_id)
+        self._last_sample = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.controller.night_to_day.get("iMode") in (MODE_AUTO, MODE_SCHEDULE)
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        if now - self._last_sample < SAMPLE_INTERVAL:
+            return
+        self._last_sample = now
+        step = max(1, frame.shape[1] // SAMPLE_WIDTH)
+        sample = np.ascontiguousarray(frame[::step, ::step])
+        self.controller.observe(cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY), now)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..state import state
+
+DAY_SECONDS = 86400
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+
+def week_second(point: Dict[str, int]) -> int:
+    """
+    TimePoint 换算为一周中的秒数，周日 00:00:00 为 0
+    """
+    return point["iDay"] * DAY_SECONDS + point["iHour"] * 3600 + point["iMinute"] * 60 + point["iSecond"]
+
+
+def local_week_second(timestamp: float) -> int:
+    local = time.localtime(timestamp)
+    # tm_wday 周一为 0，TimePoint.iDay 周日为 0
+    return ((local.tm_wday + 1) % 7) * DAY_SECONDS + local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec
+
+
+class WeeklySchedule:
+    """
+    编译后的每周计划：时间段排序合并成互不重叠的区间，再展开成一周内有序的切换点，
+    查询当前是否在计划内和下一次切换都只做一次二分查找
+    结束早于开始的时间段跨过周六到周日，结束等于开始的时间段为空，和昼夜定时切换的约定一致
+    """
+
+    def __init__(self, ranges: List[Dict[str, Any]]):
+        intervals: List[Tuple[int, int]] = []
+        for item in ranges:
+            start, end = week_second(item["dStart"]), week_second(item["dEnd"])
+            if start < end:
+                intervals.append((start, end))
+            elif start > end:
+                intervals.append((start, WEEK_SECONDS))
+                if end:
+                    intervals.append((0, end))
+        intervals.sort()
+        merged: List[List[int]] = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.intervals = merged
+        # 周日 0 点是否在计划内，切换点不含一周的起止两端，跨周连续的区间在这里不产生切换
+        self.initial = bool(merged) and merged[0][0] == 0
+        self.transitions = [edge for interval in merged for edge in interval if 0 < edge < WEEK_SECONDS]
+
+    def active(self, second: int) -> bool:
+        return self.initial ^ (bisect_right(self.transitions, second % WEEK_SECONDS) % 2 == 1)
+
+    def next_transition(self, second: int) -> Optional[int]:
+        """
+        second 之后到下一次切换的秒数，全周都在或都不在计划内时返回 None
+        """
+        if not self.transitions:
+            return None
+        second %= WEEK_SECONDS
+        index = bisect_right(self.transitions, second)
+        if index < len(self.transitions):
+            return self.transitions[index] - second
+        return self.transitions[0] + WEEK_SECONDS - second
+
+    def query(self, timestamp: float) -> Dict[str, Any]:
+        second = local_week_second(timestamp)
+        remaining = self.next_transition(second)
+        return {
+            "bActive": self.active(second),
+            "iTimestamp": int(timestamp),
+            "iWeekSecond": second,
+            "iNextTransition": int(timestamp) + remaining if remaining is not None else None,
+            "lIntervals": [list(interval) for interval in self.intervals],
+        }
+
+
+_compiled: Tuple[Optional[int], Optional[WeeklySchedule]] = (None, None)
+
+
+def weekly_schedule() -> WeeklySchedule:
+    """
+    当前 schedule_rule_config 的编译结果，只在 config_revisions["schedule"] 变化时重新编译
+    """
+    global _compiled
+    revision = state.config_revisions.get("schedule", 0)
+    if _compiled[0] != revision:
+        _compiled = (revision, WeeklySchedule(state.schedule_rule_config))
+    return _compiled[1]
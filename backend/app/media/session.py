@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender
+from aiortc.rtp import is_rtcp
+
+from .adapt import AdaptationController
+from .relay import EncodedStream, PacketTrack
+
+PIPELINE_PASSTHROUGH = "passthrough"
+PIPELINE_RELAY = "relay"
+PIPELINE_TRANSCODE = "transcode"
+
+# getStats 结果的缓存时间，频繁轮询统计接口不会反复查询各连接
+STATS_TTL = 1.0
+
+
+@dataclass
+class PeerSession:
+    """
+    单个 WebRTC 连接的视频发送状态
+    """
+    pc: RTCPeerConnection
+    stream_id: int
+    video_path: str
+    pipeline: str
+    track: MediaStreamTrack
+    sender: Optional[RTCRtpSender] = None
+    controller: Optional[AdaptationController] = None
+    created_at: float = field(default_factory=time.monotonic)
+    first_packet_ms: Optional[float] = None
+    downgraded_from: Optional[int] = None
+    stats: Optional[Dict[str, Any]] = None
+    stats_at: float = 0.0
+
+
+class LatencyStats:
+    """
+    最近若干次 offer 到第一个 RTP 包的耗时统计
+    """
+
+    def __init__(self, size: int = 100):
+        self.count = 0
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, value_ms: float) -> None:
+        self.count += 1
+        self._samples.append(value_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        if not self._samples:
+            return {"count": self.count}
+        samples = sorted(self._samples)
+        return {
+            "count": self.count,
+            "last_ms": round(self._samples[-1], 1),
+            "avg_ms": round(sum(samples) / len(samples), 1),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+            "max_ms": round(samples[-1], 1),
+        }
+
+
+def watch_first_packet(session: PeerSession, stats: LatencyStats) -> None:
+    """
+    记录从收到 offer 到发出第一个 RTP 包（不含 RTCP）的耗时，记录后恢复原来的发送函数
+    """
+    transport = session.sender.transport
+    send_rtp = transport._send_rtp
+
+    async def _send_rtp(data: bytes) -> None:
+        if session.first_packet_ms is None and not is_rtcp(data):
+            session.first_packet_ms = (time.monotonic() - session.created_at) * 1000
+            stats.add(session.first_packet_ms)
+            del transport._send_rtp
+        await send_rtp(data)
+
+    transport._send_rtp = _send_rtp
+
+
+async def peer_stats(session: PeerSession) -> Dict[str, Any]:
+    """
+    单个连接的发送统计：帧数和丢帧来自发送轨道，RTT、丢包和发送字节来自 aiortc 的 getStats()，
+    码率由两次查询之间的字节差计算；结果缓存 STATS_TTL 秒
+    """
+    now = time.monotonic()
+    if session.stats is not None and now - session.stats_at < STATS_TTL:
+        return session.stats
+
+    outbound = remote = None
+    for item in (await session.pc.getStats()).values():
+        if getattr(item, "kind", None) != "video":
+            continue
+        if item.type == "outbound-rtp":
+            outbound = item
+        elif item.type == "remote-inbound-rtp":
+            remote = item
+
+    track = session.track
+    if isinstance(track, PacketTrack):
+        frames_sent, frames_dropped = track.packets_sent, track.packets_dropped
+        stream = track.stream
+        encode_ms = stream.stats()["avg_encode_ms"] if isinstance(stream, EncodedStream) else 0.0
+    else:
+        frames_sent, frames_dropped = track.frames_sent, track.frames_dropped
+        # 逐连接编码由 aiortc 内部完成，没有单独的耗时统计
+        encode_ms = None
+
+    bytes_sent = outbound.bytesSent if outbound else 0
+    bitrate = None
+    if session.stats is not None and now > session.stats_at:
+        bitrate = int((bytes_sent - session.stats["bytes_sent"]) * 8 / (now - session.stats_at))
+
+    session.stats = {
+        "stream_id": session.stream_id,
+        "pipeline": session.pipeline,
+        "state": session.pc.connectionState,
+        "downgraded_from": session.downgraded_from,
+        "uptime_s": round(now - session.created_at, 1),
+        "first_packet_ms": round(session.first_packet_ms, 1) if session.first_packet_ms is not None else None,
+        "frames_sent": frames_sent,
+        "frames_dropped": frames_dropped,
+        "encode_ms": encode_ms,
+        "packets_sent": outbound.packetsSent if outbound else 0,
+        "bytes_sent": bytes_sent,
+        "bitrate": bitrate,
+        "rtt_ms": round(remote.roundTripTime * 1000, 1) if remote and remote.roundTripTime is not None else None,
+        "fraction_lost": remote.fractionLost if remote else None,
+        "packets_lost": remote.packetsLost if remote else None,
+        "adaptation": session.controller.stats() if session.controller else None,
+    }
+    session.stats_at = now
+    return session.stats
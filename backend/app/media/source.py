@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set, Tuple, Union
+
+import cv2
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import VIDEO_TIME_BASE, MediaStreamError
+from av import VideoFrame
+
+from .decode import DROP_OLDEST, DecodeWorker, QueueClosed
+from .framebus import FrameBus, FrameHandle
+from .geometry import FLIP_NONE
+from .pipeline import FramePipeline
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberTrack(MediaStreamTrack):
+    """
+    订阅共享解码源的视频轨道，每个 WebRTC 连接一个
+    只保留最新一帧，消费慢的连接直接跳帧，不会拖慢解码源
+    """
+
+    kind = "video"
+
+    def __init__(self, source: "StreamSource"):
+        super().__init__()
+        self.source = source
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._frame: Optional[VideoFrame] = None
+        self._ready = asyncio.Event()
+
+    def _put(self, frame: Optional[VideoFrame]) -> None:
+        if self._ready.is_set() and self._frame is not None:
+            # 上一帧还没被取走就被覆盖
+            self.frames_dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def recv(self) -> VideoFrame:
+        """
+        等待解码源的下一帧
+        """
+        if self.readyState != "live":
+            raise MediaStreamError
+        await self._ready.wait()
+        self._ready.clear()
+        frame = self._frame
+        if frame is None or self.readyState != "live":
+            raise MediaStreamError
+        self.frames_sent += 1
+        return frame
+
+    def stop(self) -> None:
+        """
+        停止轨道并退订解码源
+        """
+        if self.readyState == "live":
+            super().stop()
+            self._put(None)
+            self.source.unsubscribe(self)
+
+
+class BusSubscription:
+    """
+    只读取帧总线的订阅者（推理等）：保持解码源运行，解码源不为它把每帧转换为 VideoFrame
+    """
+
+    def __init__(self, source: "StreamSource"):
+        self.source = source
+        self.live = True
+
+    @property
+    def bus(self) -> Optional[FrameBus]:
+        return self.source.bus
+
+    def stop(self) -> None:
+        if self.live:
+            self.live = False
+            self.source.unsubscribe(self)
+
+
+class StreamSource:
+    """
+    单路码流的共享解码源
+    第一个订阅者到来时启动解码线程，最后一个订阅者离开时停止，
+    每帧只解码一次，然后分发给所有订阅者；只有帧总线订阅者时不做颜色转换
+    """
+
+    def __init__(
+        self,
+        stream_id: int,
+        video_path: str,
+        queue_size: int = 4,
+        drop_policy: str = DROP_OLDEST,
+        output_size: Optional[Tuple[int, int]] = None,
+        frame_rate: Optional[float] = None,
+        pipeline: Optional[FramePipeline] = None,
+        geometry: Tuple[int, str] = (0, FLIP_NONE),
+    ):
+        self.stream_id = stream_id
+        self.video_path = video_path
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.output_size = output_size
+        self.frame_rate = frame_rate
+        self.pipeline = pipeline
+        self.geometry = geometry
+        self.frames_delivered = 0
+        self._subscribers: Set[SubscriberTrack] = set()
+        self._bus_subscribers: Set[BusSubscription] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._worker: Optional[DecodeWorker] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def bus(self) -> Optional[FrameBus]:
+        """
+        当前解码线程的帧总线，推理、录像等其他消费者可以通过它零拷贝读取原始帧
+        """
+        if self._worker is None or not self.running:
+            return None
+        return self._worker.bus
+
+    def subscribe(self) -> SubscriberTrack:
+        track = SubscriberTrack(self)
+        self._subscribers.add(track)
+        if not self.running:
+            self._start()
+        logger.info(f"码流 {self.stream_id} 新增订阅者，当前订阅数: {len(self._subscribers)}")
+        return track
+
+    def subscribe_bus(self) -> BusSubscription:
+        subscription = BusSubscription(self)
+        self._bus_subscribers.add(subscription)
+        if not self.running:
+            self._start()
+        logger.info(f"码流 {self.stream_id} 新增帧总线订阅者，当前订阅数: {len(self._bus_subscribers)}")
+        return subscription
+
+    def unsubscribe(self, subscriber: Union[SubscriberTrack, BusSubscription]) -> None:
+        if isinstance(subscriber, BusSubscription):
+            self._bus_subscribers.discard(subscriber)
+            logger.info(f"码流 {self.stream_id} 帧总线订阅者离开，当前订阅数: {len(self._bus_subscribers)}")
+        else:
+            self._subscribers.discard(subscriber)
+            logger.info(f"码流 {self.stream_id} 订阅者离开，当前订阅数: {len(self._subscribers)}")
+        if not self._subscribers and not self._bus_subscribers:
+            self.stop()
+
+    def _start(self) -> None:
+        loop = asyncio.get_event_loop()
+        self._worker = DecodeWorker(
+            self.stream_id,
+            self.video_path,
+            loop,
+            self.queue_size,
+            self.drop_policy,
+            output_size=self.output_size,
+            frame_rate=self.frame_rate,
+            pipeline=self.pipeline,
+            geometry=self.geometry,
+        )
+        self._worker.start()
+        self._task = asyncio.ensure_future(self._run(self._worker))
+
+    def reconfigure(
+        self,
+        output_size: Optional[Tuple[int, int]],
+        frame_rate: Optional[float],
+        geometry: Tuple[int, str] = (0, FLIP_NONE),
+    ) -> None:
+        """
+        修改输出分辨率、帧率和旋转翻转；正在运行时重启解码线程，订阅者保持不变
+        """
+        if (output_size, frame_rate, geometry) == (self.output_size, self.frame_rate, self.geometry):
+            return
+        self.output_size = output_size
+        self.frame_rate = frame_rate
+        self.geometry = geometry
+        if not self.running:
+            return
+        self._worker.stop()
+        self._task.cancel()
+        self._start()
+        logger.info(f"码流 {self.stream_id} 解码源已按新参数重启: {output_size}, {frame_rate} FPS, 旋转翻转: {geometry}")
+
+    def stop(self) -> None:
+        """
+        停止解码线程并结束所有订阅者
+        """
+        if self._worker is not None:
+            self._worker.stop()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for subscriber in [*self._subscribers, *self._bus_subscribers]:
+            subscriber.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        worker = self._worker
+        return {
+            "stream_id": self.stream_id,
+            "video_path": self.video_path,
+            "running": self.running,
+            "subscribers": len(self._subscribers),
+            "bus_subscribers": len(self._bus_subscribers),
+            "fps": worker.fps if worker else 0,
+            "output_fps": worker.output_fps if worker else 0,
+            "source_width": worker.source_width if worker else 0,
+            "source_height": worker.source_height if worker else 0,
+            "width": worker.width if worker else 0,
+            "height": worker.height if worker else 0,
+            "frames_decoded": worker.frames_decoded if worker else 0,
+            "frames_skipped": worker.frames_skipped if worker else 0,
+            "frames_delivered": self.frames_delivered,
+            "queue": worker.queue.stats() if worker else None,
+            "bus": worker.bus.stats() if worker and worker.bus else None,
+            "pipeline": self.pipeline.stats() if self.pipeline else None,
+        }
+
+    @staticmethod
+    def _to_video_frame(bus: FrameBus, handle: FrameHandle) -> Optional[VideoFrame]:
+        """
+        从帧总线映射原始帧并转换为编码器使用的 yuv420p
+        共享帧在各连接的编码线程中不再需要 reformat
+        """
+        try:
+            frame = bus.view(handle)
+            if frame is None:
+                return None
+            yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        finally:
+            bus.release(handle)
+        video_frame = VideoFrame.from_ndarray(yuv, format="yuv420p")
+        video_frame.pts = handle.pts
+        video_frame.time_base = VIDEO_TIME_BASE
+        return video_frame
+
+    async def _run(self, worker: DecodeWorker) -> None:
+        """
+        事件循环只等待解码好的帧句柄并分发，颜色转换在线程池中完成
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while self._subscribers or self._bus_subscribers:
+                handle = await worker.queue.get()
+                if not self._subscribers:
+                    # 帧总线订阅者直接从总线取帧，不需要转换
+                    worker.bus.release(handle)
+                    continue
+                video_frame = await loop.run_in_executor(None, self._to_video_frame, worker.bus, handle)
+                if video_frame is None:
+                    continue
+                self.frames_delivered += 1
+                for track in list(self._subscribers):
+                    track._put(video_frame)
+        except asyncio.CancelledError:
+            pass
+        except QueueClosed:
+            for subscriber in [*self._subscribers, *self._bus_subscribers]:
+                subscriber.stop()
+
+
+class SourceRegistry:
+    """
+    按 stream_id 管理共享解码源
+    """
+
+    def __init__(self):
+        self._sources: Dict[int, StreamSource] = {}
+
+    def subscribe(self, stream_id: int, video_path: str, **options) -> SubscriberTrack:
+        return self._source(stream_id, video_path, **options).subscribe()
+
+    def subscribe_bus(self, stream_id: int, video_path: str, **options) -> BusSubscription:
+        return self._source(stream_id, video_path, **options).subscribe_bus()
+
+    def _source(self, stream_id: int, video_path: str, **options) -> StreamSource:
+        source = self._sources.get(stream_id)
+        if source is None or source.video_path != video_path:
+            if source is not None:
+                source.stop()
+            source = StreamSource(stream_id, video_path, **options)
+            self._sources[stream_id] = source
+        elif not source.running:
+            # 解码源空闲时才应用新的队列配置
+            for key, value in options.items():
+                setattr(source, key, value)
+        return source
+
+    def get(self, stream_id: int) -> Optional[StreamSource]:
+        return self._sources.get(stream_id)
+
+    def items(self):
+        return self._sources.items()
+
+    def shutdown(self) -> None:
+        for source in self._sources.values():
+            source.stop()
+        self._sources.clear()
+
+
+sources = SourceRegistry()
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from typing import Dict
+
+from .denoise import DenoiseStage
+from .isp import ISPStage
+from .mask import MaskStage
+from .osd import OSDStage
+from .pipeline import FramePipeline
+from .scene import SceneStage
+
+# 主码流的画面代表摄像头的实际亮度，昼夜切换只在主码流上采样
+MAIN_STREAM = 0
+
+_pipelines: Dict[int, FramePipeline] = {}
+
+
+def get_pipeline(stream_id: int) -> FramePipeline:
+    """
+    每路码流一条帧处理管线，列表顺序就是处理顺序：昼夜采样、降噪、图像调节、遮挡、OSD 叠加；
+    旋转翻转改变画面尺寸，在解码线程写入帧总线时完成
+    """
+    pipeline = _pipelines.get(stream_id)
+    if pipeline is None:
+        stages = [SceneStage(stream_id)] if stream_id == MAIN_STREAM else []
+        stages += [DenoiseStage(stream_id), ISPStage(stream_id), MaskStage(stream_id), OSDStage(stream_id)]
+        pipeline = FramePipeline(stream_id, stages)
+        _pipelines[stream_id] = pipeline
+    return pipeline
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import logging
+import operator
+import time
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..state import state
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DETECTION_TEMPLATE = "{timestamp}: 检测到 {class} 置信度 {confidence} 位置 ({x1},{y1},{x2},{y2})"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 每帧只计算一次的字段
+FRAME_FIELDS = ("timestamp", "seq", "width", "height")
+_BOX_FIELDS = ("class", "class_id", "confidence", "x1", "y1", "x2", "y2")
+# dTemplate 中各任务类型的模板可以引用的目标字段
+TARGET_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "sDetection": _BOX_FIELDS,
+    "sClassification": ("class", "class_id", "confidence"),
+    "sSegmentation": _BOX_FIELDS,
+    "sTracking": _BOX_FIELDS + ("track_id",),
+    "sKeypoint": _BOX_FIELDS + ("keypoints",),
+    "sOBB": _BOX_FIELDS + ("angle",),
+}
+# 校验格式说明符用的示例值
+_SAMPLES: Dict[str, Any] = {
+    "timestamp": "2024-01-15 14:30:25",
+    "seq": 0,
+    "width": 1920,
+    "height": 1080,
+    "class": "person",
+    "class_id": 0,
+    "confidence": 0.85,
+    "x1": 0,
+    "y1": 0,
+    "x2": 0,
+    "y2": 0,
+    "track_id": 0,
+    "keypoints": [],
+    "angle": 0.0,
+}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    """
+    编译后的输出模板：字段名在配置时校验，模板改写为位置参数形式，
+    渲染时每帧只计算一次帧级字段，每个目标只做一次取值和一次 str.format
+    """
+
+    def __init__(self, source: str, target_fields: Tuple[str, ...]):
+        self.source = source
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as exc:
+            raise TemplateError(f"模板格式错误: {exc}") from exc
+        for _, name, spec, _ in parsed:
+            if name is None:
+                continue
+            if name == "" or name.isdigit():
+                raise TemplateError("模板不支持位置参数，请使用字段名")
+            if name not in FRAME_FIELDS and name not in target_fields:
+                raise TemplateError(f"模板中的字段 {{{name}}} 不存在，可用字段: {', '.join(FRAME_FIELDS + target_fields)}")
+            if spec and "{" in spec:
+                raise TemplateError(f"字段 {{{name}}} 的格式说明不能嵌套字段")
+
+        # 改写为位置参数：帧级字段排在前面，目标字段用 itemgetter 一次取出，重复的字段共用一个参数
+        names = [name for _, name, _, _ in parsed if name is not None]
+        self._frame_fields = tuple(dict.fromkeys(name for name in names if name in FRAME_FIELDS))
+        self._target_fields = tuple(dict.fromkeys(name for name in names if name not in FRAME_FIELDS))
+        order = self._frame_fields + self._target_fields
+        parts = []
+        for literal, name, spec, conversion in parsed:
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            if name is not None:
+                parts.append(f"{{{order.index(name)}{'!' + conversion if conversion else ''}{':' + spec if spec else ''}}}")
+        self.pattern = "".join(parts)
+        self._getter = self._make_getter(self._target_fields)
+        try:
+            self.pattern.format(*[_SAMPLES[name] for name in order])
+        except (ValueError, TypeError) as exc:
+            raise TemplateError(f"模板格式说明错误: {exc}") from exc
+
+    @staticmethod
+    def _make_getter(names: Tuple[str, ...]) -> Callable[[Dict], tuple]:
+        if not names:
+            return lambda target: ()
+        if len(names) == 1:
+            getter = operator.itemgetter(names[0])
+            return lambda target: (getter(target),)
+        return operator.itemgetter(*names)
+
+    def render(self, result: Dict[str, Any]) -> List[str]:
+        """
+        渲染一帧中的所有目标，每个目标一行
+        """
+        frame = tuple(frame_value(result, name) for name in self._frame_fields)
+        render, getter = self.pattern.format, self._getter
+        return [render(*frame, *getter(target)) for target in result["detections"]]
+
+
+def frame_value(result: Dict[str, Any], name: str) -> Any:
+    if name == "timestamp":
+        return time.strftime(TIMESTAMP_FORMAT, time.localtime(result["timestamp"]))
+    return result[name]
+
+
+class NotifyTemplates:
+    """
+    dTemplate 中全部模板的编译结果，空模板不输出
+    """
+
+    def __init__(self, templates: Dict[str, str]):
+        self.templates: Dict[str, Optional[CompiledTemplate]] = {}
+        for key, fields in TARGET_FIELDS.items():
+            source = templates.get(key) or ""
+            try:
+                self.templates[key] = CompiledTemplate(source, fields) if source else None
+            except TemplateError as exc:
+                raise TemplateError(f"{key}: {exc}") from exc
+
+    @property
+    def detection(self) -> Optional[CompiledTemplate]:
+        return self.templates.get("sDetection")
+
+
+_compiled: Tuple[Optional[int], Optional[NotifyTemplates]] = (None, None)
+
+
+def notify_templates() -> NotifyTemplates:
+    """
+    当前 notify_config 的编译结果，只在 config_revisions["notify"] 变化时重新编译
+    """
+    global _compiled
+    revision = state.config_revisions.get("notify", 0)
+    if _compiled[0] != revision:
+        config = state.__dict__.get("notify_config") or {"dTemplate": {"sDetection": DEFAULT_DETECTION_TEMPLATE}}
+        try:
+            templates = NotifyTemplates(config.get("dTemplate", {}))
+        except TemplateError as exc:
+            logger.error(f"输出模板无效，使用默认模板: {exc}")
+            templates = NotifyTemplates({"sDetection": DEFAULT_DETECTION_TEMPLATE})
+        _compiled = (revision, templates)
+    return _compiled[1]
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import math
+import os
+import select
+import tty
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from ..events import events
+from .rules import RECORD_TRIGGER
+
+logger = logging.getLogger(__name__)
+
+# 时间轮：10ms 一格，1024 格一圈（约 10 秒），超过一圈的定时器记录圈数
+WHEEL_TICK = 0.01
+WHEEL_SLOTS = 1024
+
+GPIO_ROOT = "/sys/class/gpio"
+# TTY 一行的最大长度，超过后丢弃已缓存的内容
+TTY_LINE_LIMIT = 4096
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+
+class TimerHandle:
+    __slots__ = ("tick", "callback", "cancelled")
+
+    def __init__(self, tick: int, callback: Callable[[], None]):
+        self.tick = tick
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    哈希时间轮：定时器按到期的格子编号放进对应的槽，添加和取消都是 O(1)
+    事件循环只在最近一个有定时器的格子到期时唤醒一次，没有定时器时不唤醒，不按格子空转
+    """
+
+    def __init__(self, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots: List[List[TimerHandle]] = [[] for _ in range(slots)]
+        self.count = 0
+        self._current = None
+        self._armed: Optional[asyncio.TimerHandle] = None
+        self._armed_tick: Optional[int] = None
+        self._advancing = False
+
+    def _now_tick(self, loop: asyncio.AbstractEventLoop) -> int:
+        return math.floor(loop.time() / self.tick)
+
+    def call_at(self, when: float, callback: Callable[[], None]) -> TimerHandle:
+        """
+        在事件循环时间 when 之后的第一个格子调用 callback
+        """
+        loop = asyncio.get_running_loop()
+        if self._current is None:
+            self._current = self._now_tick(loop)
+        handle = TimerHandle(max(math.ceil(when / self.tick), self._current + 1), callback)
+        self.slots[handle.tick % len(self.slots)].append(handle)
+        self.count += 1
+        # 到期回调中新加的定时器等这一格处理完再统一计算下一次唤醒
+        if not self._advancing and (self._armed_tick is None or handle.tick < self._armed_tick):
+            self._arm(loop, handle.tick)
+        return handle
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        return self.call_at(asyncio.get_running_loop().time() + delay, callback)
+
+    def _arm(self, loop: asyncio.AbstractEventLoop, tick: int) -> None:
+        if self._armed is not None:
+            self._armed.cancel()
+        self._armed_tick = tick
+        self._armed = loop.call_at(tick * self.tick, self._advance)
+
+    def _advance(self) -> None:
+        loop = asyncio.get_running_loop()
+        # call_at 可能在时钟精度范围内略早执行，按已到达唤醒的格子处理
+        now = max(self._now_tick(loop), self._armed_tick)
+        self._armed = self._armed_tick = None
+        due: List[TimerHandle] = []
+        # 处理从上次处理到现在的所有格子，超过一圈时每个槽只需看一次
+        for tick in range(self._current + 1, min(now, self._current + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            keep = []
+            for handle in slot:
+                if handle.cancelled:
+                    self.count -= 1
+                elif handle.tick <= now:
+                    due.append(handle)
+                    self.count -= 1
+                else:
+                    keep.append(handle)
+            slot[:] = keep
+        self._current = now
+        self._advancing = True
+        try:
+            for handle in sorted(due, key=lambda item: item.tick):
+                if not handle.cancelled:
+                    handle.callback()
+        finally:
+            self._advancing = False
+        if self.count:
+            self._arm(loop, self._next_tick())
+
+    def _next_tick(self) -> int:
+        """
+        向后找一圈内最近的有定时器到期的格子；一圈内都没有时在一圈后再检查
+        """
+        for offset in range(1, len(self.slots) + 1):
+            tick = self._current + offset
+            if any(handle.tick == tick and not handle.cancelled for handle in self.slots[tick % len(self.slots)]):
+                return tick
+        return self._current + len(self.slots)
+
+    def clear(self) -> None:
+        for slot in self.slots:
+            slot.clear()
+        self.count = 0
+        if self._armed is not None:
+            self._armed.cancel()
+        self._armed = self._armed_tick = None
+        self._current = None
+
+
+wheel = TimerWheel()
+
+
+def publish_trigger(source: str, action: str, **data: Any) -> None:
+    logger.info(f"录制触发: {source} {action}")
+    events.publish(RECORD_TRIGGER, {"source": source, "action": action, **data})
+
+
+class TimerTrigger:
+    """
+    dTimer：每 iIntervalSeconds 秒触发一次，下一次按上一次的计划时间计算，不累积误差
+    """
+
+    source = "timer"
+
+    def __init__(self, config: Dict[str, Any]):
+        self.interval = config["iIntervalSeconds"]
+        if self.interval <= 0:
+            raise ValueError("iIntervalSeconds 必须大于 0")
+        self.fired = 0
+        self._deadline = 0.0
+        self._handle: Optional[TimerHandle] = None
+
+    def start(self) -> None:
+        self._deadline = asyncio.get_running_loop().time() + self.interval
+        self._handle = wheel.call_at(self._deadline, self._fire)
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self) -> None:
+        self.fired += 1
+        publish_trigger(self.source, "trigger", interval=self.interval)
+        now = asyncio.get_running_loop().time()
+        self._deadline += self.interval * max(1, math.ceil((now - self._deadline) / self.interval))
+        self._handle = wheel.call_at(self._deadline, self._fire)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.source, "interval": self.interval, "fired": self.fired}
+
+
+def _inotify():
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    return libc
+
+
+class GpioTrigger:
+    """
+    dGPIO：监视 sysfs 的 value 文件，sysfs 用 epoll 的 EPOLLPRI 等待电平变化中断，
+    普通文件（测试或用户态模拟的 GPIO）不支持 poll，改用 inotify 等待写入；两种方式都挂在事件循环上，不轮询
+    电平变化后等待 iDebounceDurationMs 不再变化才确认；rising/falling 在对应边沿触发一次，
+    high/low 在进入该电平时开始录制、离开时停止；停止监视时电平仍处于触发状态也发布停止，录制不会一直保持
+    """
+
+    source = "gpio"
+
+    def __init__(self, config: Dict[str, Any], root: Optional[str] = None):
+        self.name = config["sName"]
+        self.signal = config["sSignal"]
+        self.debounce = config["iDebounceDurationMs"] / 1000
+        self.level = 1 if config["sInitialLevel"] == "high" else 0
+        self.path = Path(root or GPIO_ROOT) / self.name / "value"
+        self.edges = 0
+        self.fired = 0
+        self._fd: Optional[int] = None
+        self._epoll: Optional[select.epoll] = None
+        self._inotify: Optional[int] = None
+        self._pending: Optional[TimerHandle] = None
+        self._holding = False
+
+    def start(self) -> None:
+        edge = self.path.with_name("edge")
+        if edge.exists():
+            try:
+                edge.write_text("both")
+            except OSError as exc:
+                logger.warning(f"设置 {edge} 失败: {exc}")
+        try:
+            self._fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as exc:
+            raise ValueError(f"无法打开 GPIO {self.name}: {exc}") from exc
+        loop = asyncio.get_running_loop()
+        self._epoll = select.epoll()
+        try:
+            self._epoll.register(self._fd, select.EPOLLPRI | select.EPOLLERR)
+            loop.add_reader(self._epoll.fileno(), self._on_ready)
+        except PermissionError:
+            self._epoll.close()
+            self._epoll = None
+            libc = _inotify()
+            self._inotify = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if self._inotify < 0 or libc.inotify_add_watch(self._inotify, bytes(self.path), _IN_MODIFY | _IN_CLOSE_WRITE) < 0:
+                self.stop()
+                raise ValueError(f"无法监视 GPIO {self.name}: {os.strerror(ctypes.get_errno())}")
+            loop.add_reader(self._inotify, self._on_ready)
+        # 启动时的电平与 sInitialLevel 不同也按一次变化处理
+        self._schedule()
+
+    def stop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._epoll is not None:
+            loop.remove_reader(self._epoll.fileno())
+            self._epoll.close()
+            self._epoll = None
+        if self._inotify is not None:
+            if self._inotify >= 0:
+                loop.remove_reader(self._inotify)
+                os.close(self._inotify)
+            self._inotify = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._holding:
+            self._holding = False
+            publish_trigger(self.source, "stop", name=self.name, level=self.level)
+
+    def read(self) -> Optional[int]:
+        try:
+            value = os.pread(self._fd, 16, 0).strip()
+        except OSError as exc:
+            logger.warning(f"读取 GPIO {self.name} 失败: {exc}")
+            return None
+        return 1 if value == b"1" else 0 if value == b"0" else None
+
+    def _on_ready(self) -> None:
+        if self._epoll is not None:
+            # sysfs 需要重新读取一次 value 才会清除中断通知，否则 epoll 持续就绪
+            self._epoll.poll(0)
+            self.read()
+        else:
+            try:
+                while os.read(self._inotify, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        self.edges += 1
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """
+        每次电平变化重新计时，去抖时间内没有新的变化才读取并确认电平
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+        self._pending = wheel.call_later(self.debounce, self._settle)
+
+    def _settle(self) -> None:
+        self._pending = None
+        level = self.read()
+        if level is None or level == self.level:
+            return
+        self.level = level
+        if self.signal == "rising" and level == 1 or self.signal == "falling" and level == 0:
+            action = "trigger"
+        elif self.signal in ("high", "low"):
+            action = "start" if level == (1 if self.signal == "high" else 0) else "stop"
+        else:
+            return
+        self.fired += 1
+        self._holding = action == "start"
+        publish_trigger(self.source, action, name=self.name, level=level)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.source, "name": self.name, "level": self.level, "edges": self.edges, "fired": self.fired}
+
+
+class TtyTrigger:
+    """
+    dTTY：非阻塞读取串口，按行切分，整行等于 sCommand 时触发一次
+    """
+
+    source = "tty"
+
+    def __init__(self, config: Dict[str, Any]):
+        name = config["sName"]
+        self.path = name if name.startswith("/") else f"/dev/{name}"
+        self.command = config["sCommand"].strip()
+        self.lines = 0
+        self.fired = 0
+        self._fd: Optional[int] = None
+        self._buffer = bytearray()
+
+    def start(self) -> None:
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError as exc:
+            raise ValueError(f"无法打开 TTY {self.path}: {exc}") from exc
+        if os.isatty(self._fd):
+            tty.setraw(self._fd)
+        asyncio.get_running_loop().add_reader(self._fd, self._on_ready)
+
+    def stop(self) -> None:
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._buffer.clear()
+
+    def _on_ready(self) -> None:
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as exc:
+            # 串口被拔出等情况，停止读取，重新配置时再打开
+            logger.error(f"读取 TTY {self.path} 失败: {exc}")
+            self.stop()
+            return
+        self._buffer += data
+        *lines, rest = self._buffer.split(b"\n")
+        if len(rest) > TTY_LINE_LIMIT:
+            rest = b""
+        self._buffer[:] = rest
+        for line in lines:
+            self.lines += 1
+            if line.strip().decode(errors="replace") == self.command:
+                self.fired += 1
+                publish_trigger(self.source, "trigger", command=self.command)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.source, "path": self.path, "lines": self.lines, "fired": self.fired}
+
+
+SOURCES = {"dTimer": TimerTrigger, "dGPIO": GpioTrigger, "dTTY": TtyTrigger}
+
+
+class TriggerSources:
+    """
+    按 sCurrentSelected 运行定时、GPIO 或 TTY 触发源中的一个，推理规则由 RecordRuleEngine 负责
+    """
+
+    def __init__(self):
+        self.source = None
+        self._key: Optional[tuple] = None
+
+    def configure(self, rule_config: Dict[str, Any], record_rule_config: Dict[str, Any]) -> None:
+        selected = record_rule_config.get("sCurrentSelected")
+        config = record_rule_config.get(selected) if selected in SOURCES else None
+        key = (selected, repr(config)) if rule_config.get("bRuleEnabled") and config else None
+        if key == self._key:
+            return
+        source = None
+        if key is not None:
+            # 新触发源先启动，设备打开失败时抛出 ValueError，原来的触发源继续运行
+            source = SOURCES[selected](config)
+            source.start()
+        self.stop()
+        self.source, self._key = source, key
+
+    def stop(self) -> None:
+        if self.source is not None:
+            self.source.stop()
+            self.source = None
+        self._key = None
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        return self.source.stats() if self.source is not None else None
+
+
+trigger_sources = TriggerSources()
@@ -45,12 +45,23 @@ class AlgorithmSupport(BaseModel):
 
 
 # 推理相关
+class InferenceLatency(BaseModel):
+    """推理各阶段耗时（毫秒）"""
+    fPreprocess: float = Field(0, description="取帧与信箱缩放")
+    fInference: float = Field(0, description="模型推理")
+    fPostprocess: float = Field(0, description="后处理")
+    fTotal: float = Field(0, description="合计")
+
+
 class InferenceStatus(BaseModel):
     """推理状态"""
     iEnable: int = Field(..., description="使能推理, 0 为关闭推理, 1 使能推理")
     sStatus: Literal["running", "stop", "error"] = Field(..., description="推理的状态")
     sModel: str = Field(..., description="当前运行的模型")
     iFPS: int = Field(..., description="推理频率")
+    sBackend: Optional[str] = Field(None, description="实际使用的推理后端, onnx 或 motion（没有模型时的替身）")
+    fMeasuredFPS: Optional[float] = Field(None, description="实测推理帧率")
+    dLatency: Optional[InferenceLatency] = Field(None, description="各阶段平均耗时")
 
 
 class InferenceConfig(BaseModel):
@@ -78,6 +89,7 @@ class MqttConfig(BaseModel):
     sTopic: str = Field(..., description="topic")
     sUsername: str = Field(..., description="用户名")
     sPassword: str = Field(..., description="密码")
+    iQos: int = Field(1, ge=0, le=1, description="QoS 等级, 0: 最多一次, 1: 至少一次")
     # sClientId: str = Field(..., description="客户端ID")
 
 
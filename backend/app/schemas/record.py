@@ -34,6 +34,14 @@ class ScheduleRuleConfig(RootModel):
     root: List[ScheduleTimeRange]
 
 
+class ScheduleStatus(BaseModel):
+    bActive: bool  # 查询时刻是否在计划内
+    iTimestamp: int  # 查询时刻（Unix 时间戳）
+    iWeekSecond: int = Field(..., ge=0, lt=604800)  # 查询时刻在一周中的秒数，周日 00:00:00 为 0
+    iNextTransition: Optional[int] = None  # 下一次进入或离开计划的时间戳，全周不变时为空
+    lIntervals: List[List[int]]  # 合并后的计划区间 [[开始秒, 结束秒), ...]，按一周中的秒数排序
+
+
 # 3. 录制规则配置 (Record Rule Configuration)
 class PolygonRegion(BaseModel):
     lPolygon: List[List[float]]  # [[x, y], ...] 坐标范围 0.0-1.0
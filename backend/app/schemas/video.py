@@ -149,6 +149,22 @@ class WebRTCAnswer(BaseModel):
     type: Literal["answer"]
 
 
+class WebRTCConfig(BaseModel):
+    """WebRTC 视频管线配置"""
+    iDecodeQueueSize: int = Field(..., ge=1, le=64, description="解码帧队列长度")
+    sDecodeDropPolicy: Literal["drop_oldest", "drop_newest"] = Field(..., description="队列满时的丢帧策略")
+    sRelayMode: Literal["passthrough", "relay", "transcode"] = Field(
+        ..., description="passthrough=H.264 文件直接转发不重新编码, relay=每路码流只编码一次, transcode=每个连接单独编码"
+    )
+    iAdaptiveLevels: int = Field(3, ge=1, le=4, description="码率自适应档位数，每档分辨率减半，1 表示关闭自适应")
+    iPrewarm: int = Field(1, ge=0, le=1, description="没有连接时也保持码流运行并缓存最近的 GOP，加快首帧")
+    iMaxPeers: int = Field(16, ge=1, le=64, description="WebRTC 总连接数上限")
+    iMaxPeersPerStream: int = Field(8, ge=1, le=64, description="每路码流的连接数上限")
+    sOverloadPolicy: Literal["reject", "downgrade"] = Field(
+        "downgrade", description="码流连接数已满时：reject=拒绝, downgrade=降级到子码流"
+    )
+
+
 # OSD 配置相关模型（使用相对坐标 0-1）
 class OSDAttributeConfig(BaseModel):
     """OSD 字体属性配置"""
@@ -6,6 +6,8 @@ from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from typing import Dict, List,Union
 
+from .filetree import FileTree
+
 
 @dataclass
 class BackendState:
@@ -18,8 +20,8 @@ class BackendState:
     )
     # 中继UUID映射到存储设备
     relay_mappings: Dict[str, str] = field(default_factory=dict)
-    # 模拟文件系统 {设备路径: {文件路径: 文件信息}}
-    mock_filesystems: Dict[str, Dict[str, Dict]] = field(default_factory=dict)
+    # 模拟文件系统 {设备路径: {文件路径: 文件信息}}，按目录索引
+    mock_filesystems: Dict[str, FileTree] = field(default_factory=dict)
     device_info: Dict[str, str] = field(
         default_factory=lambda: {
             "sSerialNumber": "RC1126B-" + secrets.token_hex(4).upper(),
@@ -187,7 +189,7 @@ class BackendState:
                     "inferenceOverlay": {"iEnabled": 1}
                 },
                 "osd-mask": {
-                    "iEnabled": 1,
+                    "iEnabled": 0,
                     "normalizedScreenSize": {
                         "iNormalizedScreenHeight": 608,
                         "iNormalizedScreenWidth": 1080,
@@ -276,6 +278,21 @@ class BackendState:
             },
         }
     )
+    # WebRTC 视频管线配置
+    webrtc_config: Dict[str, object] = field(
+        default_factory=lambda: {
+            "iDecodeQueueSize": 4,
+            "sDecodeDropPolicy": "drop_oldest",
+            "sRelayMode": "passthrough",
+            "iAdaptiveLevels": 3,
+            "iPrewarm": 1,
+            "iMaxPeers": 16,
+            "iMaxPeersPerStream": 8,
+            "sOverloadPolicy": "downgrade",
+        }
+    )
+    # 配置修订号，帧处理阶段据此判断缓存是否需要重建
+    config_revisions: Dict[str, int] = field(default_factory=dict)
     audio_streams: Dict[int, Dict] = field(
         default_factory=lambda: {
             0: {"iEnable": 1, "iBitRate": 32000, "sEncodeType": "G711A"},
@@ -291,19 +308,20 @@ class BackendState:
                     "sImageFlip": "close",
                     "sPowerLineFrequencyMode": "NTSC(60HZ)",
                 },
+                # 出厂参数都是中性值，默认配置下画面不被修改，直通模式可用
                 "nightToDay": {
-                    "iMode": 0,
+                    "iMode": 2,
                     "iNightToDayFilterLevel": 5,
                     "iNightToDayFilterTime": 5,
                     "iDawnTime": 28800,
                     "iDuskTime": 64800,
                     "iProfileSelect": 0,
-                    "iProfile": 0,
+                    "iProfile": -1,
                 },
                 "profile": [
                     {
                         "imageAdjustment": {
-                            "iBrightness": 57,
+                            "iBrightness": 50,
                             "iContrast": 50,
                             "iHue": 50,
                             "iSaturation": 50,
@@ -326,7 +344,7 @@ class BackendState:
                         },
                         "whiteBlance": {
                             "iWhiteBalanceCT": 2800,
-                            "sWhiteBlanceStyle": "manual",
+                            "sWhiteBlanceStyle": "auto",
                         },
                         "imageEnhancement": {
                             "iSpatialDenoiseLevel": 50,
@@ -447,7 +465,7 @@ class BackendState:
             },
         }
     )
-    # OSD 配置
+    # OSD 配置，叠加和遮挡默认关闭；启用任意一项后画面需要重新编码，直通模式改为共享编码
     osd_config: Dict[str, object] = field(
         default_factory=lambda: {
             "attribute": {
@@ -456,13 +474,13 @@ class BackendState:
                 "sOSDFrontColorMode": 1
             },
             "channelNameOverlay": {
-                "iEnabled": 1,
+                "iEnabled": 0,
                 "iPositionX": 0.528,
                 "iPositionY": 0.458,
                 "sChannelName": "reCamera 1126B"
             },
             "dateTimeOverlay": {
-                "iEnabled": 1,
+                "iEnabled": 0,
                 "iDisplayWeekEnabled": 1,
                 "iPositionX": 0.05,
                 "iPositionY": 0.244,
@@ -470,15 +488,15 @@ class BackendState:
                 "sTimeStyle": "24hour"
             },
             "SNOverlay": {
-                "iEnabled": 1,
+                "iEnabled": 0,
                 "iPositionX": 0.050,
                 "iPositionY": 0.244
             },
             "inferenceOverlay": {
-                "iEnabled": 1
+                "iEnabled": 0
             },
             "maskOverlay": {
-                "iEnabled": 1,
+                "iEnabled": 0,
                 "privacyMask": [
                     {
                         "id": 0,
@@ -567,7 +585,7 @@ def init_mock_filesystem() -> None:
     devices = ["/dev/sda1", "/dev/mmcblk0p1"]
     
     for device in devices:
-        state.mock_filesystems[device] = {}
+        state.mock_filesystems[device] = FileTree()
         
         # 创建一些日期文件夹
         today = datetime.now()
@@ -610,6 +628,15 @@ def init_mock_filesystem() -> None:
                     }
 
 
+def bump_revision(name: str) -> int:
+    """
+    配置变更后递增对应的修订号
+    """
+    revision = state.config_revisions.get(name, 0) + 1
+    state.config_revisions[name] = revision
+    return revision
+
+
 def reset_state() -> None:
     global state
     new_state = BackendState()
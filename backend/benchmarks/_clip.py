@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import os
+import tempfile
+
+import av
+import av.logging
+import numpy as np
+
+
+def make_clip(width: int = 1920, height: int = 1080, seconds: int = 3, fps: int = 30) -> str:
+    """
+    生成一段 H.264 测试视频，返回文件路径（同尺寸只生成一次）
+    """
+    path = os.path.join(tempfile.gettempdir(), f"recamera_bench_{width}x{height}_{seconds}s.mp4")
+    if os.path.exists(path):
+        return path
+
+    av.logging.set_level(av.logging.ERROR)
+    container = av.open(path, "w")
+    stream = container.add_stream("h264", rate=fps)
+    stream.width = width
+    stream.height = height
+    stream.pix_fmt = "yuv420p"
+    stream.options = {"g": str(fps)}
+    for i in range(seconds * fps):
+        img = np.zeros((height, width, 3), np.uint8)
+        x = (i * 16) % width
+        img[:, x:x + 64] = 255
+        img[..., 1] = (i * 4) % 256
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return path
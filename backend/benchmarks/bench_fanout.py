@@ -0,0 +1,59 @@
+"""
+共享解码源的 CPU 开销对比
+
+    python -m benchmarks.bench_fanout [video.mp4]
+
+per-peer: 每个连接各自解码（旧 LocalVideoTrack 的行为）
+shared:   每路码流一个解码源，分发给所有连接
+"""
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+
+from app.media.source import StreamSource
+
+from ._clip import make_clip
+
+DURATION = 3.0
+
+
+async def _consume(track, deadline: float) -> int:
+    frames = 0
+    while time.monotonic() < deadline:
+        await track.recv()
+        frames += 1
+    return frames
+
+
+async def run(video_path: str, peers: int, shared: bool) -> tuple:
+    if shared:
+        source = StreamSource(0, video_path)
+        tracks = [source.subscribe() for _ in range(peers)]
+    else:
+        tracks = [StreamSource(0, video_path).subscribe() for _ in range(peers)]
+
+    deadline = time.monotonic() + DURATION
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    frames = await asyncio.gather(*[_consume(track, deadline) for track in tracks])
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    for track in tracks:
+        track.stop()
+    return cpu / wall * 100, sum(frames) / peers / wall
+
+
+async def main() -> None:
+    video_path = sys.argv[1] if len(sys.argv) > 1 else make_clip()
+    print(f"video: {video_path}")
+    print(f"{'peers':>5} {'mode':>8} {'cpu%':>8} {'fps/peer':>9}")
+    for peers in (1, 4, 16):
+        for shared in (False, True):
+            cpu, fps = await run(video_path, peers, shared)
+            print(f"{peers:>5} {'shared' if shared else 'per-peer':>8} {cpu:>8.1f} {fps:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+文件中继列目录的耗时，100 万个模拟条目（400 天，每天一个目录和 2499 个录制文件）
+
+    python -m benchmarks.bench_filetree
+
+flat: 原来的 {路径: 条目} 字典，逐个 key 做 startswith 前缀匹配
+tree: FileTree，每个目录保存按 mtime 排序的子条目，列目录只访问该目录的子条目
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta
+
+from app.filetree import FileTree
+
+ENTRIES = 1_000_000
+DAYS = 400
+RUNS = 20
+ROOT = "DCIM"
+
+
+START = datetime(2025, 1, 1)
+
+
+def make_entries(count: int, days: int) -> list:
+    start = START
+    per_day = count // days
+    entries = []
+    for day in range(days):
+        date = start + timedelta(days=day)
+        folder = f"{ROOT}/{date:%Y-%m-%d}"
+        entries.append((folder, {"name": f"{date:%Y-%m-%d}", "type": "directory",
+                                 "mtime": date.strftime("%a, %d %b %Y %H:%M:%S GMT"), "size": 0}))
+        for index in range(per_day - 1):
+            moment = date + timedelta(seconds=index * 86400 // per_day)
+            name = f"{moment:%Y-%m-%d %H-%M-%S} video{index % 2}.mp4"
+            entries.append((f"{folder}/{name}", {"name": name, "type": "file",
+                                                 "mtime": moment.strftime("%a, %d %b %Y %H:%M:%S GMT"), "size": 15234567}))
+    return entries
+
+
+def list_flat(filesystem: dict, path: str) -> list:
+    """原 get_file_list 中非根目录的列法"""
+    file_list = []
+    for file_path in filesystem.keys():
+        if file_path.startswith(path + "/"):
+            if "/" not in file_path[len(path) + 1:]:
+                file_list.append(filesystem[file_path])
+    return file_list
+
+
+def measure(fn, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main() -> None:
+    entries = make_entries(ENTRIES, DAYS)
+    start = time.perf_counter()
+    flat = dict(entries)
+    flat_build = time.perf_counter() - start
+    start = time.perf_counter()
+    tree = FileTree()
+    for path, entry in entries:
+        tree[path] = entry
+    tree_build = time.perf_counter() - start
+    day = f"{ROOT}/{START + timedelta(days=DAYS // 2):%Y-%m-%d}"
+
+    print(f"{len(tree)} entries, {DAYS} directories, {len(tree.list(day))} files in {day}")
+    print(f"build      flat {flat_build:7.2f} s   tree {tree_build:7.2f} s")
+    for label, path in (("root", ROOT), ("day", day)):
+        flat_ms = measure(lambda: list_flat(flat, path), 3)
+        tree_ms = measure(lambda: tree.list(path), RUNS)
+        assert sorted(e["name"] for e in list_flat(flat, path)) == sorted(e["name"] for e in tree.list(path))
+        print(f"list {label:5} flat {flat_ms:9.3f} ms   tree {tree_ms:7.3f} ms")
+    path, entry = entries[-1]
+    print(f"insert          tree {measure(lambda: tree.__setitem__(path, entry), RUNS * 50) * 1000:7.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+ISP 模拟阶段在 1080p 下的逐帧开销（单线程）
+
+    python -m benchmarks.bench_isp
+
+default: 默认配置（亮度 57、手动白平衡 2800K）
+full:    所有参数都偏离中性值（曝光、亮度、对比度、色调、饱和度、白平衡、锐化）
+float:   不预先编译，逐帧用 NumPy 浮点运算实现同样的调节，作为对照
+"""
+from __future__ import annotations
+
+import copy
+import time
+
+import cv2
+import numpy as np
+
+from app.media.isp import ISPProgram, active_profile
+from app.state import state
+
+FRAMES = 60
+
+
+def _full_profile() -> dict:
+    profile = copy.deepcopy(active_profile(state.image_config[0]))
+    profile["imageAdjustment"].update({"iBrightness": 60, "iContrast": 65, "iHue": 55, "iSaturation": 70, "iSharpness": 75})
+    profile["exposure"].update({"sExposureMode": "manual", "sExposureTime": "1/25", "sGainMode": "manual", "iExposureGain": 3})
+    return profile
+
+
+def run_program(profile: dict, frame: np.ndarray) -> float:
+    program = ISPProgram(profile)
+    start = time.process_time()
+    for _ in range(FRAMES):
+        program.apply(frame)
+    return (time.process_time() - start) / FRAMES * 1000
+
+
+def run_float(profile: dict, frame: np.ndarray) -> float:
+    program = ISPProgram(profile)
+    lut = program.lut.astype(np.float32)
+    start = time.process_time()
+    for _ in range(FRAMES):
+        pixels = lut[frame]
+        pixels = pixels @ program.matrix.T
+        blurred = cv2.GaussianBlur(pixels, (3, 3), 0)
+        pixels = pixels * (1 + program.sharpen) - blurred * program.sharpen
+        frame[:] = np.clip(pixels, 0, 255)
+    return (time.process_time() - start) / FRAMES * 1000
+
+
+def main() -> None:
+    cv2.setNumThreads(1)
+    frame = np.random.randint(0, 255, (1080, 1920, 3), np.uint8)
+    print(f"{'mode':>8} {'ms/frame':>9} {'fps':>7}")
+    for mode, elapsed in (
+        ("default", run_program(active_profile(state.image_config[0]), frame)),
+        ("full", run_program(_full_profile(), frame)),
+        ("float", run_float(_full_profile(), frame)),
+    ):
+        print(f"{mode:>8} {elapsed:>9.2f} {1000 / elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+直通模式与共享编码模式的 CPU 开销对比（按实时节奏运行）
+
+    python -m benchmarks.bench_passthrough [video.mp4]
+
+relay:       解码 + 每路码流编码一次
+passthrough: 只解复用，转发文件中的 H.264 数据包
+"""
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+
+from app.media.passthrough import PassthroughStream
+from app.media.relay import EncodedStream
+from app.media.source import StreamSource
+
+from ._clip import make_clip
+
+DURATION = 3.0
+PEERS = 4
+
+
+async def _consume(track, deadline: float) -> int:
+    packets = 0
+    while time.monotonic() < deadline:
+        await track.recv()
+        packets += 1
+    return packets
+
+
+async def run(video_path: str, passthrough: bool) -> tuple:
+    if passthrough:
+        stream = PassthroughStream(0, video_path)
+    else:
+        source = StreamSource(0, video_path)
+        stream = EncodedStream(0, {"sFrameRate": "30", "iMaxRate": 2048}, source.subscribe)
+    tracks = [stream.subscribe() for _ in range(PEERS)]
+
+    deadline = time.monotonic() + DURATION
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    packets = await asyncio.gather(*[_consume(track, deadline) for track in tracks])
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    for track in tracks:
+        track.stop()
+    return cpu / wall * 100, sum(packets) / PEERS / wall
+
+
+async def main() -> None:
+    video_path = sys.argv[1] if len(sys.argv) > 1 else make_clip()
+    print(f"video: {video_path}, {PEERS} peers")
+    print(f"{'mode':>11} {'cpu%':>8} {'pkt/s/peer':>11}")
+    for passthrough in (False, True):
+        cpu, rate = await run(video_path, passthrough)
+        print(f"{'passthrough' if passthrough else 'relay':>11} {cpu:>8.1f} {rate:>11.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
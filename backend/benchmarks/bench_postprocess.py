@@ -0,0 +1,93 @@
+"""
+检测后处理的耗时（8400 个锚点、80 类，单线程）
+
+    python -m benchmarks.bench_postprocess
+
+yolov8: 通道在前的 (1, 84, 8400) 输出，解码、过滤、按类别 NMS、取前 k 个
+yolov5: 锚点在前的 (1, 8400, 85) 输出，流程相同
+loop:   逐框用 Python 解码并逐框做贪心 NMS，作为对照
+"""
+from __future__ import annotations
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from app.media.postprocess import PostprocessConfig, box_iou, postprocess
+
+ANCHORS = 8400
+CLASSES = 80
+OBJECTS = 40
+# 每个目标周围有多少个锚点的分数超过阈值
+ANCHORS_PER_OBJECT = 12
+RUNS = 200
+
+
+def make_yolov8(rng: np.random.Generator) -> np.ndarray:
+    output = np.zeros((4 + CLASSES, ANCHORS), np.float32)
+    output[:2] = rng.uniform(0, 640, (2, ANCHORS))
+    output[2:4] = rng.uniform(8, 120, (2, ANCHORS))
+    output[4:] = rng.uniform(0, 0.1, (CLASSES, ANCHORS))
+    anchors = rng.choice(ANCHORS, OBJECTS * ANCHORS_PER_OBJECT, replace=False).reshape(OBJECTS, -1)
+    for anchor_group in anchors:
+        center, size = rng.uniform(60, 580, 2), rng.uniform(20, 120, 2)
+        output[:2, anchor_group] = (center + rng.normal(0, 3, (len(anchor_group), 2))).T
+        output[2:4, anchor_group] = (size + rng.normal(0, 3, (len(anchor_group), 2))).T
+        output[4 + rng.integers(CLASSES), anchor_group] = rng.uniform(0.3, 0.95, len(anchor_group))
+    return output[None]
+
+
+def to_yolov5(output: np.ndarray) -> np.ndarray:
+    rows = output[0].T
+    objectness = rows[:, 4:].max(axis=1, keepdims=True)
+    return np.concatenate([rows[:, :4], objectness, rows[:, 4:] / np.maximum(objectness, 1e-6)], axis=1)[None]
+
+
+def run_loop(output: np.ndarray, config: PostprocessConfig) -> list:
+    rows = output[0].T
+    candidates = []
+    for row in rows:
+        class_id = int(np.argmax(row[4:]))
+        score = float(row[4 + class_id])
+        if score >= config.threshold:
+            cx, cy, w, h = row[:4]
+            candidates.append((score, class_id, [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]))
+    candidates.sort(key=lambda item: -item[0])
+    kept = []
+    for score, class_id, box in candidates:
+        boxes = np.array([box] + [other[2] for other in kept if other[1] == class_id], np.float32)
+        if len(boxes) > 1 and (box_iou(boxes)[0, 1:] > config.iou_threshold).any():
+            continue
+        kept.append((score, class_id, box))
+        if len(kept) == config.max_objects:
+            break
+    return kept
+
+
+def measure(function, *args, runs: int = RUNS) -> float:
+    start = time.process_time()
+    for _ in range(runs):
+        function(*args)
+    return (time.process_time() - start) / runs * 1000
+
+
+def main() -> None:
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    cv2.setNumThreads(1)
+    rng = np.random.default_rng(0)
+    config = PostprocessConfig(threshold=0.25, iou_threshold=0.45, max_objects=100)
+    yolov8 = make_yolov8(rng)
+    yolov5 = to_yolov5(yolov8)
+
+    result = postprocess(yolov8, config)
+    assert len(result) == len(run_loop(yolov8, config))
+    print(f"{ANCHORS} 个锚点, {CLASSES} 类, 超过阈值 {OBJECTS * ANCHORS_PER_OBJECT} 个, NMS 后 {len(result)} 个")
+    print(f"yolov8: {measure(postprocess, yolov8, config):7.3f} ms")
+    print(f"yolov5: {measure(postprocess, yolov5, config):7.3f} ms")
+    print(f"loop:   {measure(run_loop, yolov8, config, runs=5):7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
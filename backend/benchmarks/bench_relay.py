@@ -0,0 +1,75 @@
+"""
+共享编码（relay）与逐连接编码（transcode）的 CPU 开销对比
+
+    python -m benchmarks.bench_relay [video.mp4]
+
+transcode: 每个连接各自用 aiortc H264Encoder 编码同一帧
+relay:     每路码流只用 libx264 编码一次，每个连接只做 RTP 打包
+"""
+from __future__ import annotations
+
+import sys
+import time
+
+import av
+from aiortc.codecs.h264 import H264Encoder
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+from app.media.relay import EncodedStream
+
+from ._clip import make_clip
+
+FRAMES = 60
+
+
+def _load_frames(video_path: str) -> list:
+    frames = []
+    with av.open(video_path) as container:
+        for index, frame in enumerate(container.decode(video=0)):
+            if index >= FRAMES:
+                break
+            frame = frame.reformat(format="yuv420p")
+            frame.pts = index * 3000
+            frame.time_base = VIDEO_TIME_BASE
+            frames.append(frame)
+    return frames
+
+
+def run_transcode(frames: list, peers: int) -> float:
+    encoders = [H264Encoder() for _ in range(peers)]
+    start = time.process_time()
+    for frame in frames:
+        for encoder in encoders:
+            encoder.encode(frame)
+    return time.process_time() - start
+
+
+def run_relay(frames: list, peers: int) -> float:
+    stream = EncodedStream(0, {"sFrameRate": "30", "iMaxRate": 2048}, open_input=None)
+    packetizers = [H264Encoder() for _ in range(peers)]
+    start = time.process_time()
+    for index, frame in enumerate(frames):
+        for packet in stream._encode(frame, index == 0):
+            for packetizer in packetizers:
+                packetizer.pack(packet)
+    cpu = time.process_time() - start
+    stream._executor.shutdown()
+    return cpu
+
+
+def main() -> None:
+    video_path = sys.argv[1] if len(sys.argv) > 1 else make_clip()
+    frames = _load_frames(video_path)
+    print(f"video: {video_path}, {len(frames)} frames {frames[0].width}x{frames[0].height}")
+    print(f"{'peers':>5} {'mode':>9} {'cpu ms/frame':>13} {'ms/extra peer':>14}")
+    for mode, runner in (("transcode", run_transcode), ("relay", run_relay)):
+        base = None
+        for peers in (1, 4, 16):
+            per_frame = runner(frames, peers) / len(frames) * 1000
+            base = per_frame if base is None else base
+            extra = (per_frame - base) / (peers - 1) if peers > 1 else 0.0
+            print(f"{peers:>5} {mode:>9} {per_frame:>13.2f} {extra:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+推理结果 websocket 两种格式的带宽与服务端 CPU 对比（30 FPS）
+
+    python -m benchmarks.bench_results
+
+text:   每个目标按默认模板渲染一行，每行一条 websocket 文本消息
+binary: 每帧一条二进制消息（24 字节帧头 + 每个目标 12 字节），目标记录在推理进程中打包
+CPU 包含渲染/编码和 websocket 分帧，binary 另外计入推理进程中打包记录的时间
+"""
+from __future__ import annotations
+
+import time
+
+import numpy as np
+from websockets.frames import Frame, Opcode
+
+from app.media.postprocess import Detections, to_dicts
+from app.media.results import encode_binary, pack_records
+from app.media.template import DEFAULT_DETECTION_TEMPLATE, TARGET_FIELDS, CompiledTemplate
+
+FPS = 30
+WIDTH, HEIGHT = 1920, 1080
+FRAMES = 300
+
+
+def make_result(count: int, rng: np.random.Generator) -> dict:
+    corners = rng.uniform(0, [WIDTH - 200, HEIGHT - 200], (count, 2))
+    detections = Detections(
+        np.concatenate([corners, corners + rng.uniform(20, 200, (count, 2))], axis=1).astype(np.float32),
+        rng.uniform(0.25, 1, count).astype(np.float32),
+        rng.integers(0, 80, count),
+    )
+    return {
+        "seq": 0,
+        "timestamp": time.time(),
+        "width": WIDTH,
+        "height": HEIGHT,
+        "detections": to_dicts(detections, [f"class{i}" for i in range(80)]),
+        "_detections": detections,
+    }
+
+
+def run_text(result: dict, template: CompiledTemplate) -> int:
+    size = 0
+    for line in template.render(result):
+        size += len(Frame(Opcode.TEXT, line.encode()).serialize(mask=False, extensions=[]))
+    return size
+
+
+def run_binary(result: dict) -> int:
+    result["records"] = pack_records(result["_detections"], WIDTH, HEIGHT)
+    return len(Frame(Opcode.BINARY, encode_binary(result)).serialize(mask=False, extensions=[]))
+
+
+def measure(function, *args) -> tuple:
+    start = time.process_time()
+    for _ in range(FRAMES):
+        size = function(*args)
+    elapsed = (time.process_time() - start) / FRAMES
+    return size * FPS, elapsed * FPS * 100
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    template = CompiledTemplate(DEFAULT_DETECTION_TEMPLATE, TARGET_FIELDS["sDetection"])
+    print(f"{'目标数':>6} {'text KB/s':>10} {'binary KB/s':>12} {'text CPU%':>10} {'binary CPU%':>12}")
+    for count in (1, 10, 50, 200):
+        result = make_result(count, rng)
+        text_rate, text_cpu = measure(run_text, result, template)
+        binary_rate, binary_cpu = measure(run_binary, result)
+        print(f"{count:>6} {text_rate / 1024:>10.1f} {binary_rate / 1024:>12.1f} {text_cpu:>10.3f} {binary_cpu:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
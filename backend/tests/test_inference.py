@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.api import inference as inference_api
+from app.main import app
+from app.media.postprocess import Detections, to_dicts
+from app.media.results import BINARY_SUBPROTOCOL, decode_binary, hub, pack_records
+from app.schemas.inference import NotifyConfig
+from app.state import state
+
+
+def _result(seq: int) -> dict:
+    detections = Detections(
+        np.array([[96, 54, 960, 540]], np.float32), np.array([0.5], np.float32), np.array([1])
+    )
+    return {
+        "seq": seq,
+        "timestamp": 0.0,
+        "width": 1920,
+        "height": 1080,
+        "detections": to_dicts(detections, ["person", "car"]),
+        "records": pack_records(detections, 1920, 1080),
+    }
+
+
+def _publish_when_subscribed(result: dict) -> None:
+    deadline = time.monotonic() + 5
+    while not hub.subscriber_count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    hub.publish(result)
+
+
+def test_results_websocket_negotiates_binary_frames() -> None:
+    with TestClient(app) as client:
+        with client.websocket_connect("/cgi-bin/entry.cgi/ws/inference/results", subprotocols=[BINARY_SUBPROTOCOL]) as ws:
+            assert ws.accepted_subprotocol == BINARY_SUBPROTOCOL
+            _publish_when_subscribed(_result(3))
+            message = decode_binary(ws.receive_bytes())
+        assert message["seq"] == 3 and message["class_ids"].tolist() == [1]
+        assert np.allclose(message["boxes"], [[0.05, 0.05, 0.5, 0.5]], atol=1e-4)
+        assert abs(message["confidences"][0] - 0.5) < 1e-4
+
+
+def test_results_websocket_defaults_to_template_text() -> None:
+    with TestClient(app) as client:
+        with client.websocket_connect("/cgi-bin/entry.cgi/ws/inference/results") as ws:
+            _publish_when_subscribed(_result(4))
+            assert ws.receive_text().endswith("检测到 car 置信度 0.5 位置 (96,54,960,540)")
+
+
+def test_invalid_notify_template_is_rejected_before_outputs_restart(monkeypatch) -> None:
+    configured = []
+    monkeypatch.setattr(inference_api.notifier, "configure", configured.append)
+    payload = inference_api.get_notify_config("admin").model_dump()
+    previous = dict(state.notify_config)
+    payload["dTemplate"]["sDetection"] = "{class} {unknown}"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(inference_api.set_notify_config(NotifyConfig(**payload), "admin"))
+    assert error.value.status_code == 400
+    assert "unknown" in error.value.detail
+    assert not configured
+    assert state.notify_config == previous
@@ -0,0 +1,1258 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import tracemalloc
+
+import av
+from av.video.frame import PictureType
+import cv2
+import numpy as np
+import pytest
+
+from aiortc.mediastreams import VIDEO_TIME_BASE
+from aiortc.rtp import RTCP_PSFB_PLI, RtcpPsfbPacket, RtcpReceiverInfo, RtcpRrPacket
+
+from app.api import record as record_api
+from app.api import video
+from app.media.adapt import AdaptationController
+from app.media.decode import FrameQueue
+from app.media.denoise import DenoiseStage
+from app.media.framebus import FrameBus, mp_context
+from app.media.geometry import RemapPlan
+from app.media.inference import Letterbox, run_worker
+from app.media.isp import ISPProgram, ISPStage, color_matrix
+from app.media.mask import MaskPlan, MaskStage
+from app.media.schedule import DAY_SECONDS, WEEK_SECONDS, WeeklySchedule
+from app.media.stages import get_pipeline
+from app.media.scene import PROFILE_DAY, PROFILE_NIGHT, THRESHOLDS, SceneController, next_schedule_change, scheduled_profile
+from app.media.osd import OSDStage
+from app.media.pipeline import FramePipeline, FrameStage
+from app.media.passthrough import PassthroughStream, passthrough_allowed
+from app.media.session import PIPELINE_PASSTHROUGH, PIPELINE_RELAY
+from app.media import notify
+from app.media.mqtt import CONNACK, PUBACK, PUBLISH, read_packet
+from app.media.mqtt import packet as mqtt_packet
+from app.media.notify import HttpSink, MqttSink, SpillBuffer, UartSink
+from app.media import recorder as recording
+from app.media.results import ResultsHub, hub, pack_records
+from app.media.rules import RECORD_TRIGGER, RecordRuleEngine, RuleSet
+from app.media.triggers import GpioTrigger, TimerWheel, TtyTrigger
+from app.media.template import TARGET_FIELDS, CompiledTemplate, NotifyTemplates, TemplateError
+from app.media import relay
+from app.media.relay import PEER_QUEUE_SIZE, EncodedStream, PacketTrack, bind_sender
+from app.media.postprocess import YOLOV5, YOLOV8, Detections, PostprocessConfig, nms, postprocess
+from app.media.source import StreamSource
+from app.events import events
+from app.schemas.video import OSDConfig
+from app.filetree import FileTree
+from app.state import bump_revision, reset_state, state
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("media") / "clip.mp4")
+    container = av.open(path, "w")
+    stream = container.add_stream("h264", rate=30)
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    for i in range(30):
+        img = np.full((48, 64, 3), i * 8, np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return path
+
+
+def test_source_fans_out_one_decode(clip: str) -> None:
+    async def scenario() -> None:
+        source = StreamSource(0, clip)
+        tracks = [source.subscribe() for _ in range(3)]
+        frames = await asyncio.gather(*[track.recv() for track in tracks])
+        assert frames[0] is frames[1] is frames[2]
+        assert source.running
+        for track in tracks:
+            track.stop()
+        assert not source.running
+        assert source.subscriber_count == 0
+
+    asyncio.run(scenario())
+
+
+def test_bus_subscription_keeps_the_source_running_without_conversion(clip: str) -> None:
+    async def scenario() -> None:
+        source = StreamSource(0, clip)
+        subscription = source.subscribe_bus()
+        assert source.running
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if source.bus is not None and source.stats()["frames_decoded"] >= 3:
+                break
+        handle = subscription.bus.latest(raw=True)
+        assert handle is not None
+        subscription.bus.release(handle)
+        assert source.frames_delivered == 0
+        subscription.stop()
+        assert not source.running
+
+    asyncio.run(scenario())
+
+
+def test_source_downscales_and_decimates_once(clip: str) -> None:
+    async def scenario() -> None:
+        source = StreamSource(0, clip, output_size=(32, 32), frame_rate=15)
+        track = source.subscribe()
+        frames = [await asyncio.wait_for(track.recv(), 5) for _ in range(6)]
+        stats = source.stats()
+        track.stop()
+
+        assert {(frame.width, frame.height) for frame in frames} == {(32, 24)}
+        assert stats["output_fps"] == 15
+        assert stats["frames_skipped"] >= 5
+
+    asyncio.run(scenario())
+
+
+def test_passthrough_requires_settings_within_source(clip: str) -> None:
+    settings = {"sResolution": "1920*1080", "sFrameRate": "30", "iMaxRate": 4096}
+    assert passthrough_allowed(clip, settings)
+    assert not passthrough_allowed(clip, {**settings, "sResolution": "32*24"})
+    assert not passthrough_allowed(clip, {**settings, "sFrameRate": "15"})
+
+
+def test_default_config_selects_passthrough(clip: str) -> None:
+    reset_state()
+    # 出厂配置不修改画面，各码流都不需要重新编码
+    for stream_id in video.VIDEO_PATHS:
+        assert not get_pipeline(stream_id).active
+    assert video.select_pipeline(0, clip, True) == PIPELINE_PASSTHROUGH
+    state.osd_config["maskOverlay"]["iEnabled"] = 1
+    assert video.select_pipeline(0, clip, True) == PIPELINE_RELAY
+    reset_state()
+
+
+def test_passthrough_loops_with_continuous_pts(clip: str) -> None:
+    async def scenario() -> None:
+        stream = PassthroughStream(0, clip)
+        track = stream.subscribe()
+        packets = [await asyncio.wait_for(track.recv(), 5) for _ in range(40)]
+        track.stop()
+        assert not stream.running
+
+        # 从关键帧开始，且带有 Annex-B 格式的 SPS
+        assert packets[0].is_keyframe
+        assert bytes(packets[0]).startswith(b"\x00\x00\x00\x01\x67")
+        # 循环播放后时间戳不会重复
+        assert stream.loops >= 1
+        assert len({packet.pts for packet in packets}) == len(packets)
+
+    asyncio.run(scenario())
+
+
+def test_late_joiner_starts_from_cached_gop(clip: str) -> None:
+    async def scenario() -> None:
+        stream = PassthroughStream(0, clip)
+        first = stream.subscribe()
+        for _ in range(5):
+            await asyncio.wait_for(first.recv(), 5)
+        late = stream.subscribe()
+        # 缓存的 GOP 已经在队列里，不需要等待下一个关键帧
+        packet = await asyncio.wait_for(late.recv(), 0.01)
+        assert packet.is_keyframe
+        assert stream.instant_starts == 1
+        first.stop()
+        late.stop()
+
+    asyncio.run(scenario())
+
+
+class _FrameFeed:
+    """
+    共享编码器的输入：测试放入一帧，编码器取走一帧
+    """
+
+    def __init__(self):
+        self.frames: asyncio.Queue = asyncio.Queue()
+        self.pushed = []
+        self.count = 0
+
+    def push(self) -> None:
+        frame = av.VideoFrame.from_ndarray(np.full((48, 64, 3), self.count * 8 % 256, np.uint8), format="rgb24")
+        frame = frame.reformat(format="yuv420p")
+        frame.pts, frame.time_base = self.count * 3000, VIDEO_TIME_BASE
+        self.count += 1
+        self.pushed.append(frame)
+        self.frames.put_nowait(frame)
+
+    async def recv(self) -> av.VideoFrame:
+        return await self.frames.get()
+
+    def stop(self) -> None:
+        pass
+
+
+_ENCODE_SETTINGS = {"sFrameRate": "30", "iGOP": 300, "iMaxRate": 256}
+
+
+async def _recv_all(track: PacketTrack, count: int) -> list:
+    return [await asyncio.wait_for(track.recv(), 5) for _ in range(count)]
+
+
+def test_shared_encoder_encodes_once_for_all_peers() -> None:
+    async def scenario() -> None:
+        feed = _FrameFeed()
+        stream = EncodedStream(0, _ENCODE_SETTINGS, lambda: feed)
+        first, second = stream.subscribe(), stream.subscribe()
+        for _ in range(5):
+            feed.push()
+        packets = await _recv_all(first, 5)
+        # 两个连接收到的是同一批数据包对象，每帧只编码一次
+        assert [id(packet) for packet in packets] == [id(packet) for packet in await _recv_all(second, 5)]
+        assert stream.frames_encoded == 5 and packets[0].is_keyframe
+        first.stop()
+        assert stream.running
+        second.stop()
+        assert not stream.running
+
+    asyncio.run(scenario())
+
+
+def test_repeated_plis_collapse_into_one_forced_keyframe(monkeypatch) -> None:
+    class _Sender:
+        def __init__(self):
+            self.passed = []
+
+        async def _handle_rtcp_packet(self, packet) -> None:
+            self.passed.append(packet)
+
+    async def scenario() -> None:
+        feed = _FrameFeed()
+        stream = EncodedStream(0, _ENCODE_SETTINGS, lambda: feed)
+        tracks = [stream.subscribe(), stream.subscribe()]
+        senders = [_Sender(), _Sender()]
+        for sender, track in zip(senders, tracks):
+            bind_sender(sender, track)
+        feed.push()
+        await _recv_all(tracks[0], 1)
+        requests = stream.keyframe_requests
+
+        # 合并窗口之外：两个连接各发 3 次 PLI，只强制一个 IDR
+        monkeypatch.setattr(relay, "KEYFRAME_MIN_INTERVAL", 0.0)
+        for _ in range(3):
+            for sender in senders:
+                await sender._handle_rtcp_packet(RtcpPsfbPacket(fmt=RTCP_PSFB_PLI, ssrc=1, media_ssrc=2))
+        for _ in range(3):
+            feed.push()
+        assert [packet.is_keyframe for packet in await _recv_all(tracks[0], 3)] == [True, False, False]
+        # 强制关键帧标记在编码器自己的副本上，共享的输入帧不被修改
+        assert all(frame.pict_type == PictureType.NONE for frame in feed.pushed)
+        # 窗口内的请求被合并掉
+        monkeypatch.setattr(relay, "KEYFRAME_MIN_INTERVAL", 60.0)
+        await senders[0]._handle_rtcp_packet(RtcpPsfbPacket(fmt=RTCP_PSFB_PLI, ssrc=1, media_ssrc=2))
+        feed.push()
+        assert not (await _recv_all(tracks[0], 1))[0].is_keyframe
+
+        assert stream.keyframes == 2 and stream.keyframe_requests - requests == 7
+        # PLI 由共享编码器处理，不再交给 aiortc 的发送端
+        assert not senders[0].passed and not senders[1].passed
+        for track in tracks:
+            track.stop()
+
+    asyncio.run(scenario())
+
+
+def test_peer_queue_overflow_drops_until_next_keyframe() -> None:
+    class _Stream:
+        requests = 0
+
+        def request_keyframe(self) -> None:
+            self.requests += 1
+
+        def unsubscribe(self, track) -> None:
+            pass
+
+    def _packet(keyframe: bool) -> av.Packet:
+        packet = av.Packet(b"\x00\x00\x00\x01")
+        packet.is_keyframe = keyframe
+        return packet
+
+    async def scenario() -> None:
+        stream = _Stream()
+        track = PacketTrack(stream)
+        # 新连接从关键帧开始
+        track._put(_packet(False))
+        assert track.packets_dropped == 0 and not track._packets
+        for index in range(PEER_QUEUE_SIZE):
+            track._put(_packet(index == 0))
+        # 队列已满：丢弃积压，请求关键帧，之后的非关键帧也不再入队
+        track._put(_packet(False))
+        track._put(_packet(False))
+        assert track.packets_dropped == PEER_QUEUE_SIZE and stream.requests == 1 and not track._packets
+        keyframe = _packet(True)
+        track._put(keyframe)
+        track._put(_packet(False))
+        assert await track.recv() is keyframe and len(track._packets) == 1
+        track.stop()
+
+    asyncio.run(scenario())
+
+
+class _SwitchRecorder:
+    def __init__(self) -> None:
+        self.streams = []
+        self.bytes_sent = 0
+
+    def switch(self, stream) -> None:
+        self.streams.append(stream)
+
+
+def _receiver_report(fraction_lost: int) -> RtcpRrPacket:
+    return RtcpRrPacket(ssrc=1, reports=[RtcpReceiverInfo(2, fraction_lost, 0, 0, 0, 0, 0)])
+
+
+def test_adaptation_steps_down_on_loss_and_up_after_hold() -> None:
+    track = _SwitchRecorder()
+    controller = AdaptationController(track, 3, lambda level: 2048 // 3 ** level, lambda level: f"level-{level}")
+
+    controller.on_rtcp(_receiver_report(64), now=10.0)
+    # 两次切换之间至少间隔 SWITCH_INTERVAL
+    controller.on_rtcp(_receiver_report(64), now=11.0)
+    assert track.streams == ["level-1"]
+    controller.on_rtcp(_receiver_report(64), now=13.0)
+    assert controller.level == 2
+
+    # 丢包恢复后需要持续一段时间才升档
+    for now in (16.0, 18.0, 20.0):
+        controller.on_rtcp(_receiver_report(0), now=now)
+    assert controller.level == 2
+    controller.on_rtcp(_receiver_report(0), now=21.0)
+    assert controller.level == 1
+    assert track.streams == ["level-1", "level-2", "level-1"]
+
+
+@pytest.mark.parametrize("policy, expected", [("drop_oldest", [2, 3]), ("drop_newest", [0, 1])])
+def test_frame_queue_drop_policy(policy: str, expected: list) -> None:
+    async def scenario() -> None:
+        queue = FrameQueue(asyncio.get_running_loop(), maxsize=2, policy=policy)
+        for item in range(4):
+            queue.put(item)
+        assert queue.stats()["depth"] == 2
+        assert queue.stats()["dropped"] == 2
+        assert [await queue.get(), await queue.get()] == expected
+
+    asyncio.run(scenario())
+
+
+def _sum_latest_frame(spec, results) -> None:
+    bus = FrameBus.attach(spec)
+    handle = bus.latest()
+    results.put(int(bus.view(handle).sum()))
+    bus.release(handle)
+    bus.close()
+
+
+def test_frame_bus_refcount_and_cross_process_view() -> None:
+    bus = FrameBus((4, 4, 3), slots=2)
+    try:
+        slot = bus.reserve()
+        bus.array(slot)[:] = 7
+        handle = bus.publish(slot, pts=0)
+        # 最新帧和句柄各持有一个引用，只剩一个空闲槽位
+        assert bus.reserve() is not None
+        assert bus.reserve() is None
+
+        results = mp_context.Queue()
+        child = mp_context.Process(target=_sum_latest_frame, args=(bus.spec, results))
+        child.start()
+        assert results.get(timeout=30) == 7 * 4 * 4 * 3
+        child.join(timeout=30)
+
+        assert bus.retain(handle)
+        assert not bus.view(handle).flags.writeable
+        bus.release(handle)
+        bus.release(handle)
+    finally:
+        bus.close()
+
+
+def test_frame_bus_close_races_with_consumers() -> None:
+    bus = FrameBus((8, 8, 3), slots=3)
+    handle = bus.publish(bus.reserve(), pts=0)
+    view = bus.view(handle)
+    stop = threading.Event()
+    errors = []
+
+    def consume() -> None:
+        # 模拟线程池中正在转换最后一帧的消费者
+        while not stop.is_set():
+            try:
+                latest = bus.latest()
+                if latest is None:
+                    continue
+                frame = bus.view(latest)
+                if frame is not None:
+                    frame.sum()
+                bus.release(latest)
+            except Exception as exc:
+                errors.append(exc)
+                return
+
+    threads = [threading.Thread(target=consume) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    bus.close()
+    time.sleep(0.05)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert bus.view(handle) is None and bus.latest() is None
+    # 关闭之前取得的视图在句柄释放之前仍然可以读取，释放后才解除映射
+    assert view.sum() == 0 and bus._arrays
+    bus.release(handle)
+    assert not bus._arrays
+
+
+class _PaintStage(FrameStage):
+    name = "paint"
+    enabled = True
+
+    def apply(self, frame: np.ndarray, now: float) -> None:
+        frame[:] = 255
+
+
+def test_inference_reads_raw_frames_from_before_the_pipeline(clip: str) -> None:
+    async def scenario() -> None:
+        source = StreamSource(0, clip, pipeline=FramePipeline(0, [_PaintStage(0)]))
+        track = source.subscribe()
+        frame = await asyncio.wait_for(track.recv(), 5)
+        # 编码看到处理后的帧，推理从总线取到的原始帧没有经过处理
+        assert frame.to_ndarray(format="bgr24").min() == 255
+        bus = source.bus
+        raw, latest = bus.latest(raw=True), bus.latest()
+        assert bus.view(raw).max() < 255 and bus.view(latest).min() == 255
+        bus.release(raw)
+        bus.release(latest)
+        track.stop()
+
+    asyncio.run(scenario())
+
+
+def test_osd_stage_caches_tiles_and_touches_only_text_regions() -> None:
+    reset_state()
+    for overlay in ("channelNameOverlay", "dateTimeOverlay", "SNOverlay"):
+        state.osd_config[overlay]["iEnabled"] = 1
+    stage = OSDStage(0)
+    frame = np.zeros((360, 640, 3), np.uint8)
+    stage.apply(frame, 1000.2)
+    assert stage.renders == 3
+    changed = frame.any(axis=2)
+    assert changed.any()
+    assert not changed[-40:].any()
+
+    # 同一秒内不重新栅格化，下一秒只重画时间
+    stage.apply(frame, 1000.7)
+    assert stage.renders == 3
+    stage.apply(frame, 1001.1)
+    assert stage.renders == 4
+
+    # 修改通道名称只重画通道名称，序列号的文字块继续复用
+    state.osd_config["channelNameOverlay"]["sChannelName"] = "gate"
+    bump_revision("osd")
+    stage.apply(frame, 1001.5)
+    assert stage.renders == 5
+    reset_state()
+
+
+def test_osd_stage_draws_the_latest_inference_results(monkeypatch) -> None:
+    reset_state()
+    state.osd_config["inferenceOverlay"]["iEnabled"] = 1
+    stage = OSDStage(0)
+    detection = {"class_id": 0, "class": "person", "confidence": 0.9, "x1": 320, "y1": 180, "x2": 640, "y2": 540}
+    # 推理输入为 1280x720，叠加到 640x360 的画面上坐标减半
+    monkeypatch.setattr(hub, "latest", {"timestamp": 1000.0, "width": 1280, "height": 720, "detections": [detection]})
+    frame = np.zeros((360, 640, 3), np.uint8)
+    stage.apply(frame, 1000.2)
+    changed = frame.any(axis=2)
+    assert changed[90:270, 160].all() and changed[90, 160:320].all()
+    assert not changed[100:260, 170:310].any()
+    assert changed[:90, 160:320].any()
+
+    # 标签按类别缓存，下一帧不重新栅格化
+    stage.apply(frame, 1000.5)
+    assert stage.renders == 1
+
+    # 结果过期或码流关闭推理叠加后不再画框
+    frame[:] = 0
+    stage.apply(frame, 1002.0)
+    assert not frame.any()
+    state.video_streams[0]["osd-inference"]["inferenceOverlay"]["iEnabled"] = 0
+    stage.apply(frame, 1000.2)
+    assert not frame.any()
+    reset_state()
+
+
+def test_mask_stage_fills_global_and_stream_masks() -> None:
+    reset_state()
+    state.osd_config["maskOverlay"]["iEnabled"] = 1
+    state.video_streams[0]["osd-mask"]["iEnabled"] = 1
+    state.osd_config["maskOverlay"]["privacyMask"] = [
+        {"id": 0, "iPositionX": 0.0, "iPositionY": 0.0, "iMaskWidth": 0.25, "iMaskHeight": 0.5},
+    ]
+    # 码流 0 的 osd-mask 以 1080x608 为基准，换算到 540x304 的画面上减半
+    state.video_streams[0]["osd-mask"]["privacyMask"] = [
+        {"id": 0, "iPositionX": 540, "iPositionY": 304, "iMaskWidth": 200, "iMaskHeight": 100},
+    ]
+    stage = MaskStage(0)
+    assert stage.enabled
+    frame = np.full((304, 540, 3), 255, np.uint8)
+    stage.apply(frame, 0.0)
+
+    masked = ~frame.any(axis=2)
+    expected = np.zeros_like(masked)
+    expected[:152, :135] = True
+    expected[152:202, 270:370] = True
+    assert (masked == expected).all()
+
+    # 区域只在分辨率或修订号变化时重新计算
+    stage.apply(frame, 0.0)
+    assert stage.builds == 1
+    state.osd_config["maskOverlay"]["iEnabled"] = 0
+    bump_revision("mask")
+    frame[:] = 255
+    stage.apply(frame, 0.0)
+    assert stage.builds == 2
+    assert (~frame.any(axis=2)).sum() == 50 * 100
+    reset_state()
+
+
+def test_mask_plan_merges_overlapping_rects() -> None:
+    plan = MaskPlan([(0, 0, 10, 10), (5, 5, 15, 15), (0, 10, 10, 12)])
+    assert plan.pixels == 10 * 10 + 10 * 10 - 5 * 5 + 5 * 2
+    frame = np.ones((20, 20, 3), np.uint8)
+    plan.fill(frame)
+    assert (~frame.any(axis=2)).sum() == plan.pixels
+
+
+def test_isp_program_is_neutral_at_midpoints_and_keeps_gray_gray() -> None:
+    neutral = {
+        "imageAdjustment": {"iBrightness": 50, "iContrast": 50, "iHue": 50, "iSaturation": 50, "iSharpness": 50},
+        "exposure": {"sExposureMode": "auto"},
+        "whiteBlance": {"sWhiteBlanceStyle": "auto"},
+    }
+    assert not ISPProgram(neutral).active
+    # 色调和饱和度只作用于色差，灰色不变
+    gray = color_matrix(80, 90, np.ones(3)) @ np.full(3, 100.0)
+    assert np.allclose(gray, 100.0)
+
+
+def test_isp_stage_recompiles_only_on_revision() -> None:
+    reset_state()
+    stage = ISPStage(0)
+    frame = np.full((16, 16, 3), 100, np.uint8)
+    stage.apply(frame, 0.0)
+    stage.apply(frame, 0.0)
+    assert stage.compiles == 1
+
+    adjustment = state.image_config[0]["profile"][0]["imageAdjustment"]
+    adjustment.update({"iBrightness": 70, "iSharpness": 50})
+    state.image_config[0]["profile"][0]["whiteBlance"]["sWhiteBlanceStyle"] = "auto"
+    bump_revision("isp")
+    frame[:] = 100
+    stage.apply(frame, 0.0)
+    assert stage.compiles == 2
+    assert (frame == 151).all()
+    reset_state()
+
+
+def test_scene_controller_switches_with_hysteresis() -> None:
+    reset_state()
+    events.clear()
+    night_to_day = state.image_config[0]["nightToDay"]
+    night_to_day.update({"iMode": 0, "iNightToDayFilterLevel": 1, "iNightToDayFilterTime": 3})
+    controller = SceneController(0)
+    bright = np.full((8, 8), 200, np.uint8)
+    dark = np.full((8, 8), 10, np.uint8)
+
+    controller.observe(bright, 0.0)
+    assert night_to_day["iProfileCur"] == PROFILE_DAY
+
+    # 滚动窗口内的平均亮度跌破阈值后，还要持续 iNightToDayFilterTime 秒才切换
+    now = 0.0
+    while now < 4.0:
+        now += 0.25
+        controller.observe(dark, now)
+    assert controller.profile == PROFILE_DAY
+    controller.observe(dark, 6.0)
+    assert night_to_day["iProfileCur"] == PROFILE_NIGHT
+    assert [event["data"]["to"] for event in events.recent("scene")] == [PROFILE_DAY, PROFILE_NIGHT]
+    reset_state()
+
+
+def test_scheduled_profile_handles_wrap_around() -> None:
+    assert scheduled_profile({"iDawnTime": 28800, "iDuskTime": 64800}, 12 * 3600) == PROFILE_DAY
+    assert scheduled_profile({"iDawnTime": 28800, "iDuskTime": 64800}, 2 * 3600) == PROFILE_NIGHT
+    # 夜班摄像头：白天区间跨过午夜
+    assert scheduled_profile({"iDawnTime": 72000, "iDuskTime": 21600}, 3600) == PROFILE_DAY
+    assert scheduled_profile({"iDawnTime": 72000, "iDuskTime": 21600}, 43200) == PROFILE_NIGHT
+
+
+def test_scene_thresholds_cover_every_filter_level() -> None:
+    # schema 允许 0~5，数值越大越暗才转夜间，每一档都保留滞后区间
+    assert sorted(THRESHOLDS) == list(range(6))
+    levels = [THRESHOLDS[level] for level in range(6)]
+    assert all(night < day for night, day in levels)
+    assert levels == sorted(levels, reverse=True)
+
+
+def test_scheduled_scene_switches_on_a_timer_without_frames() -> None:
+    assert next_schedule_change({"iDawnTime": 28800, "iDuskTime": 64800}, 28800) == 36000
+    assert next_schedule_change({"iDawnTime": 72000, "iDuskTime": 21600}, 80000) == 28000
+
+    async def scenario() -> None:
+        reset_state()
+        local = time.localtime()
+        seconds = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec
+        night_to_day = state.image_config[0]["nightToDay"]
+        night_to_day.update({"iMode": 1, "iDawnTime": (seconds + 2) % 86400, "iDuskTime": (seconds + 3600) % 86400})
+        controller = SceneController(0)
+        controller.schedule()
+        try:
+            assert controller.profile == PROFILE_NIGHT
+            # 没有任何画面采样，到晨曦时刻由定时器切换
+            await asyncio.sleep(3.1)
+            assert controller.profile == PROFILE_DAY and controller.samples == 0
+        finally:
+            controller.stop()
+        reset_state()
+
+    asyncio.run(scenario())
+
+
+def test_source_rotates_once_into_the_bus(clip: str) -> None:
+    async def scenario() -> None:
+        source = StreamSource(0, clip, output_size=(32, 32), geometry=(90, "mirror"))
+        track = source.subscribe()
+        frame = await asyncio.wait_for(track.recv(), 5)
+        track.stop()
+        assert (frame.width, frame.height) == (24, 32)
+
+    asyncio.run(scenario())
+
+
+def test_geometry_and_denoise_do_not_allocate_per_frame() -> None:
+    reset_state()
+    enhancement = state.image_config[0]["profile"][0]["imageEnhancement"]
+    enhancement.update({"sNoiseReduceMode": 1, "iSpatialDenoiseLevel": 60, "iTemporalDenoiseLevel": 80})
+    source = np.random.randint(0, 255, (240, 320, 3), np.uint8)
+    plan = RemapPlan((320, 240), (320, 240), 270, "flip")
+    frame = np.empty((plan.height, plan.width, 3), np.uint8)
+    stage = DenoiseStage(0)
+    assert stage.enabled
+    # 第一帧分配累积缓冲区
+    plan.apply(source, frame)
+    stage.apply(frame, 0.0)
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(20):
+            plan.apply(source, frame)
+            stage.apply(frame, 0.0)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    # 一帧有 230KB，任何逐帧分配都会超过这个值
+    assert peak < 4096
+    reset_state()
+
+
+def test_letterbox_maps_boxes_back_to_the_source() -> None:
+    letterbox = Letterbox(64)
+    canvas = letterbox.apply(np.full((48, 128, 3), 200, np.uint8))
+    # 宽 128 缩到 64，上下各填充 (64 - 24) / 2 行
+    assert letterbox.pad == (0, 20)
+    assert canvas[:20].max() == 114 and canvas[20:44].min() == 200
+    assert letterbox.to_source(np.array([[0.0, 20.0, 32.0, 44.0]])).tolist() == [[0.0, 0.0, 64.0, 48.0]]
+
+
+def test_inference_worker_reports_detections_and_latency() -> None:
+    bus = FrameBus((96, 128, 3), slots=3)
+    control, results = mp_context.Queue(), mp_context.Queue()
+    options = {"sModel": "missing.rknn", "iFPS": 20, "dConfig": {"fThr": 0.25, "fIouThr": 0.45, "lLablel": ["person"]}}
+    child = mp_context.Process(target=run_worker, args=(bus.spec, control, results, options))
+    try:
+        slot = bus.reserve()
+        bus.array(slot)[:] = 0
+        bus.release(bus.publish(slot, pts=0))
+        child.start()
+        assert results.get(timeout=30) == {"backend": "motion"}
+        first = results.get(timeout=30)
+        assert first["seq"] == 0 and first["detections"] == []
+        assert set(first["latency"]) == {"preprocess", "inference", "postprocess"}
+
+        slot = bus.reserve()
+        bus.array(slot)[:] = 0
+        bus.array(slot)[30:60, 40:80] = 255
+        bus.release(bus.publish(slot, pts=1))
+        second = results.get(timeout=30)
+        assert second["seq"] == 1 and second["width"] == 128
+        (detection,) = second["detections"]
+        assert detection["class"] == "person"
+        # 帧差在 1/4 分辨率上做并经过膨胀，框会略大于实际区域
+        assert abs(detection["x1"] - 40) <= 12 and abs(detection["y2"] - 60) <= 12
+    finally:
+        control.put(None)
+        child.join(timeout=30)
+        bus.close()
+
+
+def test_postprocess_decodes_both_layouts_with_class_aware_nms() -> None:
+    # cx, cy, w, h 与两类分数：前两个同类高度重叠，第三个与第一个重叠但类别不同，第四个低于阈值
+    rows = np.array([
+        [50, 50, 40, 40, 0.9, 0.0],
+        [52, 51, 40, 40, 0.8, 0.0],
+        [50, 50, 40, 40, 0.0, 0.7],
+        [200, 200, 20, 20, 0.1, 0.0],
+    ], np.float32)
+    config = PostprocessConfig.from_model_config({"fThr": 0.25, "fIouThr": 0.45, "iMaxObject": 10, "lLablel": ["person", "car"]})
+    yolov8 = postprocess(rows.T[None], config, YOLOV8)
+    assert yolov8.class_ids.tolist() == [0, 1]
+    assert yolov8.boxes[0].tolist() == [30, 30, 70, 70]
+    # YOLOv5 格式多一列目标分数
+    yolov5 = postprocess(np.insert(rows, 4, 1.0, axis=1)[None], config, YOLOV5)
+    assert yolov5.class_ids.tolist() == [0, 1] and np.allclose(yolov5.scores, yolov8.scores)
+    config.max_objects = 1
+    assert len(postprocess(rows.T[None], config, YOLOV8)) == 1
+
+
+def test_nms_matches_opencv_greedy_nms() -> None:
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        corners = rng.uniform(0, 100, (150, 2))
+        sizes = rng.uniform(5, 40, (150, 2))
+        scores = rng.uniform(0.3, 1, 150).astype(np.float32)
+        class_ids = rng.integers(0, 3, 150)
+        order = np.argsort(-scores, kind="stable")
+        detections = Detections(np.concatenate([corners, corners + sizes], axis=1), scores, class_ids).take(order)
+        expected = cv2.dnn.NMSBoxesBatched(
+            np.concatenate([corners, sizes], axis=1).tolist(), scores.tolist(), class_ids.tolist(), 0.0, 0.45
+        )
+        assert set(order[nms(detections, 0.45)]) == set(np.asarray(expected).reshape(-1))
+
+
+def test_results_hub_drops_oldest_per_subscriber() -> None:
+    async def scenario() -> None:
+        hub = ResultsHub()
+        fast = hub.subscribe("fast", maxsize=4)
+        slow = hub.subscribe("slow", maxsize=2)
+        for seq in range(3):
+            hub.publish({"seq": seq})
+            assert (await fast.get())["seq"] == seq
+        for seq in range(3, 6):
+            hub.publish({"seq": seq})
+        # 慢订阅者只保留最新的两个结果，快订阅者不受影响
+        assert [(await slow.get())["seq"] for _ in range(2)] == [4, 5]
+        assert [(await fast.get())["seq"] for _ in range(3)] == [3, 4, 5]
+        stats = {item["name"]: item for item in hub.stats()["subscribers"]}
+        assert stats["slow"]["dropped"] == 4 and stats["fast"]["dropped"] == 0
+        assert stats["slow"]["lag"] == stats["fast"]["lag"] == 0
+        hub.publish({"seq": 6})
+        assert hub.stats()["subscribers"][1]["lag"] == 1
+        slow.close()
+        assert hub.subscriber_count == 1
+
+    asyncio.run(scenario())
+
+
+def test_compiled_template_renders_a_frame_and_rejects_unknown_fields() -> None:
+    template = CompiledTemplate("#{seq} {class}/{class} {confidence:.0%} {{x1}}={x1}", TARGET_FIELDS["sDetection"])
+    result = {
+        "seq": 7,
+        "timestamp": 0.0,
+        "detections": [
+            {"class": "person", "class_id": 0, "confidence": 0.5, "x1": 1, "y1": 2, "x2": 3, "y2": 4},
+            {"class": "car", "class_id": 1, "confidence": 0.25, "x1": 5, "y1": 6, "x2": 7, "y2": 8},
+        ],
+    }
+    assert template.render(result) == ["#7 person/person 50% {x1}=1", "#7 car/car 25% {x1}=5"]
+    for source in ("{foo}", "{0}", "{class.upper}", "{confidence:d}", "{class"):
+        with pytest.raises(TemplateError):
+            CompiledTemplate(source, TARGET_FIELDS["sDetection"])
+    # 分类模板没有框坐标
+    with pytest.raises(TemplateError, match="sClassification"):
+        NotifyTemplates({"sClassification": "{x1}"})
+    assert NotifyTemplates({"sDetection": ""}).detection is None
+
+
+def _notify_result(seq: int) -> dict:
+    return {
+        "seq": seq,
+        "timestamp": 0.0,
+        "width": 64,
+        "height": 48,
+        "detections": [{"class": "person", "class_id": 0, "confidence": 0.5, "x1": 1, "y1": 2, "x2": 3, "y2": 4}],
+        "records": b"",
+    }
+
+
+async def _until(condition, timeout: float = 5.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_spill_buffer_keeps_order_and_drops_oldest() -> None:
+    async def scenario() -> None:
+        spill = SpillBuffer(3)
+        for item in range(4):
+            spill.append(item)
+        batch = await spill.take(2)
+        spill.append(4)
+        # 发送失败的一批放回队首，超出容量时丢最旧的
+        spill.restore(batch)
+        assert await spill.take(10) == [2, 3, 4] and spill.dropped == 2
+
+    asyncio.run(scenario())
+
+
+def test_mqtt_sink_reconnects_and_redelivers_unacked(monkeypatch) -> None:
+    monkeypatch.setattr(notify, "BACKOFF_BASE", 0.01)
+
+    async def scenario() -> None:
+        connections, received = [], []
+
+        async def broker(reader, writer) -> None:
+            connections.append(writer)
+            header, body = await read_packet(reader)
+            assert header == 0x10 and body[:6] == b"\x00\x04MQTT"
+            writer.write(mqtt_packet(CONNACK, b"\x00\x00"))
+            try:
+                while True:
+                    header, body = await read_packet(reader)
+                    if header & 0xF0 != PUBLISH:
+                        continue
+                    # 第一个连接收到消息后不确认直接断开
+                    if len(connections) == 1:
+                        writer.close()
+                        return
+                    assert (header >> 1) & 3 == 1
+                    topic_length = struct.unpack("!H", body[:2])[0]
+                    packet_id = body[2 + topic_length:4 + topic_length]
+                    received.append(body[4 + topic_length:])
+                    writer.write(mqtt_packet(PUBACK, packet_id))
+            except asyncio.IncompleteReadError:
+                pass
+
+        server = await asyncio.start_server(broker, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        sink = MqttSink({"sURL": "mqtt://127.0.0.1", "iPort": port, "sTopic": "results/data", "sUsername": "", "sPassword": ""})
+        sink.start()
+        try:
+            await _until(lambda: sink.connected)
+            hub.publish(_notify_result(1))
+            await _until(lambda: sink.sent == 1)
+            assert len(connections) == 2 and sink.reconnects == 1 and sink.failures == 1
+            assert [json.loads(message)["seq"] for message in received] == [1]
+            assert "records" not in json.loads(received[0])
+        finally:
+            sink.stop()
+            server.close()
+
+    asyncio.run(scenario())
+
+
+def test_http_sink_micro_batches_over_one_connection() -> None:
+    async def scenario() -> None:
+        connections, requests = [], []
+
+        async def server(reader, writer) -> None:
+            connections.append(writer)
+            try:
+                while True:
+                    head = (await reader.readuntil(b"\r\n\r\n")).decode().lower()
+                    length = int(head.split("content-length:")[1].split("\r\n")[0])
+                    requests.append((head, json.loads(await reader.readexactly(length))))
+                    # 第一次请求返回 503，输出端应该重试同一批
+                    code = "503 Service Unavailable" if len(requests) == 1 else "200 OK"
+                    writer.write(f"HTTP/1.1 {code}\r\nContent-Length: 0\r\n\r\n".encode())
+            except asyncio.IncompleteReadError:
+                pass
+
+        listener = await asyncio.start_server(server, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        sink = HttpSink({"sUrl": f"http://127.0.0.1:{port}/results", "sToken": "Bearer abc"})
+        sink.start()
+        try:
+            for seq in range(10):
+                hub.publish(_notify_result(seq))
+            await _until(lambda: sink.sent == 10)
+            assert len(connections) == 1 and sink.failures == 1
+            assert "authorization: bearer abc" in requests[0][0]
+            assert [frame["seq"] for frame in requests[1][1]] == list(range(10))
+            assert sink.batches == 1
+        finally:
+            sink.stop()
+            listener.close()
+
+    asyncio.run(scenario())
+
+
+def test_uart_sink_writes_template_lines_to_a_pty() -> None:
+    async def scenario() -> None:
+        master, slave = os.openpty()
+        os.set_blocking(master, False)
+        sink = UartSink({"sPort": os.ttyname(slave), "iBaudRate": 115200})
+        sink.start()
+        output = bytearray()
+
+        def read() -> bool:
+            try:
+                output.extend(os.read(master, 4096))
+            except BlockingIOError:
+                pass
+            return output.count(b"\n") == 3
+
+        try:
+            await _until(lambda: sink.connected)
+            for seq in range(3):
+                hub.publish(_notify_result(seq))
+            await _until(read)
+            assert output.decode().splitlines()[0].endswith("检测到 person 置信度 0.5 位置 (1,2,3,4)")
+        finally:
+            sink.stop()
+            os.close(master)
+            os.close(slave)
+        with pytest.raises(ValueError):
+            UartSink({"sPort": "/dev/null", "iBaudRate": 12345})
+
+    asyncio.run(scenario())
+
+
+def test_invalid_sink_config_keeps_the_running_sink() -> None:
+    async def scenario() -> None:
+        notifier = notify.Notifier()
+        http = {"sUrl": "http://127.0.0.1:9/results", "sToken": ""}
+        notifier.configure({"iMode": notify.NOTIFY_HTTP, "dHttp": http})
+        sink = notifier.sink
+        try:
+            with pytest.raises(ValueError):
+                notifier.configure({"iMode": notify.NOTIFY_UART, "dUart": {"sPort": "/dev/null", "iBaudRate": 12345}})
+            # 新的输出端构造失败，原来的输出端继续运行
+            assert notifier.sink is sink and sink._tasks and not any(task.done() for task in sink._tasks)
+        finally:
+            notifier.stop()
+
+    asyncio.run(scenario())
+
+
+def test_rule_set_filters_class_confidence_and_region() -> None:
+    rules = RuleSet([
+        {"sID": "left", "iDebounceTimes": 0, "lConfidenceFilter": [0.5, 1.0], "lClassFilter": [0],
+         "lRegionFilter": [{"lPolygon": [[0, 0], [0.5, 0], [0.5, 1], [0, 1]]}]},
+        # 两个多边形任一命中即可，类别为空表示所有类别
+        {"sID": "corners", "iDebounceTimes": 0, "lConfidenceFilter": [0.0, 0.4], "lClassFilter": [],
+         "lRegionFilter": [{"lPolygon": [[0.8, 0.8], [1, 0.8], [1, 1]]}, {"lPolygon": [[0, 0], [0.2, 0], [0, 0.2]]}]},
+        {"sID": "any", "iDebounceTimes": 0, "lConfidenceFilter": [0.9, 1.0], "lClassFilter": [3, 200]},
+    ])
+
+    def evaluate(*targets) -> list:
+        class_ids, confidences, centers = (np.array(values) for values in zip(*targets))
+        boxes = np.concatenate([centers - 0.01, centers + 0.01], axis=1)
+        return rules.evaluate(class_ids, confidences.astype(np.float32), boxes).tolist()
+
+    assert evaluate((0, 0.6, (0.25, 0.5))) == [True, False, False]
+    assert evaluate((0, 0.6, (0.75, 0.5)), (1, 0.6, (0.25, 0.5))) == [False, False, False]
+    assert evaluate((7, 0.3, (0.05, 0.05)), (500, 0.95, (0.5, 0.5))) == [False, True, False]
+    assert evaluate((7, 0.3, (0.85, 0.95)), (200, 0.95, (0.5, 0.5))) == [False, False, True]
+    assert rules.evaluate(np.zeros(0, np.int64), np.zeros(0, np.float32), np.zeros((0, 4))).tolist() == [False] * 3
+    with pytest.raises(ValueError):
+        RuleSet([{"sID": "bad", "iDebounceTimes": 0, "lConfidenceFilter": [0, 1], "lClassFilter": [],
+                  "lRegionFilter": [{"lPolygon": [[0, 0], [1, 1]]}]}])
+
+
+def test_record_rules_debounce_start_and_stop() -> None:
+    engine = RecordRuleEngine()
+    engine.load([{"sID": "person", "iDebounceTimes": 3, "lConfidenceFilter": [0.5, 1.0], "lClassFilter": [0]}])
+    hit = Detections(np.array([[10, 10, 20, 20]], np.float32), np.array([0.8], np.float32), np.array([0]))
+    frames = {True: pack_records(hit, 64, 48), False: pack_records(Detections.empty(), 64, 48)}
+    events.clear()
+    pattern = [True, True, False, True, True, True, False, True, False, False, False]
+    states = [engine.observe({"seq": seq, "records": frames[matched]}) for seq, matched in enumerate(pattern)]
+    # 连续 3 帧命中才开始，连续 3 帧未命中才结束，中间单帧漏检不会打断
+    assert states == [False] * 5 + [True] * 5 + [False]
+    triggers = [(event["data"]["action"], event["data"]["seq"]) for event in events.recent(RECORD_TRIGGER)]
+    assert triggers == [("start", 5), ("stop", 10)]
+    assert events.recent(RECORD_TRIGGER)[0]["data"]["rules"] == ["person"]
+
+
+def test_weekly_schedule_merges_ranges_and_wraps_the_week() -> None:
+    def point(day: int, hour: int) -> dict:
+        return {"iDay": day, "iHour": hour, "iMinute": 0, "iSecond": 0}
+
+    schedule = WeeklySchedule([
+        {"dStart": point(1, 9), "dEnd": point(1, 18)},
+        {"dStart": point(1, 12), "dEnd": point(1, 20)},
+        # 周六 22 点到周日 6 点，跨过一周的边界
+        {"dStart": point(6, 22), "dEnd": point(0, 6)},
+        {"dStart": point(3, 8), "dEnd": point(3, 8)},
+    ])
+    hour = 3600
+    assert schedule.intervals == [[0, 6 * hour], [DAY_SECONDS + 9 * hour, DAY_SECONDS + 20 * hour], [6 * DAY_SECONDS + 22 * hour, WEEK_SECONDS]]
+    assert schedule.active(0) and schedule.active(WEEK_SECONDS - 1) and not schedule.active(6 * hour)
+    assert schedule.active(DAY_SECONDS + 19 * hour) and not schedule.active(3 * DAY_SECONDS + 8 * hour)
+    # 跨周的区间在周日 0 点不切换，下一次切换是周日 6 点
+    assert schedule.next_transition(6 * DAY_SECONDS + 23 * hour) == 7 * hour
+    assert schedule.next_transition(2 * DAY_SECONDS) == 4 * DAY_SECONDS + 22 * hour
+    assert WeeklySchedule([{"dStart": point(0, 0), "dEnd": point(0, 0)}]).next_transition(0) is None
+    full = WeeklySchedule([{"dStart": point(2, 0), "dEnd": point(2, 0)}, {"dStart": point(0, 0), "dEnd": point(6, 23)},
+                           {"dStart": point(6, 22), "dEnd": point(0, 0)}])
+    assert full.active(12345) and full.next_transition(12345) is None
+
+
+def test_timer_wheel_fires_in_order_across_rounds() -> None:
+    async def scenario() -> None:
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(tick=0.01, slots=8)
+        fired = []
+        # 0.2 秒超过一圈（0.08 秒），和 0.05 秒落在同一个槽
+        for delay in (0.2, 0.05, 0.03, 0.12):
+            wheel.call_later(delay, lambda delay=delay: fired.append((delay, loop.time())))
+        wheel.call_later(0.04, lambda: fired.append("cancelled")).cancel()
+        start = loop.time()
+        await _until(lambda: len(fired) == 4)
+        assert [delay for delay, _ in fired] == [0.03, 0.05, 0.12, 0.2]
+        assert all(when - start >= delay - 0.011 for delay, when in fired)
+        await asyncio.sleep(0.1)
+        assert wheel.count == 0 and wheel._armed is None
+
+    asyncio.run(scenario())
+
+
+def test_gpio_trigger_debounces_edges_on_a_value_file(tmp_path) -> None:
+    async def scenario() -> None:
+        value = tmp_path / "GPIO_01" / "value"
+        value.parent.mkdir()
+        value.write_text("0\n")
+        events.clear()
+        trigger = GpioTrigger(
+            {"sName": "GPIO_01", "sInitialLevel": "low", "sSignal": "high", "iDebounceDurationMs": 50}, root=str(tmp_path)
+        )
+        trigger.start()
+        try:
+            # 抖动：去抖时间内回到原电平不触发
+            value.write_text("1\n")
+            await asyncio.sleep(0.01)
+            value.write_text("0\n")
+            await asyncio.sleep(0.15)
+            assert trigger.edges >= 2 and not events.recent(RECORD_TRIGGER)
+            value.write_text("1\n")
+            await _until(lambda: len(events.recent(RECORD_TRIGGER)) == 1)
+            value.write_text("0\n")
+            await _until(lambda: len(events.recent(RECORD_TRIGGER)) == 2)
+        finally:
+            trigger.stop()
+        assert [event["data"]["action"] for event in events.recent(RECORD_TRIGGER)] == ["start", "stop"]
+
+    asyncio.run(scenario())
+
+
+def test_stopping_a_held_gpio_trigger_releases_the_recording(tmp_path) -> None:
+    reset_state()
+    state.schedule_rule_config = []
+    bump_revision("schedule")
+
+    async def scenario() -> None:
+        value = tmp_path / "GPIO_01" / "value"
+        value.parent.mkdir()
+        value.write_text("0\n")
+        service = recording.Recorder()
+        events.add_listener(service._on_event)
+        trigger = GpioTrigger(
+            {"sName": "GPIO_01", "sInitialLevel": "low", "sSignal": "high", "iDebounceDurationMs": 20}, root=str(tmp_path)
+        )
+        try:
+            trigger.start()
+            value.write_text("1\n")
+            await _until(lambda: service._holds == {"gpio"})
+            # 电平仍为高时替换或关闭触发源，录制保持也要解除
+            trigger.stop()
+            assert not service._holds
+            trigger.stop()
+            assert [event["data"]["action"] for event in events.recent(RECORD_TRIGGER)][-2:] == ["start", "stop"]
+        finally:
+            events.remove_listener(service._on_event)
+
+    asyncio.run(scenario())
+    reset_state()
+
+
+def test_tty_trigger_matches_command_lines_from_a_pty() -> None:
+    async def scenario() -> None:
+        master, slave = os.openpty()
+        events.clear()
+        trigger = TtyTrigger({"sName": os.ttyname(slave), "sCommand": "record"})
+        trigger.start()
+        try:
+            os.write(master, b"noise\nrec")
+            await asyncio.sleep(0.05)
+            assert trigger.lines == 1 and not events.recent(RECORD_TRIGGER)
+            # 命令被拆成两次到达，带 CRLF 也能识别
+            os.write(master, b"ord\r\nrecord\n")
+            await _until(lambda: trigger.fired == 2)
+        finally:
+            trigger.stop()
+            os.close(master)
+            os.close(slave)
+        assert events.recent(RECORD_TRIGGER)[0]["data"] == {"source": "tty", "action": "trigger", "command": "record"}
+
+    asyncio.run(scenario())
+
+
+def test_failed_rule_update_keeps_running_rules_and_triggers() -> None:
+    from fastapi import HTTPException
+
+    from app.api.record import _apply_rules
+    from app.media.rules import record_rules
+    from app.media.triggers import trigger_sources
+
+    async def scenario() -> None:
+        reset_state()
+        rule_config = {"bRuleEnabled": True, "dWriterConfig": {"sFormat": "mp4", "iIntervalMs": 0}}
+        _apply_rules(rule_config, {"sCurrentSelected": "dTimer", "dTimer": {"iIntervalSeconds": 60}})
+        timer = trigger_sources.source
+        try:
+            # 触发设备打开失败：返回 400，定时触发源继续运行，推理规则没有被启动
+            with pytest.raises(HTTPException) as error:
+                _apply_rules(rule_config, {
+                    "sCurrentSelected": "dTTY",
+                    "dTTY": {"sName": "/nonexistent/ttyS9", "sCommand": "record"},
+                })
+            assert error.value.status_code == 400
+            assert trigger_sources.source is timer and timer._handle is not None
+            assert record_rules.rules is None
+        finally:
+            trigger_sources.stop()
+            record_rules.stop()
+
+    asyncio.run(scenario())
+
+
+def test_recorder_flushes_gop_aligned_preroll_into_mp4(clip: str, tmp_path, monkeypatch) -> None:
+    reset_state()
+    slot = state.storage_status["lSlots"][0]
+    slot["sMountPath"] = str(tmp_path)
+    state.schedule_rule_config = []
+    bump_revision("schedule")
+    monkeypatch.setattr(recording, "POSTROLL_SECONDS", 0.0)
+
+    async def scenario() -> None:
+        service = recording.Recorder()
+        stream = PassthroughStream(0, clip)
+        service.configure({"bRuleEnabled": True, "dWriterConfig": {"sFormat": "mp4", "iIntervalMs": 0}}, {0: lambda: stream})
+        await asyncio.sleep(1.5)
+        ring = service.streams[0].ring
+        # 预录缓存从关键帧开始，超出时长的 GOP 整个丢弃
+        assert ring.snapshot()[0].is_keyframe and ring.seconds <= recording.PREROLL_SECONDS
+        preroll = len(ring)
+
+        events.publish(RECORD_TRIGGER, {"source": "test", "action": "start"})
+        await asyncio.sleep(0.5)
+        assert await asyncio.to_thread(service.writer.flush) and slot["bWriting"]
+        events.publish(RECORD_TRIGGER, {"source": "test", "action": "stop"})
+        # 解除后在下一个关键帧结束文件
+        for _ in range(40):
+            if not service.streams[0].clip:
+                break
+            await asyncio.sleep(0.05)
+        assert await asyncio.to_thread(service.writer.flush)
+        assert not slot["bWriting"]
+        service.stop(wait=True)
+        assert not stream.running
+        return preroll
+
+    preroll = asyncio.run(scenario())
+    files = list(tmp_path.glob("DCIM/*/* video0.mp4"))
+    assert len(files) == 1
+    with av.open(str(files[0])) as container:
+        frames = list(container.decode(video=0))
+    assert len(frames) > preroll and (frames[0].width, frames[0].height) == (64, 48)
+
+
+def test_recorder_follows_the_pipeline_when_a_mask_is_enabled(clip: str, tmp_path, monkeypatch) -> None:
+    reset_state()
+    slot = state.storage_status["lSlots"][0]
+    slot["sMountPath"] = str(tmp_path)
+    state.schedule_rule_config = []
+    bump_revision("schedule")
+    state.webrtc_config["iPrewarm"] = 0
+    monkeypatch.setattr(video, "VIDEO_PATHS", {0: clip})
+    monkeypatch.setattr(record_api, "VIDEO_PATHS", {0: clip})
+    service = recording.Recorder()
+    monkeypatch.setattr(video, "recorder", service)
+    monkeypatch.setattr(record_api, "recorder", service)
+
+    async def scenario() -> None:
+        record_api._apply_recorder(state.rule_config)
+        try:
+            passthrough = service.streams[0]._track.stream
+            assert isinstance(passthrough, PassthroughStream)
+            events.publish(RECORD_TRIGGER, {"source": "test", "action": "start"})
+            await asyncio.sleep(0.5)
+            assert service.streams[0].clip is not None
+
+            # 启用遮挡后录制离开直通码流，原始画面不再写入存储卡
+            config = dict(state.osd_config, maskOverlay={"iEnabled": 1, "privacyMask": [
+                {"id": 0, "iPositionX": 0.0, "iPositionY": 0.0, "iMaskWidth": 0.5, "iMaskHeight": 0.5},
+            ]})
+            await video.update_osd_config(OSDConfig(**config), "admin")
+            assert isinstance(service.streams[0]._track.stream, EncodedStream)
+            assert not passthrough.running and passthrough.subscriber_count == 0
+            # 录制没有中断，新文件从共享编码的关键帧开始
+            await asyncio.sleep(1.0)
+            assert service.streams[0].clip is not None and service.streams[0].clip.packets > 0
+        finally:
+            service.stop(wait=True)
+
+    asyncio.run(scenario())
+    files = sorted(tmp_path.glob("DCIM/*/*.mp4"))
+    assert len(files) == 2
+    for path in files:
+        with av.open(str(path)) as container:
+            assert next(container.decode(video=0)).key_frame
+    reset_state()
+
+
+def test_file_tree_lists_children_newest_first_and_removes_subtrees() -> None:
+    tree = FileTree()
+    tree["DCIM/2025-10-17"] = {"name": "2025-10-17", "type": "directory", "mtime": "Fri, 17 Oct 2025 09:00:00 GMT"}
+    tree["DCIM/2025-10-18"] = {"name": "2025-10-18", "type": "directory", "mtime": "Sat, 18 Oct 2025 09:00:00 GMT"}
+    for name, clock in [("b.mp4", "10:30:00"), ("a.mp4", "11:00:00"), ("c.jpg", "09:15:00")]:
+        tree[f"DCIM/2025-10-18/{name}"] = {"name": name, "type": "file", "mtime": f"Sat, 18 Oct 2025 {clock} GMT"}
+    assert [entry["name"] for entry in tree.list("DCIM")] == ["2025-10-18", "2025-10-17"]
+    assert [entry["name"] for entry in tree.list("DCIM/2025-10-18")] == ["a.mp4", "b.mp4", "c.jpg"]
+    # 重新赋值会更新排序位置，其余操作与原来的路径字典一致
+    tree["DCIM/2025-10-18/c.jpg"] = {"name": "c.jpg", "type": "file", "mtime": "Sat, 18 Oct 2025 12:00:00 GMT"}
+    assert tree.list("DCIM/2025-10-18")[0]["name"] == "c.jpg"
+    assert len(tree) == 5 and "DCIM/2025-10-18/a.mp4" in tree and "DCIM/missing" not in tree
+    assert sorted(tree) == ["DCIM/2025-10-17", "DCIM/2025-10-18", "DCIM/2025-10-18/a.mp4",
+                            "DCIM/2025-10-18/b.mp4", "DCIM/2025-10-18/c.jpg"]
+
+    assert tree.remove_tree("DCIM/2025-10-18") and len(tree) == 1
+    assert tree.list("DCIM/2025-10-18") == [] and not tree.remove_tree("DCIM/2025-10-18")
+
+
+def test_clip_paths_are_reserved_before_the_file_exists(tmp_path) -> None:
+    slot = {"sMountPath": str(tmp_path)}
+    reserved = set()
+    # 同一秒内连续触发的截图，写入线程还没创建文件时也分到不同的文件名
+    first, second = (recording.clip_path(slot, 0, recording.FORMAT_JPG, 1760000000, reserved) for _ in range(2))
+    assert first != second and second.name.endswith("image0 (1).jpg")
+    assert reserved == {first, second} and not first.exists()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import video
+from app.state import reset_state, state
+
+
+@pytest.fixture
+def limits():
+    reset_state()
+    state.webrtc_config.update({"iMaxPeers": 3, "iMaxPeersPerStream": 2, "sOverloadPolicy": "downgrade"})
+    yield
+    video.sessions.clear()
+    reset_state()
+
+
+def _connect(stream_id: int) -> None:
+    video.sessions[object()] = SimpleNamespace(stream_id=stream_id)
+
+
+def test_admission_downgrades_then_rejects(limits) -> None:
+    _connect(0)
+    _connect(0)
+    # 主码流已满，降级到子码流
+    assert video._admit(0) == 1
+    _connect(1)
+    # 总连接数已满
+    with pytest.raises(HTTPException) as error:
+        video._admit(1)
+    assert error.value.status_code == 503
+
+
+def test_admission_rejects_when_policy_is_reject(limits) -> None:
+    state.webrtc_config["sOverloadPolicy"] = "reject"
+    _connect(0)
+    _connect(0)
+    with pytest.raises(HTTPException):
+        video._admit(0)
+    assert video._admit(1) == 1
+
+
+def test_webrtc_status_keeps_the_original_top_level_keys(limits) -> None:
+    status = asyncio.run(video.webrtc_status("admin"))
+    # 原有客户端读取的主码流字段保留，每路码流的详细信息在 streams 中
+    assert status["video_path"] == video.MAIN_VIDEO_PATH
+    assert status["video_exists"] == status["streams"]["0"]["video_exists"]
+    assert status["video_info"] == status["streams"]["0"]["video_info"]
+    assert set(status["first_packet"]) == set(status["streams"]) == {"0", "1"}